@@ -321,7 +321,8 @@ class WorkflowController(object):
                         workflow,
                         expiration_date=None,
                         name=None,
-                        queue=None):
+                        queue=None,
+                        reduce_dependencies=False):
         '''
         Submits a workflow and returns a workflow identifier.
 
@@ -342,6 +343,11 @@ class WorkflowController(object):
             Optional name of the queue where to submit jobs. If it is not
             specified the jobs will be submitted to the default queue.
 
+        reduce_dependencies: bool
+            If True, redundant dependencies are removed from the workflow
+            before it is submitted (see :meth:`Workflow.reduce_dependencies`).
+            The workflow object is modified.
+
         Returns
         -------
         Workflow_identifier: int
@@ -355,6 +361,11 @@ class WorkflowController(object):
                 "Use soma_workflow.MPI_workflow_runner to submit a workflow "
                 "using the MPI scheduler.")
 
+        if reduce_dependencies:
+            removed = workflow.reduce_dependencies()
+            logging.info('%d redundant dependencies removed from the workflow'
+                         % removed)
+
         # cProfile.runctx("wf_id = self._engine_proxy.submit_workflow(workflow,
         # expiration_date, name, queue)", globals(), locals(),
         # "/home/soizic/profile/profile_submit_workflow")
@@ -593,6 +604,59 @@ class WorkflowController(object):
         '''
         return self._engine_proxy.job_termination_status(job_id)
 
+    def workflow_resource_usage(self, workflow_id):
+        '''
+        Resource usage of the ended jobs of a workflow, aggregated from their
+        resource usage information (see :meth:`job_termination_status`).
+        The information available depends on the scheduler: jobs run by the
+        local scheduler report their CPU time, memory and I/O.
+
+        Parameters
+        ----------
+        workflow_id: workflow identifier
+
+        Returns
+        -------
+        usage: dict
+            * jobs: number of jobs with resource usage information
+            * cpu_time: total CPU time, in seconds
+            * walltime: sum of the jobs execution times, in seconds
+            * cpu_percent: mean CPU usage of the jobs
+            * max_memory: maximum memory used by a job, in bytes
+            * max_memory_job: id of the job using max_memory
+            * inblock, oublock: total number of file system inputs and
+              outputs
+
+            Values which no job has reported are None.
+
+        Raises *UnknownObjectError* if the workflow_id is not valid
+        '''
+        return self._engine_proxy.workflow_resource_usage(workflow_id)
+
+    def scheduler_stats(self):
+        '''
+        Current state of the scheduler used by the engine.
+
+        Returns
+        -------
+        stats: dict or None
+            None if the scheduler does not provide it. The local scheduler
+            provides:
+
+            * allocated_cpus: number of CPUs used by the running jobs
+            * max_cpus: maximum number of CPUs which may be used
+            * running_jobs: number of running jobs
+            * queued_jobs: number of jobs waiting for resources
+            * oldest_wait: time the oldest queued job has been waiting, in
+              seconds, or None if the queue is empty
+            * dispatched_jobs: number of jobs started since the scheduler
+              has been created
+            * dispatch_latency: mean time the last 100 started jobs have
+              waited for resources, in seconds, or None
+            * max_dispatch_latency: maximum of these times, or None
+        '''
+        return self._engine_proxy.scheduler_stats()
+
     def retrieve_job_stdouterr(self,
                                job_id,
                                stdout_file_path,
@@ -835,6 +899,16 @@ class WorkflowController(object):
              if element[3][0] != constants.EXIT_NOTRUN])
         if len(failed_jobs) != 0:
             # failure
+            aborted_ids = [element[0] for element in failed_jobs
+                           if element[3][0] == constants.EXIT_NOTRUN]
+            cancelled = {}
+            if aborted_ids:
+                # jobs which have not run because of each failed job
+                workflow = self.workflow(workflow_id)
+                cancelled = workflow.cancelled_jobs(
+                    [element[0] for element in failed_jobs
+                     if element[3][0] != constants.EXIT_NOTRUN],
+                    aborted_ids)
             print('** Jobs failure, the following jobs ended with failed '
                   'status:', file=file)
             for element in failed_jobs:
@@ -847,6 +921,13 @@ class WorkflowController(object):
                           file=file)
                     print('  commandline:', file=file)
                     print(job[1], file=file)
+                    cancelled_ids = cancelled.get(element[0])
+                    if cancelled_ids:
+                        print('  downstream jobs not run because of this '
+                              'failure (%d):' % len(cancelled_ids), file=file)
+                        print('  ' + ', '.join(
+                            [workflow.registered_jobs[job_id].name
+                             for job_id in cancelled_ids]), file=file)
             print('\n** Failed jobs outputs:\n', file=file)
             # log outputs
             for element in failed_jobs:
@@ -1277,7 +1358,9 @@ def _embedded_engine_and_server(config):
     # database server
     database_server = WorkflowDatabaseServer(config.get_database_file(),
                                              config.get_transfered_file_dir(),
-                                             remove_orphan_files=config.get_remove_orphan_files())
+                                             remove_orphan_files=config.get_remove_orphan_files(),
+                                             process_lock=config.get_embedded_database_server(),
+                                             journal_mode=config.get_database_journal_mode())
 
     sch = scheduler.build_scheduler(config.get_scheduler_type(), config)
     workflow_engine = ConfiguredWorkflowEngine(database_server,
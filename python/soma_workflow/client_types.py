@@ -21,6 +21,7 @@ from __future__ import absolute_import
 import warnings
 import sys
 import soma_workflow.constants as constants
+from soma_workflow.errors import WorkflowError
 import re
 import importlib
 
@@ -178,6 +179,22 @@ class Job(object):
         Path to the file which will be written for output parameters of the
         job.
 
+    duration_hint: float
+        New in 3.1.
+        Expected duration of the job, in seconds. When the engine computes
+        critical path priorities (configuration item:
+        CRITICAL_PATH_PRIORITIES) it is used instead of the durations of the
+        previous runs of jobs with the same name. The local scheduler also
+        uses it to run smaller jobs while a parallel job waits for CPUs
+        (backfilling).
+
+    memory_requirement: float
+        New in 3.1.
+        Memory needed by the job, in megabytes. The local scheduler does not
+        start the job until this memory is available within its memory budget
+        (scheduler configuration item: MAX_MEMORY). Other schedulers ignore
+        it: use native_specification to pass it to a DRMS.
+
     disposal_timeout: int
         Only requiered outside of a workflow
     '''
@@ -248,6 +265,17 @@ class Job(object):
     # dict (config options)
     configuration = {}
 
+    # float (seconds) or None
+    duration_hint = None
+
+    # float (megabytes) or None
+    memory_requirement = None
+
+    # values set by the constructor which differ from the class attributes
+    # (used by from_dict())
+    _init_defaults = {'join_stderrout': False, 'disposal_timeout': 168,
+                      'priority': 0}
+
     def __init__(self,
                  command,
                  referenced_input_files=None,
@@ -269,7 +297,9 @@ class Job(object):
                  has_outputs=False,
                  input_params_file=None,
                  output_params_file=None,
-                 configuration={}):
+                 configuration={},
+                 duration_hint=None,
+                 memory_requirement=None):
         if not name and len(command) != 0:
             self.name = command[0]
         else:
@@ -299,6 +329,8 @@ class Job(object):
         self.input_params_file = input_params_file
         self.output_params_file = output_params_file
         self.configuration = configuration
+        self.duration_hint = duration_hint
+        self.memory_requirement = memory_requirement
 
         # this deson't seem to be really hamful.
         # for command_elem in self.command:
@@ -414,6 +446,8 @@ class Job(object):
             "input_params_file",
             "output_params_file",
             "configuration",
+            "duration_hint",
+            "memory_requirement",
         ]
         for attr_name in attributes:
             attr = getattr(self, attr_name)
@@ -438,10 +472,25 @@ class Job(object):
          * tmp_from_ids *id -> TemporaryPath*
          * opt_from_ids *id -> OptionPath*
         '''
-        job = cls(command=d["command"],
-                  configuration=d.get("configuration", {}))
-        for key, value in six.iteritems(d):
-            setattr(job, key, value)
+        if cls.__init__ is Job.__init__:
+            # no specific constructor: set the attributes directly, which is
+            # much faster for large workflows
+            job = cls.__new__(cls)
+            job.__dict__.update(d)
+            if 'name' not in d:
+                job.name = d["command"][0] if d["command"] else None
+            for key, value in six.iteritems(cls._init_defaults):
+                if key not in d:
+                    setattr(job, key, value)
+            if not job.referenced_input_files:
+                job.referenced_input_files = []
+            if not job.referenced_output_files:
+                job.referenced_output_files = []
+        else:
+            job = cls(command=d["command"],
+                      configuration=d.get("configuration", {}))
+            for key, value in six.iteritems(d):
+                setattr(job, key, value)
 
         new_command = list_from_serializable(job.command,
                                              tr_from_ids,
@@ -534,6 +583,8 @@ class Job(object):
             "has_outputs",
             "configuration",
             "uuid",
+            "duration_hint",
+            "memory_requirement",
         ]
 
         job_dict["class"] = '%s.%s' % (self.__class__.__module__,
@@ -647,7 +698,7 @@ class Job(object):
             return state_dict
         copied = False
         for attribute in no_picke:
-            if hasattr(self, attribute):
+            if attribute in state_dict:
                 if not copied:
                     state_dict = dict(state_dict)
                     copied = True
@@ -924,6 +975,10 @@ class Workflow(object):
 
     param_links = {}
 
+    # barrier jobs (input hub, output hub) replacing each group used in
+    # dependencies. dict: Group -> (BarrierJob, BarrierJob)
+    _group_to_hub = None
+
     def __init__(self,
                  jobs,
                  dependencies=None,
@@ -1123,9 +1178,17 @@ class Workflow(object):
             and self.env_builder_code == other.env_builder_code \
             and self.param_links == other.param_links
 
-    def to_dict(self):
+    def to_dict(self, id_maps=None):
         '''
         The keys must be string to serialize with JSON.
+
+        Parameters
+        ----------
+        id_maps: dict (optional)
+            if specified, it is filled with the dictionaries mapping the
+            workflow elements to their identifiers in the serialized
+            workflow: keys are "jobs", "groups", "file_transfers",
+            "shared_res_paths", "temporary_paths" and "option_paths".
         '''
         id_generator = IdGenerator()
         job_ids = {}  # Job -> id
@@ -1233,10 +1296,29 @@ class Workflow(object):
         if hasattr(self, 'uuid'):
             wf_dict['uuid'] = self.uuid
 
+        if id_maps is not None:
+            id_maps.update({'jobs': job_ids,
+                            'groups': group_ids,
+                            'file_transfers': transfer_ids,
+                            'shared_res_paths': shared_res_path_ids,
+                            'temporary_paths': temporary_ids,
+                            'option_paths': option_ids})
+
         return wf_dict
 
     @classmethod
-    def from_dict(cls, d):
+    def from_dict(cls, d, id_maps=None):
+        '''
+        Build a workflow from its dict representation (see to_dict()).
+
+        Parameters
+        ----------
+        d: dict
+        id_maps: dict (optional)
+            if specified, it is filled with the dictionaries mapping the
+            identifiers in the serialized workflow to the built elements (see
+            to_dict()).
+        '''
         name = d.get("name", None)
 
         # shared resource paths
@@ -1271,14 +1353,18 @@ class Workflow(object):
         # jobs
         serialized_jobs = d.get("serialized_jobs", {})
         job_from_ids = {}
+        job_classes = {}
         for job_id, job_d in six.iteritems(serialized_jobs):
             cls_name = job_d.get("class", "soma_workflow.client_types.Job")
-            cls_mod = cls_name.rsplit('.', 1)
-            if len(cls_mod) == 1:
-                jcls = sys.modules[__name__].__dict__[cls_name]
-            else:
-                module = importlib.import_module(cls_mod[0])
-                jcls = getattr(module, cls_mod[1])
+            jcls = job_classes.get(cls_name)
+            if jcls is None:
+                cls_mod = cls_name.rsplit('.', 1)
+                if len(cls_mod) == 1:
+                    jcls = sys.modules[__name__].__dict__[cls_name]
+                else:
+                    module = importlib.import_module(cls_mod[0])
+                    jcls = getattr(module, cls_mod[1])
+                job_classes[cls_name] = jcls
             job = jcls.from_dict(job_d, tr_from_ids, srp_from_ids,
                                  tmp_from_ids, opt_from_ids)
             job_from_ids[int(job_id)] = job
@@ -1358,8 +1444,112 @@ class Workflow(object):
                        env_builder_code=env_builder_code,
                        param_links=param_links)
 
+        if id_maps is not None:
+            id_maps.update({'jobs': job_from_ids,
+                            'groups': group_from_ids,
+                            'file_transfers': tr_from_ids,
+                            'shared_res_paths': srp_from_ids,
+                            'temporary_paths': tmp_from_ids,
+                            'option_paths': opt_from_ids})
+
         return workflow
 
+    def reduce_dependencies(self):
+        '''
+        Remove redundant dependencies: a dependency (job_a, job_c) is
+        redundant if job_c already depends on job_a through other jobs, for
+        instance if the workflow also has the dependencies (job_a, job_b) and
+        (job_b, job_c). Duplicate dependencies are also removed. Barrier jobs
+        replacing groups are handled as other jobs.
+
+        The remaining dependencies are the transitive reduction of the jobs
+        graph: the jobs are run in the same order, but there are less
+        dependencies to store in the database and to check by the engine.
+
+        Returns
+        -------
+        removed: int
+            number of removed dependencies
+
+        Raises
+        ------
+        WorkflowError
+            if the dependencies contain a cycle
+        '''
+        if type(self.dependencies) not in (list, tuple, set):
+            raise TypeError('Unsupported dependencies type: %s'
+                            % repr(type(self.dependencies)))
+        children = {}
+        in_degree = {}
+        for j1, j2 in self.dependencies:
+            job_children = children.setdefault(j1, set())
+            if j2 not in job_children:
+                job_children.add(j2)
+                in_degree[j2] = in_degree.get(j2, 0) + 1
+            children.setdefault(j2, set())
+            in_degree.setdefault(j1, 0)
+        # topological sort
+        order = [job for job, degree in six.iteritems(in_degree)
+                 if degree == 0]
+        i = 0
+        while i < len(order):
+            for child in children[order[i]]:
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    order.append(child)
+            i += 1
+        if len(order) != len(children):
+            cycle_jobs = [job for job, degree in six.iteritems(in_degree)
+                          if degree != 0]
+            raise WorkflowError(
+                'The workflow dependencies contain a cycle, involving %d '
+                'jobs, including: %s'
+                % (len(cycle_jobs),
+                   ', '.join([repr(job.name) for job in cycle_jobs[:10]])))
+        # reachability sets, as bits of integers indexed by topological
+        # order. They are built from the end of the order, and released once
+        # all the jobs depending on a job have used it.
+        index = dict([(job, i) for i, job in enumerate(order)])
+        parents_left = {}
+        for job_children in six.itervalues(children):
+            for child in job_children:
+                parents_left[child] = parents_left.get(child, 0) + 1
+        reachable = {}
+        redundant = []
+        for job in reversed(order):
+            reach = 0
+            # closest children first: a child reachable from another one
+            # comes after it in the topological order
+            for child in sorted(children[job], key=index.get):
+                bit = 1 << index[child]
+                if reach & bit:
+                    redundant.append((job, child))
+                else:
+                    reach |= bit | reachable[child]
+                parents_left[child] -= 1
+                if parents_left[child] == 0:
+                    del reachable[child]
+            if parents_left.get(job, 0) != 0:
+                reachable[job] = reach
+        redundant = set(redundant)
+        ndeps = len(self.dependencies)
+        if type(self.dependencies) is set:
+            self.dependencies.difference_update(redundant)
+        else:
+            # keep the first occurrence of each non-redundant dependency
+            kept_deps = set()
+            deps = []
+            for dependency in self.dependencies:
+                if dependency not in redundant \
+                        and dependency not in kept_deps:
+                    kept_deps.add(dependency)
+                    deps.append(dependency)
+            if type(self.dependencies) is list:
+                self.dependencies[:] = deps
+            else:
+                self.dependencies = deps
+        return ndeps - len(self.dependencies)
+
     def __getstate__(self):
         # filter out some instance attributes which should / can not be pickled
         no_picke = getattr(self, '_do_not_pickle', None)
@@ -1368,18 +1558,20 @@ class Workflow(object):
             return state_dict
         copied = False
         for attribute in no_picke:
-            if hasattr(self, attribute):
+            if attribute in state_dict:
                 if not copied:
                     state_dict = dict(state_dict)
                     copied = True
                 del state_dict[attribute]
         return state_dict
 
-    def __group_hubs(self, group, group_to_hub):
+    def __group_hubs(self, group, group_to_hub, new_groups):
         '''
         Replace a group with a BarrierJob pair for inputs and ouputs).
         All jobs inside the group depends on its input hub, and the output hub
-        depends on all jobs in the group
+        depends on all jobs in the group.
+        The hubs of a group are only created once: groups for which hubs are
+        created are appended to new_groups.
         '''
         ghubs = group_to_hub.get(group, None)
         if ghubs is not None:
@@ -1387,6 +1579,7 @@ class Workflow(object):
         ghubs = (BarrierJob(name=group.name + '_input'),
                  BarrierJob(name=group.name + '_output'))
         group_to_hub[group] = ghubs
+        new_groups.append(group)
         if type(self.jobs) is list:
             self.jobs += [ghubs[0], ghubs[1]]
         elif type(self.jobs) is set:
@@ -1398,20 +1591,24 @@ class Workflow(object):
                             % repr(type(self.jobs)))
         return ghubs
 
-    def __group_hubs_recurs(self, group, group_to_hub):
+    def __group_hubs_recurs(self, group, group_to_hub, new_groups):
         '''
         Replace a group with a BarrierJob pair for inputs and ouputs).
         Same as __group_hubs() but also create hubs for sub-groups in group
         '''
+        if group in group_to_hub:
+            # sub-groups hubs have been created at the same time
+            return group_to_hub[group]
+        ghubs = self.__group_hubs(group, group_to_hub, new_groups)
         groups = [group]
-        ghubs = None
-        while groups:
-            group = groups.pop(0)
-            ghubs_tmp = self.__group_hubs(group, group_to_hub)
-            if ghubs is None:
-                ghubs = ghubs_tmp
-            groups += [element for element in group.elements
-                       if isinstance(element, Group)]
+        i = 0
+        while i < len(groups):
+            for element in groups[i].elements:
+                if isinstance(element, Group) \
+                        and element not in group_to_hub:
+                    self.__group_hubs(element, group_to_hub, new_groups)
+                    groups.append(element)
+            i += 1
         return ghubs
 
     def __make_group_hubs_deps(self, group, group_to_hub):
@@ -1419,10 +1616,10 @@ class Workflow(object):
         Build and return intra-group dependencies list
         '''
         dependencies = []
-        in_hub, out_hub = self.__group_hubs(group, group_to_hub)
+        in_hub, out_hub = group_to_hub[group]
         for item in group.elements:
             if isinstance(item, Group):  # depends on a sub-group
-                sub_hub = self.__group_hubs(item, group_to_hub)
+                sub_hub = group_to_hub[item]
                 # TODO: check that these dependencies are not already here
                 # (directly or indirectly)
                 dependencies.append((in_hub, sub_hub[0]))
@@ -1436,7 +1633,13 @@ class Workflow(object):
 
     def __convert_group_dependencies(self, dependencies=None):
         '''
-        Converts dependencies using groups into barrier jobs when needed
+        Converts dependencies using groups into barrier jobs when needed.
+
+        Each group gets a single pair of barrier jobs, whatever the number of
+        dependencies (and of calls) it is used in, and each resulting
+        dependency is only added once. The conversion takes a time linear in
+        the number of dependencies and groups elements, and converting again
+        does not change anything.
 
         Parameters
         ----------
@@ -1446,57 +1649,56 @@ class Workflow(object):
             a subset of the workflow dependencies (all must exist in
             self.dependencies)
         '''
-        new_deps_list = []
-        group_to_hub = {}
-        deps_to_remove = []
+        if type(self.dependencies) not in (list, tuple, set):
+            raise TypeError('Unsupported dependencies type: %s'
+                            % repr(type(self.dependencies)))
         if dependencies is None:
             dependencies = self.dependencies
-            reindex = False
-        else:
-            reindex = True
-        for index, dependency in enumerate(dependencies):
-            j1, j2 = dependency
-            if not isinstance(j1, Group) and not isinstance(j2, Group):
-                continue
-            if type(self.dependencies) in (list, tuple):
-                if reindex:
-                    index = self.dependencies.index(dependency)
-                deps_to_remove.insert(0, index)  # reverse order index list
-            else:
-                deps_to_remove.append(dependency)
+        group_deps = [dependency for dependency in dependencies
+                      if isinstance(dependency[0], Group)
+                      or isinstance(dependency[1], Group)]
+        if not group_deps:
+            return
+        if self._group_to_hub is None:
+            self._group_to_hub = {}
+        group_to_hub = self._group_to_hub
+        new_groups = []
+        new_deps_list = []
+        for j1, j2 in group_deps:
             if isinstance(j1, Group):
                 # a group is replaced with a BarrierJob pair for inputs and
                 # ouputs)
-                ghubs = self.__group_hubs_recurs(j1, group_to_hub)
+                ghubs = self.__group_hubs_recurs(j1, group_to_hub, new_groups)
                 j1 = ghubs[1]  # replace input group with the group ouput hub
             if isinstance(j2, Group):
                 # a group is replaced with a BarrierJob pair for inputs and
                 # ouputs)
-                ghubs = self.__group_hubs_recurs(j2, group_to_hub)
+                ghubs = self.__group_hubs_recurs(j2, group_to_hub, new_groups)
                 j2 = ghubs[0]  # replace output group with the group input hub
             new_deps_list.append((j1, j2))
-        # rebuild intra-group links
-        for group, ghubs in six.iteritems(group_to_hub):
+        # build intra-group links of the new hubs
+        for group in new_groups:
             new_deps_list += self.__make_group_hubs_deps(group, group_to_hub)
+        # remove converted dependencies
         if type(self.dependencies) is set:
-            self.dependencies.difference_update(deps_to_remove)
-            self.dependencies.update(new_deps_list)
-        elif type(self.dependencies) is list:
-            # remove converted dependencies
-            for index in deps_to_remove:
-                del self.dependencies[index]
-            # add new ones
-            self.dependencies += new_deps_list
-        elif type(self.dependencies) is tuple:
-            self.dependencies = list(self.dependencies)
-            # remove converted dependencies
-            for index in deps_to_remove:
-                del self.dependencies[index]
-            # add new ones
-            self.dependencies += new_deps_list
+            self.dependencies.difference_update(group_deps)
+            current_deps = self.dependencies
         else:
-            raise TypeError('Unsupported dependencies type: %s'
-                            % repr(type(self.dependencies)))
+            converted = set(group_deps)
+            kept_deps = [dependency for dependency in self.dependencies
+                         if dependency not in converted]
+            if type(self.dependencies) is list:
+                # keep the same list object
+                self.dependencies[:] = kept_deps
+            else:
+                self.dependencies = kept_deps
+            current_deps = set(kept_deps)
+        # add new ones, only once
+        for dependency in new_deps_list:
+            if dependency not in current_deps:
+                current_deps.add(dependency)
+                if type(self.dependencies) is list:
+                    self.dependencies.append(dependency)
 
 
 class Group(object):
@@ -2417,10 +2619,12 @@ def list_from_serializable(list_to_convert,
                            opt_from_ids):
     us_list = []
     for element in list_to_convert:
-        us_element = from_serializable(element,
-                                       tr_from_ids,
-                                       srp_from_ids,
-                                       tmp_from_ids,
-                                       opt_from_ids)
-        us_list.append(us_element)
+        # other elements are left unchanged by from_serializable()
+        if isinstance(element, (list, tuple)):
+            element = from_serializable(element,
+                                        tr_from_ids,
+                                        srp_from_ids,
+                                        tmp_from_ids,
+                                        opt_from_ids)
+        us_list.append(element)
     return us_list
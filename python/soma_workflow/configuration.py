@@ -75,6 +75,14 @@ OCFG_MAX_JOB_IN_QUEUE = 'MAX_JOB_IN_QUEUE'
 # running or in the queue for one user. The engine won't submit more than
 # N jobs at once.
 OCFG_MAX_JOB_RUNNING = 'MAX_JOB_RUNNING'
+# OCFG_FAIR_SHARE: when set (to 1), the jobs which may be submitted to the
+# queues limited by MAX_JOB_IN_QUEUE or MAX_JOB_RUNNING are taken in turn from
+# each workflow, instead of by priority order.
+OCFG_FAIR_SHARE = 'FAIR_SHARE'
+# OCFG_CRITICAL_PATH_PRIORITIES: when set (to 1), the engine computes the
+# critical path of each job of the submitted workflows, and runs first the
+# jobs with the longest critical path among the jobs of the same priority.
+OCFG_CRITICAL_PATH_PRIORITIES = 'CRITICAL_PATH_PRIORITIES'
 
 # database server
 CFG_DATABASE_FILE = 'DATABASE_FILE'
@@ -87,6 +95,16 @@ CFG_SERVER_NAME = 'SERVER_NAME'
 # large number of files exist in the transfered files directory.
 OCFG_REMOVE_ORPHAN_FILES = 'REMOVE_ORPHAN_FILES'
 OCFG_SERVER_LOG_FILE = 'SERVER_LOG_FILE'
+# OCFG_EMBEDDED_DATABASE_SERVER: when set (to 1), the workflow engine process
+# (local or remote server modes) hosts the database server itself and calls
+# it directly instead of going through a separate database server process.
+# Several engines using the same database file are synchronized using a lock
+# file next to the database file.
+OCFG_EMBEDDED_DATABASE_SERVER = 'EMBEDDED_DATABASE_SERVER'
+# OCFG_DATABASE_JOURNAL_MODE: SQLite journal mode of the database: TRUNCATE
+# (default) or WAL. In WAL mode, status reads run concurrently with the
+# engine writes.
+OCFG_DATABASE_JOURNAL_MODE = 'DATABASE_JOURNAL_MODE'
 OCFG_SERVER_LOG_LEVEL = 'SERVER_LOG_LEVEL'
 OCFG_SERVER_LOG_FORMAT = 'SERVER_LOG_FORMAT'
 
@@ -142,6 +160,7 @@ OCFG_ALLOWED_PYTHON_VERSIONS = 'ALLOWED_PYTHON_VERSIONS'
 OCFG_SCDL_CPU_NB = "CPU_NB"
 OCFG_SCDL_MAX_CPU_NB = "MAX_CPU_NB"
 OCFG_SCDL_INTERVAL = "SCHEDULER_INTERVAL"
+OCFG_SCDL_MAX_MEMORY = "MAX_MEMORY"
 OCFG_SWF_DIR = "SOMA_WORKFLOW_DIR"
 
 
@@ -194,6 +213,14 @@ class Configuration(observer.Observable):
 
     _remove_orphan_files = None
 
+    _embedded_database_server = None
+
+    _database_journal_mode = None
+
+    _fair_share = None
+
+    _critical_path_priorities = None
+
     parallel_job_config = None
 
     path_translation = None
@@ -816,6 +843,46 @@ class Configuration(observer.Observable):
 
         return self._remove_orphan_files
 
+    def get_embedded_database_server(self):
+        '''
+        config that tells if the workflow engine process should host the
+        database server itself, rather than connecting to a separate database
+        server process.
+        '''
+        if self._embedded_database_server is not None:
+            return self._embedded_database_server
+
+        if self._config_parser is None or \
+            not self._config_parser.has_option(self._resource_id,
+                                               OCFG_EMBEDDED_DATABASE_SERVER):
+            return False
+
+        self._embedded_database_server = self._config_parser.get(
+            self._resource_id, OCFG_EMBEDDED_DATABASE_SERVER)
+        self._embedded_database_server = bool(int(os.path.expandvars(
+            self._embedded_database_server)))
+
+        return self._embedded_database_server
+
+    def get_database_journal_mode(self):
+        '''
+        SQLite journal mode used by the database server: "TRUNCATE"
+        (default) or "WAL".
+        '''
+        if self._database_journal_mode is not None:
+            return self._database_journal_mode
+
+        if self._config_parser is None or \
+            not self._config_parser.has_option(self._resource_id,
+                                               OCFG_DATABASE_JOURNAL_MODE):
+            return 'TRUNCATE'
+
+        self._database_journal_mode = os.path.expandvars(
+            self._config_parser.get(self._resource_id,
+                                    OCFG_DATABASE_JOURNAL_MODE)).upper()
+
+        return self._database_journal_mode
+
     def get_parallel_job_config(self):
         if self._config_parser == None or self.parallel_job_config != None:
             return self.parallel_job_config
@@ -997,6 +1064,43 @@ class Configuration(observer.Observable):
 
         return self._running_jobs_limits
 
+    def get_fair_share(self):
+        '''
+        config that tells if the submission slots of the limited queues are
+        shared between workflows (see OCFG_FAIR_SHARE).
+        '''
+        if self._fair_share is not None:
+            return self._fair_share
+
+        if self._config_parser is None or \
+            not self._config_parser.has_option(self._resource_id,
+                                               OCFG_FAIR_SHARE):
+            return False
+
+        self._fair_share = bool(int(os.path.expandvars(
+            self._config_parser.get(self._resource_id, OCFG_FAIR_SHARE))))
+
+        return self._fair_share
+
+    def get_critical_path_priorities(self):
+        '''
+        config that tells if the engine computes critical path priorities for
+        the jobs of workflows (see OCFG_CRITICAL_PATH_PRIORITIES).
+        '''
+        if self._critical_path_priorities is not None:
+            return self._critical_path_priorities
+
+        if self._config_parser is None or \
+            not self._config_parser.has_option(self._resource_id,
+                                               OCFG_CRITICAL_PATH_PRIORITIES):
+            return False
+
+        self._critical_path_priorities = bool(int(os.path.expandvars(
+            self._config_parser.get(self._resource_id,
+                                    OCFG_CRITICAL_PATH_PRIORITIES))))
+
+        return self._critical_path_priorities
+
     def get_queues(self):
         if self._config_parser == None or len(self._queues) != 0:
             return self._queues
@@ -1245,27 +1349,37 @@ class LocalSchedulerCfg(observer.Observable):
     # interval (second)
     _interval = None
 
+    # memory (megabytes) which running jobs may use. 0 means the physical
+    # memory of the machine.
+    _max_memory = None
+
     # path of the configuration file
     _config_path = None
 
     PROC_NB_CHANGED = 0
     INTERVAL_CHANGED = 1
     MAX_PROC_NB_CHANGED = 2
+    MAX_MEMORY_CHANGED = 3
 
     def __init__(self, proc_nb=default_cpu_number(), interval=1,
-                 max_proc_nb=0):
+                 max_proc_nb=0, max_memory=0):
         '''
         * proc_nb *int*
           Number of processus which can run in parallel
 
         * interval *int*
           Update interval in second
+
+        * max_memory *int*
+          Memory which running jobs may use, in megabytes. 0 means the
+          physical memory of the machine.
         '''
 
         super(LocalSchedulerCfg, self).__init__()
         self._proc_nb = proc_nb
         self._max_proc_nb = max_proc_nb
         self._interval = interval
+        self._max_memory = max_memory
 
     @classmethod
     def load_from_file(cls,
@@ -1304,6 +1418,7 @@ class LocalSchedulerCfg(observer.Observable):
         proc_nb = 0
         max_proc_nb = 0
         interval = None
+        max_memory = 0
 
         if config_parser.has_option(hostname,
                                     OCFG_SCDL_CPU_NB):
@@ -1320,9 +1435,14 @@ class LocalSchedulerCfg(observer.Observable):
             max_proc_nb_str = config_parser.get(socket.gethostname(),
                                                 OCFG_SCDL_MAX_CPU_NB)
             max_proc_nb = int(max_proc_nb_str)
+        if config_parser.has_option(hostname,
+                                    OCFG_SCDL_MAX_MEMORY):
+            max_memory_str = config_parser.get(hostname,
+                                               OCFG_SCDL_MAX_MEMORY)
+            max_memory = int(max_memory_str)
 
         config = cls(proc_nb=proc_nb, interval=interval,
-                     max_proc_nb=max_proc_nb)
+                     max_proc_nb=max_proc_nb, max_memory=max_memory)
         config._config_path = config_path
         return config
 
@@ -1370,6 +1490,9 @@ class LocalSchedulerCfg(observer.Observable):
     def get_interval(self):
         return self._interval
 
+    def get_max_memory(self):
+        return self._max_memory
+
     def set_proc_nb(self, proc_nb):
         self._proc_nb = proc_nb
         self.notifyObservers(LocalSchedulerCfg.PROC_NB_CHANGED)
@@ -1382,6 +1505,10 @@ class LocalSchedulerCfg(observer.Observable):
         self._interval = interval
         self.notifyObservers(LocalSchedulerCfg.INTERVAL_CHANGED)
 
+    def set_max_memory(self, max_memory):
+        self._max_memory = max_memory
+        self.notifyObservers(LocalSchedulerCfg.MAX_MEMORY_CHANGED)
+
     def save_to_file(self, config_path=None):
         hostname = socket.gethostname()
         if not config_path:
@@ -1410,6 +1537,9 @@ class LocalSchedulerCfg(observer.Observable):
         config_parser.set(hostname,
                           OCFG_SCDL_MAX_CPU_NB,
                           str(self._max_proc_nb))
+        config_parser.set(hostname,
+                          OCFG_SCDL_MAX_MEMORY,
+                          str(self._max_memory))
         config_file = open(config_path, "w")
         config_parser.write(config_file)
         config_file.close()
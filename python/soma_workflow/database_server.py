@@ -33,6 +33,7 @@ from datetime import timedelta
 from datetime import datetime
 import socket
 import itertools
+import collections
 import io
 import traceback
 import math
@@ -41,10 +42,18 @@ import ctypes
 import ctypes.util
 import tempfile
 import json
+import zlib
+import gc
 import sys
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
 
 import soma_workflow.constants as constants
 from soma_workflow.client import FileTransfer, TemporaryPath
+from soma_workflow.engine_types import EngineWorkflow, EngineJob
 from soma_workflow.errors import UnknownObjectError, DatabaseError
 from soma_workflow.info import DB_VERSION, DB_PICKLE_PROTOCOL
 from soma_workflow import utils
@@ -302,9 +311,144 @@ def create_database(database_file):
 
     cursor.close()
     connection.commit()
+    # schema revisions after the initial schema
+    migrate_database(connection)
     connection.close()
 
 
+# Schema changes which keep the database compatible with the current
+# DB_VERSION (new indexes, new optional columns...) are applied as migrations
+# to existing databases, rather than requiring to create a new database.
+# The schema revision is stored in the database as its "PRAGMA user_version",
+# and each migration function brings the schema from revision i to i + 1.
+
+def _migration_add_indexes(cursor):
+    '''
+    Secondary indexes for the queries performed at each engine loop
+    iteration, or by clients polling statuses.
+    '''
+    for index, table, columns in (
+            # detailed workflow status, workflow deletion
+            ('jobs_workflow_id', 'jobs', 'workflow_id'),
+            # nb_jobs, jobs_to_delete_and_kill (covering: id is the rowid)
+            ('jobs_user_status_queue', 'jobs', 'user_id, status, queue'),
+            ('jobs_expiration_date', 'jobs', 'expiration_date'),
+            ('transfers_workflow_id', 'transfers', 'workflow_id'),
+            ('transfers_user_id', 'transfers', 'user_id'),
+            ('transfers_expiration_date', 'transfers', 'expiration_date'),
+            ('temporary_paths_workflow_id', 'temporary_paths',
+             'workflow_id'),
+            ('temporary_paths_user_id', 'temporary_paths', 'user_id'),
+            ('temporary_paths_expiration_date', 'temporary_paths',
+             'expiration_date'),
+            # ios(job_id) and ios_tmp(job_id) are the first columns of
+            # their primary keys, thus already indexed
+            ('ios_engine_file_id', 'ios', 'engine_file_id'),
+            ('ios_tmp_temp_path_id', 'ios_tmp', 'temp_path_id'),
+            ('workflows_user_status', 'workflows', 'user_id, status'),
+            ('workflows_expiration_date', 'workflows', 'expiration_date'),
+            # updated_job_parameters
+            ('param_links_dest_job_id', 'param_links', 'dest_job_id'),
+            ('param_links_workflow_id', 'param_links', 'workflow_id')):
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)'
+                       % (index, table, columns))
+
+
+DB_SCHEMA_MIGRATIONS = [_migration_add_indexes]
+
+DB_SCHEMA_REVISION = len(DB_SCHEMA_MIGRATIONS)
+
+
+def get_schema_revision(connection):
+    cursor = connection.cursor()
+    try:
+        return cursor.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def migrate_database(connection):
+    '''
+    Apply the schema migrations the database has not received yet, in a
+    single exclusive transaction.
+
+    Returns
+    -------
+    revisions: tuple
+        (schema revision before, schema revision after)
+    '''
+    cursor = connection.cursor()
+    try:
+        cursor.execute('BEGIN EXCLUSIVE')
+        # read within the transaction: another process may have migrated
+        # the database meanwhile
+        revision = cursor.execute('PRAGMA user_version').fetchone()[0]
+        for i in range(revision, DB_SCHEMA_REVISION):
+            DB_SCHEMA_MIGRATIONS[i](cursor)
+            cursor.execute('PRAGMA user_version = %d' % (i + 1))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    return (revision, max(revision, DB_SCHEMA_REVISION))
+
+
+def encode_engine_object(engine_object):
+    '''
+    Representation of an EngineWorkflow or EngineJob stored in the database
+    (pickled_engine_workflow and pickled_engine_job columns): its
+    to_database_dict() representation as compressed JSON (using
+    utils.to_json_dicts() to keep tuples and sets).
+
+    Objects which cannot be represented in JSON (because of values of other
+    types than the JSON ones in jobs parameters or in the workflow
+    user_storage, for instance) are pickled, as in older versions.
+    '''
+    engine_dict = utils.to_json_dicts(engine_object.to_database_dict())
+    try:
+        data = json.dumps(engine_dict, separators=(',', ':'))
+    except (TypeError, ValueError):
+        return sqlite3.Binary(pickle.dumps(engine_object,
+                                           protocol=DB_PICKLE_PROTOCOL))
+    return sqlite3.Binary(zlib.compress(data.encode('utf-8')))
+
+
+def decode_engine_object(data, engine_class):
+    '''
+    Build back an EngineWorkflow or EngineJob from its representation in the
+    database (see encode_engine_object()). Pickles stored by older versions
+    are still read.
+
+    Parameters
+    ----------
+    data: bytes
+    engine_class: EngineWorkflow or EngineJob
+    '''
+    try:
+        data = zlib.decompress(data)
+    except zlib.error:
+        if six.PY2:
+            return pickle.loads(data)
+        return pickle.loads(data, encoding='utf-8')
+    # a workflow is restored as a large number of long-lived objects:
+    # collections triggered while they are allocated would only traverse
+    # them over and over, so the cyclic collector is paused meanwhile.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        engine_dict = json.loads(data.decode('utf-8'),
+                                 object_hook=utils.from_json_dict)
+        if engine_dict.get('format') == 1:
+            # format 1 used utils.to_json()
+            engine_dict = utils.from_json(engine_dict)
+        return engine_class.from_database_dict(engine_dict)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
 # -- this is a copy of the find_library in soma-base soma.utils.find_library
 ctypes_find_library = ctypes.util.find_library
 
@@ -499,6 +643,187 @@ def print_tables(database_file):
     connection.close()
 
 
+class DatabaseFileLock(object):
+
+    '''
+    Re-entrant lock which serializes the database accesses of the threads of
+    the current process (like a threading.RLock), and of all the processes
+    using the same lock file.
+
+    When the database server runs as a separate process, it is the only
+    process accessing the database for a resource. When it is embedded in
+    several workflow engine processes, the lock file plays this role. The
+    inter-process lock (fcntl.flock) is only taken by the outermost
+    acquire() call of the process. On systems without fcntl, the lock only
+    works within the current process.
+    '''
+
+    def __init__(self, lock_file):
+        self._lock_file = lock_file
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                if self._fd is None:
+                    self._fd = os.open(self._lock_file,
+                                       os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except Exception:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        try:
+            if self._depth == 0 and self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.release()
+
+    def __del__(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class NullLock(object):
+
+    '''
+    Context manager which does not lock anything: replaces the database
+    server lock for read-only methods in WAL journal mode.
+    '''
+
+    def __enter__(self):
+        return True
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+
+class PooledConnection(sqlite3.Connection):
+
+    '''
+    sqlite3 connection which goes back to its ConnectionPool when it is
+    closed, instead of being actually closed. As when closing a connection,
+    uncommitted changes are discarded.
+    '''
+
+    pool = None
+    # (device, inode) of the database file when the connection was opened
+    file_id = None
+
+    def close(self):
+        pool = self.pool
+        if pool is None:
+            self.really_close()
+            return
+        try:
+            self.rollback()
+        except sqlite3.Error:
+            # broken connection: do not reuse it
+            self.really_close()
+            return
+        pool.release(self)
+
+    def really_close(self):
+        sqlite3.Connection.close(self)
+
+
+class ConnectionPool(object):
+
+    '''
+    Per-thread pool of persistent connections to a SQLite database file.
+
+    Opening a connection (and setting its journal mode) costs much more than
+    the short queries most database server methods perform. Pooled
+    connections are kept open, and so is their prepared statements cache
+    (see the cached_statements parameter of sqlite3.connect()): statements
+    are only compiled once per connection.
+
+    Connections are never shared between threads. Nested connect() calls in
+    the same thread get distinct connections, thus transactions remain
+    independent as with non-pooled connections.
+
+    If the database file is replaced (removed, or moved over by another
+    file), the pooled connections, which still point to the old file, are
+    discarded.
+
+    journal_mode is the SQLite journal mode set on new connections
+    ("TRUNCATE" or "WAL").
+    '''
+
+    def __init__(self, database_file, max_free_connections=4,
+                 cached_statements=256, journal_mode='TRUNCATE'):
+        self._database_file = database_file
+        self._journal_mode = journal_mode
+        self._max_free_connections = max_free_connections
+        self._cached_statements = cached_statements
+        self._local = threading.local()
+
+    def _free_connections(self):
+        free = getattr(self._local, 'free', None)
+        if free is None:
+            free = []
+            self._local.free = free
+        return free
+
+    def _file_id(self):
+        try:
+            stat = os.stat(self._database_file)
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino)
+
+    def connect(self):
+        free = self._free_connections()
+        file_id = self._file_id()
+        while free:
+            connection = free.pop()
+            if connection.file_id == file_id:
+                return connection
+            connection.really_close()
+        connection = sqlite3.connect(
+            self._database_file, timeout=10, isolation_level="EXCLUSIVE",
+            check_same_thread=False, factory=PooledConnection,
+            cached_statements=self._cached_statements)
+        try:
+            # set journal_mode to TRUNCATE mode (unless WAL is requested). On
+            # some systems / filesystems / python versions (3), using the
+            # default DELETE mode can cause some OperationalError : IO failure
+            # when commiting transactions.
+            cursor = connection.cursor()
+            cursor.execute("PRAGMA journal_mode = %s" % self._journal_mode)
+            cursor.close()
+        except Exception:
+            connection.really_close()
+            raise
+        connection.file_id = self._file_id()
+        connection.pool = self
+        return connection
+
+    def release(self, connection):
+        free = self._free_connections()
+        if any(c is connection for c in free):
+            # closed twice
+            return
+        if len(free) < self._max_free_connections:
+            free.append(connection)
+        else:
+            connection.really_close()
+
+
 class WorkflowDatabaseServer(object):
 
     def __init__(self,
@@ -506,7 +831,9 @@ class WorkflowDatabaseServer(object):
                  tmp_file_dir_path,
                  shared_tmp_dir=None,
                  logging_configuration=None,
-                 remove_orphan_files=True):
+                 remove_orphan_files=True,
+                 process_lock=False,
+                 journal_mode='TRUNCATE'):
         '''
         The constructor gets as parameter the database information.
 
@@ -515,6 +842,17 @@ class WorkflowDatabaseServer(object):
         @type  tmp_file_dir_path: string
         @param tmp_file_dir_path: place on the resource file system where
         the files will be transfered
+        @type  process_lock: bool
+        @param process_lock: if True, database accesses are also serialized
+        between processes using a lock file next to the database file (see
+        DatabaseFileLock). This is needed when the database server is
+        embedded in several workflow engine processes.
+        @type  journal_mode: string
+        @param journal_mode: SQLite journal mode: "TRUNCATE" (default) or
+        "WAL". In WAL mode, read-only methods do not take the server lock and
+        run concurrently with other reads and with writes, each on its own
+        connection. Writes remain serialized. WAL needs a local filesystem
+        (it does not work on NFS).
         '''
 
         # print('WorkflowDatabaseServer::__init__, remove orphan files:',
@@ -530,12 +868,26 @@ class WorkflowDatabaseServer(object):
         from soma_workflow.engine import EngineTemporaryPath
         EngineTemporaryPath.temporary_directory = self._shared_temp_dir
 
-        self._lock = threading.RLock()
+        if process_lock:
+            self._lock = DatabaseFileLock(database_file + '.lock')
+        else:
+            self._lock = threading.RLock()
+        journal_mode = journal_mode.upper()
+        if journal_mode not in ('TRUNCATE', 'WAL'):
+            raise ValueError('Unsupported database journal mode: %s'
+                             % journal_mode)
+        self._journal_mode = journal_mode
+        if journal_mode == 'WAL':
+            self._read_lock = NullLock()
+        else:
+            self._read_lock = self._lock
+        self._connection_pool = ConnectionPool(database_file,
+                                               journal_mode=journal_mode)
 
         self.logger = logging.getLogger('jobServer')
         self.logger.debug(
             "=> starting database server, within the constructor")
-        self._free_file_counters = []
+        self._free_file_counters = collections.deque()
 
         # For some reason logger does not work so we log using logging
         if logging_configuration:
@@ -601,6 +953,26 @@ class WorkflowDatabaseServer(object):
                                         str(database_file) + " \n"
                                         "  3. Clear the content of the directory: " + repr(tmp_file_dir_path))
 
+                cursor.close()
+                try:
+                    old_revision, revision = migrate_database(connection)
+                except Exception as e:
+                    six.reraise(DatabaseError,
+                                DatabaseError('Database schema migration '
+                                              'failed on %s: %s'
+                                              % (database_file, e)),
+                                sys.exc_info()[2])
+                finally:
+                    connection.close()
+                if old_revision != revision:
+                    self.logger.info('Database schema migrated from revision '
+                                     '%d to %d' % (old_revision, revision))
+                elif revision > DB_SCHEMA_REVISION:
+                    self.logger.warning(
+                        'The database schema revision (%d) is newer than the '
+                        'one of this version of Soma-Workflow (%d)'
+                        % (revision, DB_SCHEMA_REVISION))
+
     def __del__(self):
         # send VACUUM command ?
         pass
@@ -611,17 +983,20 @@ class WorkflowDatabaseServer(object):
             "Testing that the database_server is reachable as a remote object")
         return True
 
-    def _connect(self):
+    def _connect(self, read_only=False):
+        '''
+        Get a connection to the database from the connection pool. Closing
+        the connection gives it back to the pool.
+
+        Read-only methods, which use self._read_lock instead of self._lock,
+        should pass read_only=True: in WAL mode, their queries then run in a
+        single read transaction, and see a consistent snapshot of the
+        database even if writes happen concurrently.
+        '''
         try:
-            connection = sqlite3.connect(
-                self._database_file, timeout=10, isolation_level="EXCLUSIVE",
-                check_same_thread=False)
-            # set journal_mode to TRUNCATE mode. On some systems / filesystems
-            # / python versions (3), using the default DELETE mode can
-            # cause some OperationalError : IO failure when commiting
-            # transactions.
-            cursor = connection.cursor()
-            cursor.execute("PRAGMA journal_mode = TRUNCATE")
+            connection = self._connection_pool.connect()
+            if read_only and self._journal_mode == 'WAL':
+                connection.execute("BEGIN")
         except Exception as e:
             six.reraise(DatabaseError,
                         DatabaseError('On database file %s: %s: %s \n'
@@ -962,7 +1337,8 @@ class WorkflowDatabaseServer(object):
         Numbers are preallocated by blocks for efficiency matters: allocating
         them individually when needed, during databasing operations (open
         cursors) is a very high overhead and a severe performance bottleneck
-        for workflow submission especially.
+        for workflow submission especially. The new numbers are appended to
+        the ones which are still available.
 
         Returns
         -------
@@ -986,7 +1362,7 @@ class WorkflowDatabaseServer(object):
                     # *very* costy... (about 0.1 second per call)
                     cursor.execute(
                         'UPDATE fileCounter SET count=count+%d' % num_files)
-                self._free_file_counters = list(range(count,
+                self._free_file_counters.extend(range(count,
                                                       count + num_files))
                 return count
             except Exception as e:
@@ -1035,7 +1411,7 @@ class WorkflowDatabaseServer(object):
         '''
         with self._lock:
             self.ensure_file_numbers_available(1, 200, external_cursor)
-            return self._free_file_counters.pop(0)
+            return self._free_file_counters.popleft()
 
     def generate_file_path(self,
                            user_id,
@@ -1156,19 +1532,8 @@ class WorkflowDatabaseServer(object):
             else:
                 cursor = external_cursor
 
-            if engine_transfer.client_paths:
-                engine_transfer.engine_path \
-                    = self.generate_file_path(user_id, external_cursor=cursor)
-            else:
-                engine_transfer.engine_path \
-                    = self.generate_file_path(user_id,
-                                              engine_transfer.client_path,
-                                              external_cursor=cursor)
-            client_path_std = None
-            if engine_transfer.client_paths:
-                client_path_std = file_separator.join(
-                    engine_transfer.client_paths)
-
+            values = self._transfer_values(engine_transfer, user_id,
+                                           expiration_date, cursor)
             try:
                 cursor.execute('''INSERT INTO transfers
                         (engine_file_path,
@@ -1181,14 +1546,7 @@ class WorkflowDatabaseServer(object):
                          client_paths)
                         VALUES (?, ?, ?, ?,
                                 ?, ?, ?, ?)''',
-                               (engine_transfer.engine_path,
-                                engine_transfer.client_path,
-                                date.today(),
-                                expiration_date,
-                                user_id,
-                                engine_transfer.workflow_id,
-                                engine_transfer.status,
-                                client_path_std))
+                               values)
                 engine_transfer.transfer_id = cursor.lastrowid
             except Exception as e:
                 if not external_cursor:
@@ -1203,6 +1561,35 @@ class WorkflowDatabaseServer(object):
 
         return engine_transfer
 
+    def _transfer_values(self, engine_transfer, user_id, expiration_date,
+                         cursor, login=None):
+        '''
+        Allocate the engine path of a transfer, and build the values of its
+        row in the transfers table (all columns but the id).
+        '''
+        if engine_transfer.client_paths:
+            engine_transfer.engine_path \
+                = self.generate_file_path(user_id, external_cursor=cursor,
+                                          login=login)
+        else:
+            engine_transfer.engine_path \
+                = self.generate_file_path(user_id,
+                                          engine_transfer.client_path,
+                                          external_cursor=cursor,
+                                          login=login)
+        client_path_std = None
+        if engine_transfer.client_paths:
+            client_path_std = file_separator.join(
+                engine_transfer.client_paths)
+        return (engine_transfer.engine_path,
+                engine_transfer.client_path,
+                date.today(),
+                expiration_date,
+                user_id,
+                engine_transfer.workflow_id,
+                engine_transfer.status,
+                client_path_std)
+
     def add_temporary_path(self,
                            engine_temp,
                            user_id,
@@ -1230,10 +1617,6 @@ class WorkflowDatabaseServer(object):
             else:
                 cursor = external_cursor
 
-            engine_path = engine_temp.get_engine_path()
-            if engine_path is None:
-                engine_path = ''
-
             try:
                 cursor.execute('''INSERT INTO temporary_paths
                         (engine_file_path,
@@ -1242,11 +1625,8 @@ class WorkflowDatabaseServer(object):
                          workflow_id,
                          status)
                         VALUES (?, ?, ?, ?, ?)''',
-                               (engine_path,
-                                expiration_date,
-                                user_id,
-                                engine_temp.workflow_id,
-                                engine_temp.status))
+                               self._temporary_path_values(
+                                   engine_temp, user_id, expiration_date))
                 engine_temp.temp_path_id = cursor.lastrowid
             except Exception as e:
                 if not external_cursor:
@@ -1261,6 +1641,38 @@ class WorkflowDatabaseServer(object):
 
         return engine_temp
 
+    @staticmethod
+    def _temporary_path_values(engine_temp, user_id, expiration_date):
+        '''
+        Build the values of a temporary path row in the temporary_paths table
+        (all columns but the id).
+        '''
+        engine_path = engine_temp.get_engine_path()
+        if engine_path is None:
+            engine_path = ''
+        return (engine_path,
+                expiration_date,
+                user_id,
+                engine_temp.workflow_id,
+                engine_temp.status)
+
+    @staticmethod
+    def _first_free_row_id(cursor, table):
+        '''
+        Get the first row id which has never been used in a table with an
+        AUTOINCREMENT primary key. Rows may then be inserted with explicit
+        ids from this one: the table sequence follows them, so the ids will
+        not be reused.
+
+        The cursor transaction must already hold the database write lock
+        (i.e. have written something), so that no other connection can use
+        the same ids before it is committed.
+        '''
+        for (seq, ) in cursor.execute(
+                'SELECT seq FROM sqlite_sequence WHERE name=?', [table]):
+            return seq + 1
+        return 1
+
     def _check_transfer(self, connection, cursor, transfer_id, user_id):
         try:
             sel = cursor.execute(
@@ -1392,8 +1804,8 @@ class WorkflowDatabaseServer(object):
             (tranfer_id, engine_file_path, client_file_path, expiration_date, workflow_id, client_paths, transfer_type, status)
         '''
         self.logger.debug("=> get_transfer_information")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             self._check_transfer(connection, cursor, transfer_id, user_id)
             try:
@@ -1461,8 +1873,8 @@ class WorkflowDatabaseServer(object):
             (temp_path_id, engine_file_path, expiration_date, workflow_id, status)
         '''
         self.logger.debug("=> get_temporary_information")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             self._check_temporary(connection, cursor, temp_path_id, user_id)
             try:
@@ -1500,8 +1912,8 @@ class WorkflowDatabaseServer(object):
         Returns the transfer status stored in the database.
         '''
         self.logger.debug("=> get_transfer_status")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             self._check_transfer(connection, cursor, transfer_id, user_id)
             try:
@@ -1523,8 +1935,8 @@ class WorkflowDatabaseServer(object):
         Returns the temporary path status stored in the database.
         '''
         self.logger.debug("=> get_temporary_status")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             self._check_temporary(connection, cursor, temp_path_id, user_id)
             try:
@@ -1541,7 +1953,206 @@ class WorkflowDatabaseServer(object):
 
         return status
 
-    def set_transfer_status(self, transfer_id, status):
+    def get_transfers_status(self, transfer_ids, user_id):
+        '''
+        Returns the status of several transfers at once.
+
+        Parameters
+        ----------
+        transfer_ids: list
+            transfer ids
+        user_id: int
+
+        Returns
+        -------
+        status: dict
+            transfer_id -> status. Transfers which do not exist or belong to
+            an other user are missing from the dict.
+        '''
+        self.logger.debug("=> get_transfers_status")
+        return self._get_file_status(
+            'SELECT id, status FROM transfers WHERE user_id=? AND id IN (%s)',
+            transfer_ids, user_id)
+
+    def get_temporaries_status(self, temp_path_ids, user_id):
+        '''
+        Returns the status of several temporary paths at once.
+
+        Parameters
+        ----------
+        temp_path_ids: list
+            temporary path ids
+        user_id: int
+
+        Returns
+        -------
+        status: dict
+            temp_path_id -> status. Temporary paths which do not exist or
+            belong to an other user are missing from the dict.
+        '''
+        self.logger.debug("=> get_temporaries_status")
+        return self._get_file_status(
+            'SELECT temp_path_id, status FROM temporary_paths '
+            'WHERE user_id=? AND temp_path_id IN (%s)',
+            temp_path_ids, user_id)
+
+    def get_jobs_mean_duration(self, user_id, names):
+        '''
+        Mean duration of the previous runs of jobs, by job name. Only the
+        jobs of the user which have ended successfully, and are still in the
+        database, are taken into account.
+
+        Parameters
+        ----------
+        user_id: int
+        names: list of str
+            jobs names
+
+        Returns
+        -------
+        durations: dict
+            job name -> mean duration in seconds. Names without any ended
+            job are missing from the dict.
+        '''
+        self.logger.debug("=> get_jobs_mean_duration")
+        durations = {}
+        names = list(names)
+        if len(names) == 0:
+            return durations
+        nmax = sqlite3_max_variable_number() - 3
+        if nmax <= 0:
+            nmax = len(names)
+        with self._read_lock:
+            connection = self._connect(read_only=True)
+            cursor = connection.cursor()
+            try:
+                for chunk in range(0, len(names), nmax):
+                    chunk_names = names[chunk:chunk + nmax]
+                    for name, duration in cursor.execute(
+                            '''SELECT name,
+                            AVG(strftime('%%s', ending_date)
+                                - strftime('%%s', COALESCE(execution_date,
+                                                           submission_date)))
+                            FROM jobs
+                            WHERE user_id=? AND status=? AND exit_status=?
+                            AND exit_value=0 AND ending_date IS NOT NULL
+                            AND name IN (%s)
+                            GROUP BY name'''
+                            % ','.join(['?'] * len(chunk_names)),
+                            [user_id, constants.DONE,
+                             constants.FINISHED_REGULARLY] + chunk_names):
+                        if duration is not None:
+                            durations[self._string_conversion(name)] \
+                                = float(duration)
+            except Exception as e:
+                cursor.close()
+                connection.close()
+                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
+            cursor.close()
+            connection.close()
+        return durations
+
+    def get_workflow_resource_usage(self, wf_id, user_id):
+        '''
+        Resource usage of the ended jobs of a workflow, aggregated from the
+        jobs resource usage strings (see utils.parse_resource_usage()). Only
+        jobs for which the scheduler has reported resource usage are taken
+        into account.
+
+        Parameters
+        ----------
+        wf_id: int
+        user_id: int
+
+        Returns
+        -------
+        usage: dict
+            * jobs: number of jobs with resource usage information
+            * cpu_time: total CPU time, in seconds
+            * walltime: sum of the jobs execution times, in seconds
+            * cpu_percent: mean CPU usage of the jobs (cpu_time / walltime)
+            * max_memory: maximum memory of a job, in bytes
+            * max_memory_job: id of the job using max_memory
+            * inblock, oublock: total number of file system inputs and
+              outputs
+
+            Values which no job has reported are None.
+        '''
+        self.logger.debug("=> get_workflow_resource_usage")
+        with self._read_lock:
+            connection = self._connect(read_only=True)
+            cursor = connection.cursor()
+            self._check_workflow(connection, cursor, wf_id, user_id)
+            try:
+                rows = cursor.execute(
+                    '''SELECT id, resource_usage FROM jobs
+                    WHERE workflow_id=? AND resource_usage IS NOT NULL
+                    AND resource_usage != ?''', [wf_id, '']).fetchall()
+            except Exception as e:
+                cursor.close()
+                connection.close()
+                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
+            cursor.close()
+            connection.close()
+
+        totals = {'cpu_time': None, 'walltime': None, 'inblock': None,
+                  'oublock': None}
+        max_memory = None
+        max_memory_job = None
+        for job_id, resource_usage in rows:
+            usage = utils.parse_resource_usage(
+                self._string_conversion(resource_usage))
+            values = {'walltime': usage.get('walltime'),
+                      'inblock': usage.get('inblock'),
+                      'oublock': usage.get('oublock')}
+            if 'utime' in usage and 'stime' in usage:
+                values['cpu_time'] = usage['utime'] + usage['stime']
+            else:
+                values['cpu_time'] = usage.get('cput')
+            for name, value in six.iteritems(values):
+                if isinstance(value, six.integer_types + (float, )):
+                    totals[name] = (totals[name] or 0) + value
+            memory = usage.get('mem')
+            if isinstance(memory, six.integer_types) \
+                    and (max_memory is None or memory > max_memory):
+                max_memory = memory
+                max_memory_job = job_id
+        cpu_percent = None
+        if totals['cpu_time'] is not None and totals['walltime']:
+            cpu_percent = totals['cpu_time'] * 100. / totals['walltime']
+        totals.update({'jobs': len(rows),
+                       'cpu_percent': cpu_percent,
+                       'max_memory': max_memory,
+                       'max_memory_job': max_memory_job})
+        return totals
+
+    def _get_file_status(self, query, ids, user_id):
+        status = {}
+        if len(ids) == 0:
+            return status
+        nmax = sqlite3_max_variable_number() - 1
+        if nmax <= 0:
+            nmax = len(ids)
+        ids = list(ids)
+        with self._read_lock:
+            connection = self._connect(read_only=True)
+            cursor = connection.cursor()
+            try:
+                for chunk in range(0, len(ids), nmax):
+                    chunk_ids = ids[chunk:chunk + nmax]
+                    for obj_id, obj_status in cursor.execute(
+                            query % ','.join(['?'] * len(chunk_ids)),
+                            [user_id] + chunk_ids):
+                        status[obj_id] = self._string_conversion(obj_status)
+            except Exception as e:
+                cursor.close()
+                connection.close()
+                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
+            cursor.close()
+            connection.close()
+        return status
+
+    def set_transfer_status(self, transfer_id, status, external_cursor=None):
         '''
         Updates the transfer status in the database.
         The status must be valid (ie a string among the transfer status
@@ -1559,20 +2170,25 @@ class WorkflowDatabaseServer(object):
         self.logger.debug("=> set_transfer_status")
         with self._lock:
             # TBI if the status is not valid raise an exception ??
-            connection = self._connect()
-            cursor = connection.cursor()
+            if not external_cursor:
+                connection = self._connect()
+                cursor = connection.cursor()
+            else:
+                cursor = external_cursor
             try:
                 cursor.execute(
                     'UPDATE transfers SET status=? WHERE id=?',
                     (status, transfer_id))
             except Exception as e:
-                connection.rollback()
+                if not external_cursor:
+                    connection.rollback()
+                    cursor.close()
+                    connection.close()
+                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
+            if not external_cursor:
+                connection.commit()
                 cursor.close()
                 connection.close()
-                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
-            connection.commit()
-            cursor.close()
-            connection.close()
 
     def set_transfer_paths(self, transfer_id, engine_path, client_path,
                            client_paths):
@@ -1616,7 +2232,8 @@ class WorkflowDatabaseServer(object):
             cursor.close()
             connection.close()
 
-    def set_temporary_status(self, temp_path_id, status):
+    def set_temporary_status(self, temp_path_id, status,
+                             external_cursor=None):
         '''
         Updates the temporary path status in the database.
         The status must be valid (ie a string among the transfer status
@@ -1628,20 +2245,25 @@ class WorkflowDatabaseServer(object):
         self.logger.debug("=> set_temporary_status")
         with self._lock:
             # TBI if the status is not valid raise an exception ??
-            connection = self._connect()
-            cursor = connection.cursor()
+            if not external_cursor:
+                connection = self._connect()
+                cursor = connection.cursor()
+            else:
+                cursor = external_cursor
             try:
                 cursor.execute(
                     'UPDATE temporary_paths SET status=? WHERE temp_path_id=?',
                     (status, temp_path_id))
             except Exception as e:
-                connection.rollback()
+                if not external_cursor:
+                    connection.rollback()
+                    cursor.close()
+                    connection.close()
+                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
+            if not external_cursor:
+                connection.commit()
                 cursor.close()
                 connection.close()
-                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
-            connection.commit()
-            cursor.close()
-            connection.close()
 
     def set_transfer_type(self, transfer_id, transfer_type, user_id):
         self.logger.debug("=> set_transfer_type")
@@ -1722,6 +2344,61 @@ class WorkflowDatabaseServer(object):
             connection.close()
         return ended_transfers
 
+    def pop_ended_transfers(self, workflow_ids):
+        '''
+        Returns the ended transfers of several workflows, and clears their
+        ended transfer lists (see :meth:`pop_workflow_ended_transfer`).
+
+        Parameters
+        ----------
+        workflow_ids: list
+            workflow ids
+
+        Returns
+        -------
+        ended_transfers: dict
+            workflow_id -> list of ended transfers, for the workflows which
+            have ended transfers only.
+        '''
+        self.logger.debug("=> pop_ended_transfers")
+        separator = ", "
+        ended_transfers = {}
+        if len(workflow_ids) == 0:
+            return ended_transfers
+        nmax = sqlite3_max_variable_number()
+        if nmax <= 0:
+            nmax = len(workflow_ids)
+        workflow_ids = list(workflow_ids)
+        with self._lock:
+            connection = self._connect()
+            cursor = connection.cursor()
+            try:
+                for chunk in range(0, len(workflow_ids), nmax):
+                    wf_ids = workflow_ids[chunk:chunk + nmax]
+                    for wf_id, str_ended_transfers in cursor.execute(
+                            'SELECT id, ended_transfers FROM workflows '
+                            'WHERE ended_transfers IS NOT NULL AND id IN (%s)'
+                            % ','.join(['?'] * len(wf_ids)),
+                            wf_ids).fetchall():
+                        ended_transfers[wf_id] = self._string_conversion(
+                            str_ended_transfers).split(separator)
+                ended_ids = list(ended_transfers.keys())
+                for chunk in range(0, len(ended_ids), nmax):
+                    wf_ids = ended_ids[chunk:chunk + nmax]
+                    cursor.execute(
+                        'UPDATE workflows SET ended_transfers=NULL '
+                        'WHERE id IN (%s)' % ','.join(['?'] * len(wf_ids)),
+                        wf_ids)
+            except Exception as e:
+                connection.rollback()
+                cursor.close()
+                connection.close()
+                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
+            connection.commit()
+            cursor.close()
+            connection.close()
+        return ended_transfers
+
     #
     # WORKFLOWS
 
@@ -1747,8 +2424,14 @@ class WorkflowDatabaseServer(object):
         self.logger.debug("=> add_workflow")
         with self._lock:
             # try to allocate enough file counters before opening a new cursor
-            needed_files = len(engine_workflow.transfer_mapping) \
-                + len(engine_workflow.job_mapping) * 2
+            needed_files = len(engine_workflow.transfer_mapping)
+            for job in six.itervalues(engine_workflow.job_mapping):
+                if not job.plain_stdout():
+                    needed_files += 2
+                if job.use_input_params_file:
+                    needed_files += 1
+                if job.has_outputs:
+                    needed_files += 1
             self.ensure_file_numbers_available(needed_files)
 
             connection = self._connect()
@@ -1756,6 +2439,11 @@ class WorkflowDatabaseServer(object):
             name = None
             if engine_workflow.name != None:
                 name = six.ensure_text(engine_workflow.name, 'utf8')
+            # dates are converted once for all rows
+            now = adapt_datetime(datetime.now())
+            expiration_date = engine_workflow.expiration_date
+            if expiration_date is not None:
+                expiration_date = adapt_datetime(expiration_date)
             try:
                 cursor.execute('''INSERT INTO workflows
                          (user_id,
@@ -1768,54 +2456,111 @@ class WorkflowDatabaseServer(object):
                           VALUES (?, ?, ?, ?, ?, ?, ?)''',
                                (user_id,
                                 None,
-                                engine_workflow.expiration_date,
+                                expiration_date,
                                 name,
                                 constants.WORKFLOW_NOT_STARTED,
-                                datetime.now(),
+                                now,
                                 engine_workflow.queue))
 
                 engine_workflow.wf_id = cursor.lastrowid
 
+                if login is None:
+                    login = self.get_user_login(user_id, cursor)
+
+                # The workflow elements are inserted with preallocated ids:
+                # the connection holds the database write lock since the
+                # workflow insertion above.
+
                 # the transfers must be registered before the jobs
+                transfer_rows = []
+                temp_path_rows = []
+                transfer_id = self._first_free_row_id(cursor, 'transfers')
+                temp_path_id = self._first_free_row_id(cursor,
+                                                       'temporary_paths')
                 for transfer in six.itervalues(
                         engine_workflow.transfer_mapping):
                     transfer.workflow_id = engine_workflow.wf_id
-                    self.add_transfer(transfer,
-                                      user_id,
-                                      engine_workflow.expiration_date,
-                                      external_cursor=cursor)
                     if isinstance(transfer, FileTransfer):
+                        transfer.transfer_id = transfer_id
+                        transfer_id += 1
+                        transfer_rows.append(
+                            (transfer.transfer_id, )
+                            + self._transfer_values(transfer, user_id,
+                                                    expiration_date, cursor,
+                                                    login))
                         engine_workflow.registered_tr[
                             transfer.transfer_id] = transfer
                     else:
+                        transfer.temp_path_id = temp_path_id
+                        temp_path_id += 1
+                        temp_path_rows.append(
+                            (transfer.temp_path_id, )
+                            + self._temporary_path_values(transfer, user_id,
+                                                          expiration_date))
                         engine_workflow.registered_tmp[
                             transfer.temp_path_id] = transfer
+                cursor.executemany('''INSERT INTO transfers
+                        (id,
+                         engine_file_path,
+                         client_file_path,
+                         transfer_date,
+                         expiration_date,
+                         user_id,
+                         workflow_id,
+                         status,
+                         client_paths)
+                        VALUES (?, ?, ?, ?, ?,
+                                ?, ?, ?, ?)''',
+                                   transfer_rows)
+                cursor.executemany('''INSERT INTO temporary_paths
+                        (temp_path_id,
+                         engine_file_path,
+                         expiration_date,
+                         user_id,
+                         workflow_id,
+                         status)
+                        VALUES (?, ?, ?, ?, ?, ?)''',
+                                   temp_path_rows)
 
-                job_info = []
-
-                if login is None:
-                    login = self.get_user_login(cursor)
-
+                job_rows = []
+                ios_rows = []
+                ios_tmp_rows = []
+                job_id = self._first_free_row_id(cursor, 'jobs')
                 for job in six.itervalues(engine_workflow.job_mapping):
                     job.workflow_id = engine_workflow.wf_id
-                    job = self.add_job(user_id,
-                                       job,
-                                       engine_workflow.expiration_date,
-                                       external_cursor=cursor,
-                                       login=login)
-                    job_info.append(
-                        (job.job_id, job.stdout_file, job.stderr_file))
+                    job.job_id = job_id
+                    job_id += 1
+                    values, ios, ios_tmp = self._job_values(
+                        user_id, job, expiration_date, now, cursor, login)
+                    job_rows.append((job.job_id, ) + values)
+                    ios_rows += [(job.job_id, ) + row for row in ios]
+                    ios_tmp_rows += [(job.job_id, ) + row for row in ios_tmp]
                     engine_workflow.registered_jobs[job.job_id] = job
-
-                pickled_workflow = pickle.dumps(engine_workflow,
-                                                protocol=DB_PICKLE_PROTOCOL)
+                cursor.executemany('''INSERT INTO jobs
+                         (id, %s)
+                          VALUES (%s)'''
+                                   % (', '.join(self._job_columns),
+                                      ', '.join(['?'] * (
+                                          len(self._job_columns) + 1))),
+                                   job_rows)
+                cursor.executemany('''INSERT INTO ios (job_id,
+                                             engine_file_id,
+                                             is_input)
+                             VALUES (?, ?, ?)''',
+                                   ios_rows)
+                cursor.executemany('''INSERT INTO ios_tmp (job_id,
+                                             temp_path_id,
+                                             is_input)
+                             VALUES (?, ?, ?)''',
+                                   ios_tmp_rows)
 
                 cursor.execute('''UPDATE workflows
                           SET pickled_engine_workflow=?
                           WHERE id=?''',
-                               (sqlite3.Binary(pickled_workflow),
+                               (encode_engine_object(engine_workflow),
                                 engine_workflow.wf_id))
 
+                param_link_rows = []
                 for dest_job, links \
                         in six.iteritems(engine_workflow.param_links):
                     edest_job = engine_workflow.job_mapping[dest_job]
@@ -1825,17 +2570,19 @@ class WorkflowDatabaseServer(object):
                             func = None
                             if len(link) > 2:
                                 func = sqlite3.Binary(pickle.dumps(link[2]))
-                            cursor.execute(
-                                '''INSERT INTO param_links
-                                (workflow_id,
-                                dest_job_id,
-                                dest_param,
-                                src_job_id,
-                                src_param,
-                                pickled_function)
-                                VALUES (?, ?, ?, ?, ?, ?)''',
+                            param_link_rows.append(
                                 (engine_workflow.wf_id, edest_job.job_id,
                                  dest_param, esrc_job.job_id, link[1], func))
+                cursor.executemany(
+                    '''INSERT INTO param_links
+                    (workflow_id,
+                    dest_job_id,
+                    dest_param,
+                    src_job_id,
+                    src_param,
+                    pickled_function)
+                    VALUES (?, ?, ?, ?, ?, ?)''',
+                    param_link_rows)
 
             except Exception as e:
                 connection.rollback()
@@ -1927,8 +2674,8 @@ class WorkflowDatabaseServer(object):
             workflow object
         '''
         self.logger.debug("=> get_engine_workflow")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             self._check_workflow(connection, cursor, wf_id, user_id)
 
@@ -1946,16 +2693,14 @@ class WorkflowDatabaseServer(object):
             connection.close()
 
         if pickled_workflow:
-            if six.PY2:
-                workflow = pickle.loads(pickled_workflow)
-            else:
-                workflow = pickle.loads(pickled_workflow, encoding='utf-8')
+            workflow = decode_engine_object(pickled_workflow, EngineWorkflow)
         else:
             workflow = None
 
         return workflow
 
-    def set_workflow_status(self, wf_id, status, force=False):
+    def set_workflow_status(self, wf_id, status, force=False,
+                            external_cursor=None):
         '''
         Updates the workflow status in the database.
         The status must be valid (ie a string among the workflow status
@@ -1971,8 +2716,11 @@ class WorkflowDatabaseServer(object):
                           % (wf_id, status))
         with self._lock:
             # TBI if the status is not valid raise an exception ??
-            connection = self._connect()
-            cursor = connection.cursor()
+            if not external_cursor:
+                connection = self._connect()
+                cursor = connection.cursor()
+            else:
+                cursor = external_cursor
             try:
                 prev_status = six.next(cursor.execute(
                     '''SELECT status
@@ -1993,16 +2741,104 @@ class WorkflowDatabaseServer(object):
                 else:
                     self.logger.debug("===> (workflow_status not updated)")
             except Exception as e:
-                connection.rollback()
-                cursor.close()
-                connection.close()
+                if not external_cursor:
+                    connection.rollback()
+                    cursor.close()
+                    connection.close()
                 self.logger.error(
                     "===> workflow_status update failed, error: %s, : %s"
                     % (str(type(e)), str(e)))
                 six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
-            connection.commit()
-            cursor.close()
-            connection.close()
+            if not external_cursor:
+                connection.commit()
+                cursor.close()
+                connection.close()
+
+    def touch_workflows(self, wf_ids, external_cursor=None):
+        '''
+        Set the date of the last status update of several workflows to now,
+        without changing their status. The engine uses it as a periodic
+        heartbeat for the workflows whose status has not changed: clients
+        consider a workflow which has not been updated for a while as not
+        handled by an engine any longer.
+
+        Parameters
+        ----------
+        wf_ids: list
+            workflow ids
+        '''
+        self.logger.debug("=> touch_workflows")
+        with self._lock:
+            if not external_cursor:
+                connection = self._connect()
+                cursor = connection.cursor()
+            else:
+                cursor = external_cursor
+            nmax = sqlite3_max_variable_number() - 1
+            if nmax <= 0:
+                nmax = max(len(wf_ids), 1)
+            now = datetime.now()
+            try:
+                for chunk in range(0, len(wf_ids), nmax):
+                    ids = list(wf_ids[chunk:chunk + nmax])
+                    cursor.execute(
+                        'UPDATE workflows SET last_status_update=? '
+                        'WHERE id IN (%s)' % ','.join(['?'] * len(ids)),
+                        [now] + ids)
+            except Exception as e:
+                if not external_cursor:
+                    connection.rollback()
+                    cursor.close()
+                    connection.close()
+                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
+            if not external_cursor:
+                connection.commit()
+                cursor.close()
+                connection.close()
+
+    def touch_workflow_jobs(self, wf_ids, external_cursor=None):
+        '''
+        Set the date of the last status update of the jobs of several
+        workflows which have not ended yet to now, without changing their
+        status: periodic heartbeat of the jobs, as touch_workflows() for
+        workflows.
+
+        Parameters
+        ----------
+        wf_ids: list
+            workflow ids
+        '''
+        self.logger.debug("=> touch_workflow_jobs")
+        with self._lock:
+            if not external_cursor:
+                connection = self._connect()
+                cursor = connection.cursor()
+            else:
+                cursor = external_cursor
+            ended = [constants.DONE, constants.FAILED]
+            nmax = sqlite3_max_variable_number() - 1 - len(ended)
+            if nmax <= 0:
+                nmax = max(len(wf_ids), 1)
+            now = datetime.now()
+            try:
+                for chunk in range(0, len(wf_ids), nmax):
+                    ids = list(wf_ids[chunk:chunk + nmax])
+                    cursor.execute(
+                        'UPDATE jobs SET last_status_update=? '
+                        'WHERE workflow_id IN (%s) AND status NOT IN (%s)'
+                        % (','.join(['?'] * len(ids)),
+                           ','.join(['?'] * len(ended))),
+                        [now] + ids + ended)
+            except Exception as e:
+                if not external_cursor:
+                    connection.rollback()
+                    cursor.close()
+                    connection.close()
+                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
+            if not external_cursor:
+                connection.commit()
+                cursor.close()
+                connection.close()
 
     def get_workflow_status(self, wf_id, user_id):
         '''
@@ -2011,8 +2847,8 @@ class WorkflowDatabaseServer(object):
         '''
         self.logger.debug("=> get_workflow_status, wf_id: %s, user_id: %s"
                           % (wf_id, user_id))
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             self._check_workflow(connection, cursor, wf_id, user_id)
             try:
@@ -2076,8 +2912,8 @@ class WorkflowDatabaseServer(object):
         )
         '''
         self.logger.debug("=> get_detailed_workflow_status, wf_id: %s" % wf_id)
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
 
             try:
@@ -2253,8 +3089,8 @@ class WorkflowDatabaseServer(object):
 
     def is_valid_job(self, job_id, user_id):
         self.logger.debug("=> is_valid_job")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             last_status_update = None
             try:
@@ -2334,19 +3170,6 @@ class WorkflowDatabaseServer(object):
             expiration_date = datetime.now() + timedelta(
                 hours=engine_job.disposal_timeout)
 
-        parallel_config_name = None
-        nodes_number = 1
-        cpu_per_node = 1
-        if engine_job.parallel_job_info:
-            parallel_config_name \
-                = engine_job.parallel_job_info.get('config_name')
-            nodes_number = engine_job.parallel_job_info.get('nodes_number', 1)
-            cpu_per_node = engine_job.parallel_job_info.get('cpu_per_node', 1)
-        command_info = []
-        for command_element in engine_job.plain_command():
-            command_info.append(self.shell_param(command_element))
-        command_info = " ".join(command_info)
-
         with self._lock:
             if not external_cursor:
                 self.logger.debug("=> add_job")
@@ -2359,154 +3182,33 @@ class WorkflowDatabaseServer(object):
                 login = self.get_user_login(user_id, cursor)
 
             try:
-
-                if not engine_job.plain_stdout():
-                    engine_job.stdout_file = self.generate_file_path(
-                        user_id, external_cursor=cursor, login=login)
-                    engine_job.stderr_file = self.generate_file_path(
-                        user_id, external_cursor=cursor, login=login)
-                    custom_submission = False  # the std out and err file has to be removed with the job
-                else:
-                    custom_submission = True  # the std out and err file won't to be removed with the job
-
-                if engine_job.use_input_params_file \
-                        and not engine_job.plain_input_params_file():
-                    engine_job.input_params_file = self.generate_file_path(
-                        user_id, external_cursor=cursor, login=login)
-
-                if engine_job.has_outputs \
-                        and not engine_job.plain_output_params_file():
-                    engine_job.output_params_file = self.generate_file_path(
-                        user_id, external_cursor=cursor, login=login)
-
-                referenced_input_files = []
-                referenced_input_temp = []
-                for ft in engine_job.referenced_input_files:
-                    eft = engine_job.transfer_mapping[ft]
-                    if isinstance(eft, FileTransfer):
-                        referenced_input_files.append(eft.transfer_id)
-                    else:
-                        referenced_input_temp.append(eft.temp_path_id)
-
-                referenced_output_files = []
-                referenced_output_temp = []
-                for ft in engine_job.referenced_output_files:
-                    eft = engine_job.transfer_mapping[ft]
-                    if isinstance(eft, FileTransfer):
-                        referenced_output_files.append(eft.engine_path)
-                    else:
-                        referenced_output_temp.append(eft.temp_path_id)
-
+                values, ios, ios_tmp = self._job_values(
+                    user_id, engine_job, expiration_date, datetime.now(),
+                    cursor, login)
                 cursor.execute('''INSERT INTO jobs
-                         (user_id,
-
-                          drmaa_id,
-                          expiration_date,
-                          status,
-                          last_status_update,
-                          workflow_id,
-
-                          command,
-                          stdin_file,
-                          join_errout,
-                          stdout_file,
-                          stderr_file,
-                          working_directory,
-                          custom_submission,
-                          parallel_config_name,
-                          nodes_number,
-                          cpu_per_node,
-                          queue,
-                          input_params_file,
-                          output_params_file,
-
-                          name,
-                          submission_date,
-                          execution_date,
-                          ending_date,
-
-                          exit_status,
-                          exit_value,
-                          terminating_signal,
-                          resource_usage,
-
-                          pickled_engine_job)
-                          VALUES (?, ?, ?, ?, ?,
-                                  ?, ?, ?, ?, ?,
-                                  ?, ?, ?, ?, ?,
-                                  ?, ?, ?, ?, ?,
-                                  ?, ?, ?, ?, ?,
-                                  ?, ?, ?)''',
-                               (user_id,
-
-                                None,  # drmaa_id
-                                expiration_date,
-                                constants.NOT_SUBMITTED,  # status
-                                datetime.now(),  # last_status_update
-                                engine_job.workflow_id,
-
-                                command_info,
-                                engine_job.plain_stdin(),
-                                engine_job.join_stderrout,
-                                engine_job.plain_stdout(),
-                                engine_job.plain_stderr(),
-                                engine_job.plain_working_directory(),
-                                custom_submission,
-                                parallel_config_name,
-                                nodes_number,
-                                cpu_per_node,
-                                engine_job.queue,
-                                engine_job.plain_input_params_file(),
-                                engine_job.plain_output_params_file(),
-
-                                engine_job.name,
-                                None,  # submission_date,
-                                None,  # execution_date,
-                                None,  # ending_date,
-                                None,  # exit_status,
-                                None,  # exit_value,
-                                None,  # terminating_signal,
-                                None,  # resource_usage,
-
-                                None  # pickled_engine_job
-                                ))
+                         (%s)
+                          VALUES (%s)'''
+                               % (', '.join(self._job_columns),
+                                  ', '.join(['?'] * len(self._job_columns))),
+                               values)
 
                 job_id = cursor.lastrowid
                 engine_job.job_id = job_id
                 if not engine_job.workflow_id or engine_job.workflow_id == -1:
-                    pickled_engine_job = pickle.dumps(
-                        engine_job, protocol=DB_PICKLE_PROTOCOL)
                     cursor.execute(
                         'UPDATE jobs SET pickled_engine_job=? WHERE id=?',
-                                  (sqlite3.Binary(pickled_engine_job), job_id))
-
-                for transfer_id in referenced_input_files:
-                    cursor.execute('''INSERT INTO ios (job_id,
-                                             engine_file_id,
-                                             is_input)
-                             VALUES (?, ?, ?)''',
-                                   (job_id, transfer_id, True))
+                        (encode_engine_object(engine_job), job_id))
 
-                for transfer_id in referenced_output_files:
-                    cursor.execute('''INSERT INTO ios (job_id,
+                cursor.executemany('''INSERT INTO ios (job_id,
                                              engine_file_id,
                                              is_input)
-                            VALUES (?, ?, ?)''',
-                                   (job_id, transfer_id, False))
-
-                for temp_path_id in referenced_input_temp:
-                    cursor.execute('''INSERT INTO ios_tmp (job_id,
-                                             temp_path_id,
-                                             is_input)
                              VALUES (?, ?, ?)''',
-                                   (job_id, temp_path_id, True))
-
-                for temp_path_id in referenced_output_temp:
-                    cursor.execute('''INSERT INTO ios_tmp (job_id,
+                                   [(job_id, ) + row for row in ios])
+                cursor.executemany('''INSERT INTO ios_tmp (job_id,
                                              temp_path_id,
                                              is_input)
                              VALUES (?, ?, ?)''',
-                                   (job_id, temp_path_id, False))
+                                   [(job_id, ) + row for row in ios_tmp])
 
             except Exception as e:
                 if not external_cursor:
@@ -2521,6 +3223,141 @@ class WorkflowDatabaseServer(object):
 
         return engine_job
 
+    # columns of the jobs table set when a job is added, in the order of the
+    # values built by _job_values()
+    _job_columns = (
+        'user_id',
+
+        'drmaa_id',
+        'expiration_date',
+        'status',
+        'last_status_update',
+        'workflow_id',
+
+        'command',
+        'stdin_file',
+        'join_errout',
+        'stdout_file',
+        'stderr_file',
+        'working_directory',
+        'custom_submission',
+        'parallel_config_name',
+        'nodes_number',
+        'cpu_per_node',
+        'queue',
+        'input_params_file',
+        'output_params_file',
+
+        'name',
+        'submission_date',
+        'execution_date',
+        'ending_date',
+
+        'exit_status',
+        'exit_value',
+        'terminating_signal',
+        'resource_usage',
+
+        'pickled_engine_job')
+
+    def _job_values(self, user_id, engine_job, expiration_date, now, cursor,
+                    login):
+        '''
+        Allocate the server-side files of a job, and build the values of its
+        row in the jobs table (see _job_columns), and its references to
+        transfers and temporary paths.
+
+        Returns
+        -------
+        values: tuple
+            jobs table row values
+        ios: list
+            (engine_file_id, is_input) tuples for the ios table
+        ios_tmp: list
+            (temp_path_id, is_input) tuples for the ios_tmp table
+        '''
+        parallel_config_name = None
+        nodes_number = 1
+        cpu_per_node = 1
+        if engine_job.parallel_job_info:
+            parallel_config_name \
+                = engine_job.parallel_job_info.get('config_name')
+            nodes_number = engine_job.parallel_job_info.get('nodes_number', 1)
+            cpu_per_node = engine_job.parallel_job_info.get('cpu_per_node', 1)
+        shell_param = self.shell_param
+        command_info = " ".join([shell_param(command_element)
+                                 for command_element
+                                 in engine_job.plain_command()])
+
+        if not engine_job.plain_stdout():
+            engine_job.stdout_file = self.generate_file_path(
+                user_id, external_cursor=cursor, login=login)
+            engine_job.stderr_file = self.generate_file_path(
+                user_id, external_cursor=cursor, login=login)
+            custom_submission = False  # the std out and err file has to be removed with the job
+        else:
+            custom_submission = True  # the std out and err file won't to be removed with the job
+
+        if engine_job.use_input_params_file \
+                and not engine_job.plain_input_params_file():
+            engine_job.input_params_file = self.generate_file_path(
+                user_id, external_cursor=cursor, login=login)
+
+        if engine_job.has_outputs \
+                and not engine_job.plain_output_params_file():
+            engine_job.output_params_file = self.generate_file_path(
+                user_id, external_cursor=cursor, login=login)
+
+        ios = []
+        ios_tmp = []
+        for ft in engine_job.referenced_input_files:
+            eft = engine_job.transfer_mapping[ft]
+            if isinstance(eft, FileTransfer):
+                ios.append((eft.transfer_id, True))
+            else:
+                ios_tmp.append((eft.temp_path_id, True))
+        for ft in engine_job.referenced_output_files:
+            eft = engine_job.transfer_mapping[ft]
+            if isinstance(eft, FileTransfer):
+                ios.append((eft.engine_path, False))
+            else:
+                ios_tmp.append((eft.temp_path_id, False))
+
+        values = (user_id,
+
+                  None,  # drmaa_id
+                  expiration_date,
+                  constants.NOT_SUBMITTED,  # status
+                  now,  # last_status_update
+                  engine_job.workflow_id,
+
+                  command_info,
+                  engine_job.plain_stdin(),
+                  engine_job.join_stderrout,
+                  engine_job.plain_stdout(),
+                  engine_job.plain_stderr(),
+                  engine_job.plain_working_directory(),
+                  custom_submission,
+                  parallel_config_name,
+                  nodes_number,
+                  cpu_per_node,
+                  engine_job.queue,
+                  engine_job.plain_input_params_file(),
+                  engine_job.plain_output_params_file(),
+
+                  engine_job.name,
+                  None,  # submission_date,
+                  None,  # execution_date,
+                  None,  # ending_date,
+                  None,  # exit_status,
+                  None,  # exit_value,
+                  None,  # terminating_signal,
+                  None,  # resource_usage,
+
+                  None  # pickled_engine_job
+                  )
+        return values, ios, ios_tmp
+
     def update_job_command(self, job_id, commandline):
         self.logger.debug("=> update_job_command " + str(job_id) + ':'
                           + repr(commandline))
@@ -2547,8 +3384,8 @@ class WorkflowDatabaseServer(object):
 
     def get_job_command(self, job_id):
         self.logger.debug("=> get_job_command " + str(job_id))
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             try:
                 command = six.next(cursor.execute(
@@ -2571,8 +3408,8 @@ class WorkflowDatabaseServer(object):
         @return: workflow object
         '''
         self.logger.debug("=> get_engine_job %d" % job_id)
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             self._check_job(connection, cursor, job_id, user_id)
             try:
@@ -2589,10 +3426,7 @@ class WorkflowDatabaseServer(object):
             connection.close()
 
         if pickled_job:
-            if six.PY2:
-                job = pickle.loads(pickled_job)
-            else:
-                job = pickle.loads(pickled_job, encoding='utf-8')
+            job = decode_engine_object(pickled_job, EngineJob)
             job.job_id = job_id
         else:
             job = None
@@ -2665,14 +3499,18 @@ class WorkflowDatabaseServer(object):
             cursor.close()
             connection.close()
 
-    def set_jobs_status(self, job_status, force=False):
+    def set_jobs_status(self, job_status, force=False, external_cursor=None):
         '''
         job_status: dictionary: job_id -> status
         '''
         self.logger.debug("=> set_jobs_status")
         with self._lock:
             # TBI if the status is not valid raise an exception ??
-            connection = self._connect()
+            if not external_cursor:
+                connection = self._connect()
+                cursor = connection.cursor()
+            else:
+                cursor = external_cursor
             statuses = []
 
             # execute all queries before writing in the database, it's
@@ -2690,7 +3528,7 @@ class WorkflowDatabaseServer(object):
                     n = nmax
                 else:
                     n = len(job_status) - chunk * nmax
-                sel = connection.execute(
+                sel = cursor.execute(
                     ''' SELECT id,
                             status,
                             last_status_update,
@@ -2699,7 +3537,7 @@ class WorkflowDatabaseServer(object):
                     FROM jobs WHERE id IN (%s)'''
                     % ','.join('?' * n), jkeys[chunk * nmax:chunk * nmax + n])
                 for (job_id, previous_status, last_update, execution_date,
-                     ending_date) in sel:
+                     ending_date) in sel.fetchall():
                     status = job_status[job_id]
                     previous_status = self._string_conversion(
                         previous_status)
@@ -2710,7 +3548,6 @@ class WorkflowDatabaseServer(object):
                                      last_update, execution_date,
                                      ending_date))
 
-            cursor = connection.cursor()
             now = datetime.now()
             date_to_update = []
             try:
@@ -2764,10 +3601,13 @@ class WorkflowDatabaseServer(object):
                             [now] + date_to_update[chunk * nmax:
                                                    chunk * nmax + n])
             except Exception as e:
-                connection.rollback()
-                cursor.close()
-                connection.close()
+                if not external_cursor:
+                    connection.rollback()
+                    cursor.close()
+                    connection.close()
                 six.raise_from(DatabaseError(e), e)
+            if external_cursor:
+                return
             # connection.commit()
             try:
                 connection.commit()
@@ -2780,7 +3620,8 @@ class WorkflowDatabaseServer(object):
             cursor.close()
             connection.close()
 
-    def set_job_status(self, job_id, status, force=False):
+    def set_job_status(self, job_id, status, force=False,
+                       external_cursor=None):
         '''
         Updates the job status in the database.
         The status must be valid (ie a string among the job status
@@ -2792,8 +3633,12 @@ class WorkflowDatabaseServer(object):
         self.logger.debug("=> set_job_status")
         with self._lock:
             # TBI if the status is not valid raise an exception ??
-            connection = self._connect()
-            sel = connection.execute(
+            if not external_cursor:
+                connection = self._connect()
+                cursor = connection.cursor()
+            else:
+                cursor = external_cursor
+            sel = cursor.execute(
                 ''' SELECT status,
                               execution_date,
                               ending_date
@@ -2805,7 +3650,9 @@ class WorkflowDatabaseServer(object):
                  ending_date) = six.next(sel)
             except StopIteration:
                 # job does not exist
-                connection.close()
+                if not external_cursor:
+                    cursor.close()
+                    connection.close()
                 return
 
             previous_status = self._string_conversion(previous_status)
@@ -2824,20 +3671,24 @@ class WorkflowDatabaseServer(object):
                     (previous_status != constants.DELETE_PENDING and
                      previous_status != constants.KILL_PENDING):
                 try:
-                    connection.execute('''UPDATE jobs SET status=?,
-                                          last_status_update=?,
-                                          execution_date=?,
-                                          ending_date=? WHERE id=?''',
-                                       (status, datetime.now(),
-                                        execution_date, ending_date,
-                                        job_id))
+                    cursor.execute('''UPDATE jobs SET status=?,
+                                      last_status_update=?,
+                                      execution_date=?,
+                                      ending_date=? WHERE id=?''',
+                                   (status, datetime.now(),
+                                    execution_date, ending_date,
+                                    job_id))
                 except Exception as e:
-                    connection.rollback()
-                    connection.close()
+                    if not external_cursor:
+                        connection.rollback()
+                        cursor.close()
+                        connection.close()
                     six.reraise(
                         DatabaseError, DatabaseError(e), sys.exc_info()[2])
-            connection.commit()
-            connection.close()
+            if not external_cursor:
+                connection.commit()
+                cursor.close()
+                connection.close()
 
     def get_job_status(self, job_id, user_id):
         '''
@@ -2856,8 +3707,8 @@ class WorkflowDatabaseServer(object):
         other user.
         '''
         self.logger.debug("=> get_jobs_status")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             self._check_jobs(connection, cursor, job_ids, user_id)
 
@@ -2894,7 +3745,8 @@ class WorkflowDatabaseServer(object):
 
         return status
 
-    def set_submission_information(self, drmaa_ids, submission_date):
+    def set_submission_information(self, drmaa_ids, submission_date,
+                                   external_cursor=None):
         '''
         Set the submission information of the job and reset information
         related to the job submission (execution_date, ending_date,
@@ -2905,8 +3757,11 @@ class WorkflowDatabaseServer(object):
         '''
         self.logger.debug("=> set_submission_information")
         with self._lock:
-            connection = self._connect()
-            cursor = connection.cursor()
+            if not external_cursor:
+                connection = self._connect()
+                cursor = connection.cursor()
+            else:
+                cursor = external_cursor
             try:
                 for job_id, drmaa_id in six.iteritems(drmaa_ids):
                     cursor.execute('''UPDATE jobs
@@ -2933,13 +3788,15 @@ class WorkflowDatabaseServer(object):
                                     None,
                                     job_id))
             except Exception as e:
-                connection.rollback()
+                if not external_cursor:
+                    connection.rollback()
+                    cursor.close()
+                    connection.close()
+                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
+            if not external_cursor:
+                connection.commit()
                 cursor.close()
                 connection.close()
-                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
-            connection.commit()
-            cursor.close()
-            connection.close()
 
     def set_job_output_params(self, job_id, param_dict):
         '''
@@ -2965,8 +3822,8 @@ class WorkflowDatabaseServer(object):
         Returns the job output parameters dict.
         '''
         self.logger.debug("=> get_job_output_params")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             try:
                 json_sql = cursor.execute(
@@ -3038,8 +3895,8 @@ class WorkflowDatabaseServer(object):
         @return: DRMAA job identifier (job identifier on DRMS if submitted via DRMAA)
         '''
         self.logger.debug("=> get_drmaa_job_id")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             try:
                 sel = cursor.execute(
@@ -3074,8 +3931,8 @@ class WorkflowDatabaseServer(object):
             (stdout_file_path, stderr_file_path)
         '''
         self.logger.debug("=> get_std_out_err_file_path")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             try:
                 sel = cursor.execute(
@@ -3107,8 +3964,8 @@ class WorkflowDatabaseServer(object):
         The job_id must be valid.
         '''
         self.logger.debug("=> get_job_output_params_file_path")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             try:
                 sel = cursor.execute(
@@ -3142,8 +3999,8 @@ class WorkflowDatabaseServer(object):
         @return: (exit_status, exit_value, terminating_signal, resource_usage)
         '''
         self.logger.debug("=> get_job_exit_info")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             self._check_job(connection, cursor, job_id, user_id)
             try:
@@ -3167,11 +4024,14 @@ class WorkflowDatabaseServer(object):
 
         return (exit_status, exit_value, terminating_signal, resource_usage)
 
-    def set_jobs_exit_info(self, job_dict):
+    def set_jobs_exit_info(self, job_dict, external_cursor=None):
         self.logger.debug("=> set_jobs_exit_info")
         with self._lock:
-            connection = self._connect()
-            cursor = connection.cursor()
+            if not external_cursor:
+                connection = self._connect()
+                cursor = connection.cursor()
+            else:
+                cursor = external_cursor
             try:
                 for job_id, job in six.iteritems(job_dict):
                     self.set_job_exit_info(job_id,
@@ -3181,12 +4041,14 @@ class WorkflowDatabaseServer(object):
                                            job.str_rusage,
                                            cursor)
             except Exception as e:
+                if not external_cursor:
+                    cursor.close()
+                    connection.close()
+                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
+            if not external_cursor:
+                connection.commit()
                 cursor.close()
                 connection.close()
-                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
-            connection.commit()
-            cursor.close()
-            connection.close()
 
     def set_job_exit_info(self,
                           job_id,
@@ -3245,6 +4107,58 @@ class WorkflowDatabaseServer(object):
                 cursor.close()
                 connection.close()
 
+    # methods which can be grouped in a single transaction by apply_updates()
+    BATCHABLE_UPDATES = ('set_jobs_status',
+                         'set_job_status',
+                         'set_jobs_exit_info',
+                         'set_submission_information',
+                         'set_workflow_status',
+                         'touch_workflows',
+                         'touch_workflow_jobs',
+                         'set_transfer_status',
+                         'set_temporary_status')
+
+    def apply_updates(self, updates):
+        '''
+        Apply a batch of updates in a single database transaction: either all
+        of them are recorded, or none (the database is left unchanged if one
+        of them fails).
+
+        The engine loop uses it to write the changes of an iteration at once
+        instead of opening a transaction (and, for a remote database server,
+        performing a remote call) for each of them.
+
+        Parameters
+        ----------
+        updates: list
+            list of (method_name, args, kwargs) tuples. method_name must be
+            one of :attr:`BATCHABLE_UPDATES`. Updates are applied in the list
+            order.
+        '''
+        self.logger.debug("=> apply_updates (%d)" % len(updates))
+        for method_name, args, kwargs in updates:
+            if method_name not in self.BATCHABLE_UPDATES:
+                raise DatabaseError('method %s cannot be used in a batch '
+                                    'update' % method_name)
+        if len(updates) == 0:
+            return
+        with self._lock:
+            connection = self._connect()
+            cursor = connection.cursor()
+            try:
+                for method_name, args, kwargs in updates:
+                    kwargs = dict(kwargs)
+                    kwargs['external_cursor'] = cursor
+                    getattr(self, method_name)(*args, **kwargs)
+            except Exception as e:
+                connection.rollback()
+                cursor.close()
+                connection.close()
+                six.reraise(DatabaseError, DatabaseError(e), sys.exc_info()[2])
+            connection.commit()
+            cursor.close()
+            connection.close()
+
     def _string_conversion(self, string):
         # return string
         if string:
@@ -3296,8 +4210,8 @@ class WorkflowDatabaseServer(object):
             request = request + ")"
             argument = job_ids
 
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             result = {}
             try:
@@ -3371,8 +4285,8 @@ class WorkflowDatabaseServer(object):
         '''
         if not isinstance(status, list) and not isinstance(status, tuple):
             status = [status]
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             try:
                 if queue_name != None:
@@ -3469,8 +4383,8 @@ class WorkflowDatabaseServer(object):
             request = request + ")"
             argument = transfer_ids
 
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             result = {}
             try:
@@ -3524,8 +4438,8 @@ class WorkflowDatabaseServer(object):
             request = request + ")"
             argument = temp_ids
 
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             result = {}
             try:
@@ -3567,8 +4481,8 @@ class WorkflowDatabaseServer(object):
 
     def is_valid_workflow(self, wf_id, user_id):
         self.logger.debug("=> is_valid_workflow")
-        with self._lock:
-            connection = self._connect()
+        with self._read_lock:
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             last_status_update = None
             try:
@@ -3616,9 +4530,9 @@ class WorkflowDatabaseServer(object):
             request = request + ")"
             argument = workflow_ids
 
-        with self._lock:
+        with self._read_lock:
             self.logger.debug("=> get_workflows, within lock")
-            connection = self._connect()
+            connection = self._connect(read_only=True)
             cursor = connection.cursor()
             result = {}
 
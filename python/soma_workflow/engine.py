@@ -16,6 +16,8 @@ import stat
 import hashlib
 import operator
 import itertools
+import heapq
+import collections
 import atexit
 import six
 import weakref
@@ -43,6 +45,10 @@ refreshment_interval = 1.  # seconds
 # if the last status update is older than the refreshment_timeout
 # the status is changed into WARNING
 refreshment_timeout = 90  # seconds
+# the engine loop only writes the status of the jobs which have changed. The
+# last_status_update of the jobs which have not ended is refreshed at this
+# interval anyway (it must stay well below refreshment_timeout)
+status_update_interval = 15  # seconds
 
 
 def _out_to_date(last_status_update):
@@ -115,6 +121,333 @@ class EngineLoopThread(threading.Thread):
             loop_thread.stop_loop()
 
 
+class PendingQueue(object):
+
+    '''
+    Jobs waiting to be submitted to a scheduler queue.
+
+    Jobs are popped by decreasing priority (see
+    :meth:`EngineJob.scheduling_priority
+    <soma_workflow.engine_types.EngineJob.scheduling_priority>`), and in the
+    order they have been added for the same priority. Adding or popping a job
+    is O(log n), and removing a job is O(1) (removed entries are dropped when
+    they reach the top of the heap).
+    '''
+
+    def __init__(self):
+        # heap of [-scheduling priority, sequence number, enqueue time, job]
+        # entries.
+        # The job of removed entries is set to None.
+        self._heap = []
+        # pending job -> heap entry, in the order they have been added
+        self._entries = collections.OrderedDict()
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, job):
+        return job in self._entries
+
+    def _entry(self, job):
+        if job in self._entries:
+            self.remove(job)
+        entry = [tuple([-p for p in job.scheduling_priority()]),
+                 next(self._counter), time.time(), job]
+        self._entries[job] = entry
+        return entry
+
+    def push(self, job):
+        '''
+        Add a job to the queue.
+        '''
+        heapq.heappush(self._heap, self._entry(job))
+
+    def extend(self, jobs):
+        '''
+        Add several jobs to the queue. Jobs with the same priority keep their
+        order in jobs.
+        '''
+        entries = [self._entry(job) for job in jobs]
+        if len(entries) > len(self._heap) // 4:
+            # cheaper to build the heap again
+            self._heap.extend(entries)
+            heapq.heapify(self._heap)
+        else:
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+
+    def pop(self):
+        '''
+        Remove and return the job to submit first.
+        '''
+        while self._heap:
+            job = heapq.heappop(self._heap)[-1]
+            if job is not None:
+                del self._entries[job]
+                return job
+        raise IndexError('pop from an empty PendingQueue')
+
+    def pop_all(self):
+        '''
+        Remove all the jobs and return them in submission order.
+        '''
+        jobs = [entry[-1] for entry in sorted(self._entries.values())]
+        self._heap = []
+        self._entries.clear()
+        return jobs
+
+    def remove(self, job):
+        '''
+        Remove a job from the queue. The job must be in the queue.
+        '''
+        entry = self._entries.pop(job)
+        entry[-1] = None
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            # too many removed entries
+            self._heap = [entry for entry in self._heap
+                          if entry[-1] is not None]
+            heapq.heapify(self._heap)
+
+    def oldest_wait(self):
+        '''
+        Time (in seconds) the job added first has been waiting, or None if
+        the queue is empty.
+        '''
+        for entry in six.itervalues(self._entries):
+            return time.time() - entry[2]
+        return None
+
+
+class FairSharePendingQueue(object):
+
+    '''
+    Jobs waiting to be submitted to a scheduler queue, shared fairly between
+    workflows.
+
+    Each workflow (and the jobs submitted outside of any workflow, together)
+    has its own :class:`PendingQueue`, and jobs are popped from them in turn
+    (round-robin), so that a workflow with many ready jobs does not delay the
+    jobs of the workflows submitted after it until all its jobs are
+    submitted. Within a workflow, jobs are popped by priority.
+
+    It has the same API as :class:`PendingQueue`.
+    '''
+
+    def __init__(self):
+        # workflow id -> PendingQueue
+        self._queues = {}
+        # workflow ids which have pending jobs, in turn order
+        self._turns = collections.deque()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, job):
+        queue = self._queues.get(job.workflow_id)
+        return queue is not None and job in queue
+
+    def _queue(self, workflow_id):
+        queue = self._queues.get(workflow_id)
+        if queue is None:
+            queue = PendingQueue()
+            self._queues[workflow_id] = queue
+        if len(queue) == 0:
+            self._turns.append(workflow_id)
+        return queue
+
+    def push(self, job):
+        self.extend([job])
+
+    def extend(self, jobs):
+        workflows_jobs = collections.OrderedDict()
+        for job in jobs:
+            workflows_jobs.setdefault(job.workflow_id, []).append(job)
+        for workflow_id, wf_jobs in six.iteritems(workflows_jobs):
+            queue = self._queue(workflow_id)
+            size = len(queue)
+            queue.extend(wf_jobs)
+            self._len += len(queue) - size
+
+    def pop(self):
+        if not self._turns:
+            raise IndexError('pop from an empty FairSharePendingQueue')
+        workflow_id = self._turns.popleft()
+        queue = self._queues[workflow_id]
+        job = queue.pop()
+        self._len -= 1
+        if len(queue) == 0:
+            del self._queues[workflow_id]
+        else:
+            self._turns.append(workflow_id)
+        return job
+
+    def pop_all(self):
+        return [self.pop() for i in range(self._len)]
+
+    def remove(self, job):
+        queue = self._queues[job.workflow_id]
+        queue.remove(job)
+        self._len -= 1
+        if len(queue) == 0:
+            del self._queues[job.workflow_id]
+            self._turns.remove(job.workflow_id)
+
+    def oldest_wait(self):
+        waits = [queue.oldest_wait() for queue in six.itervalues(self._queues)]
+        if not waits:
+            return None
+        return max(waits)
+
+
+class DatabaseUpdateBuffer(object):
+
+    '''
+    Write-behind buffer of the database updates done by the engine loop.
+
+    The updates are recorded in order, using the same methods and arguments
+    as the database server, and are written at once by :meth:`flush`, in a
+    single call to :meth:`WorkflowDatabaseServer.apply_updates
+    <soma_workflow.database_server.WorkflowDatabaseServer.apply_updates>`,
+    thus in a single database transaction.
+
+    Updates are coalesced while they are buffered: consecutive
+    set_jobs_status() calls are merged, and only the last status of a
+    workflow, transfer or temporary path is written.
+    '''
+
+    # methods for which only the last update of a given object is kept
+    _keyed_methods = ('set_workflow_status',
+                      'set_transfer_status',
+                      'set_temporary_status')
+
+    def __init__(self, database_server):
+        self._database_server = database_server
+        # list of [method_name, args, kwargs]
+        self._updates = []
+        # (method_name, object id) -> update in _updates
+        self._keyed_updates = {}
+        # time.time() of the first buffered update
+        self._first_update_time = None
+        # number of database calls (transactions) done by flush()
+        self.flush_count = 0
+
+    def __len__(self):
+        return len(self._updates)
+
+    def age(self):
+        '''
+        Time (in seconds) since the oldest buffered update has been recorded.
+        0 if the buffer is empty.
+        '''
+        if self._first_update_time is None:
+            return 0.
+        return time.time() - self._first_update_time
+
+    def _record(self, method_name, args, kwargs={}):
+        if self._first_update_time is None:
+            self._first_update_time = time.time()
+        update = [method_name, args, kwargs]
+        self._updates.append(update)
+        return update
+
+    def _record_keyed(self, method_name, obj_id, args, kwargs={}):
+        update = self._keyed_updates.get((method_name, obj_id))
+        if update is None:
+            self._keyed_updates[(method_name, obj_id)] \
+                = self._record(method_name, args, kwargs)
+        else:
+            if update[2].get('force'):
+                kwargs = dict(kwargs)
+                kwargs['force'] = True
+            update[1] = args
+            update[2] = kwargs
+
+    def set_jobs_status(self, job_status, force=False):
+        if self._updates and self._updates[-1][0] == 'set_jobs_status' \
+                and self._updates[-1][2].get('force', False) == force:
+            self._updates[-1][1][0].update(job_status)
+        else:
+            self._record('set_jobs_status', (dict(job_status), ),
+                         {'force': force})
+
+    def set_job_status(self, job_id, status, force=False):
+        self._record('set_job_status', (job_id, status), {'force': force})
+
+    def set_jobs_exit_info(self, job_dict):
+        self._record('set_jobs_exit_info', (dict(job_dict), ))
+
+    def set_submission_information(self, drmaa_ids, submission_date):
+        self._record('set_submission_information',
+                     (dict(drmaa_ids), submission_date))
+
+    def set_workflow_status(self, wf_id, status, force=False):
+        self._record_keyed('set_workflow_status', wf_id, (wf_id, status),
+                           {'force': force})
+
+    def touch_workflows(self, wf_ids):
+        self._record('touch_workflows', (list(wf_ids), ))
+
+    def touch_workflow_jobs(self, wf_ids):
+        self._record('touch_workflow_jobs', (list(wf_ids), ))
+
+    def set_transfer_status(self, transfer_id, status):
+        self._record_keyed('set_transfer_status', transfer_id,
+                           (transfer_id, status))
+
+    def set_temporary_status(self, temp_path_id, status):
+        self._record_keyed('set_temporary_status', temp_path_id,
+                           (temp_path_id, status))
+
+    def transfer_status(self, transfer_id, default=None):
+        '''
+        Status of a transfer not written in the database yet, or default.
+        '''
+        update = self._keyed_updates.get(('set_transfer_status', transfer_id))
+        if update is None:
+            return default
+        return update[1][1]
+
+    def temporary_status(self, temp_path_id, default=None):
+        '''
+        Status of a temporary path not written in the database yet, or
+        default.
+        '''
+        update = self._keyed_updates.get(('set_temporary_status',
+                                          temp_path_id))
+        if update is None:
+            return default
+        return update[1][1]
+
+    def flush(self):
+        '''
+        Write all the buffered updates in the database, in a single
+        transaction. If the database call fails, the updates are put back at
+        the head of the buffer, to be written by the next flush, and the
+        exception is raised again.
+        '''
+        if not self._updates:
+            return
+        pending = self._updates
+        keyed_updates = self._keyed_updates
+        first_update_time = self._first_update_time
+        self._updates = []
+        self._keyed_updates = {}
+        self._first_update_time = None
+        self.flush_count += 1
+        try:
+            self._database_server.apply_updates(
+                [tuple(update) for update in pending])
+        except Exception:
+            # updates recorded meanwhile come after the failed ones
+            self._updates = pending + self._updates
+            keyed_updates.update(self._keyed_updates)
+            self._keyed_updates = keyed_updates
+            self._first_update_time = first_update_time
+            raise
+
+
 class WorkflowEngineLoop(object):
 
     # jobs managed by the current engine process instance.
@@ -146,14 +479,46 @@ class WorkflowEngineLoop(object):
     # Submission pending queues.
     # For each limited queue, a submission pending queue is needed to store the
     # jobs that couldn't be submitted.
-    # Dictionary queue name (str) => pending jobs (list)
+    # Dictionary queue name (str) => pending jobs (PendingQueue or
+    # FairSharePendingQueue)
     _pending_queues = None
+    # boolean: share the submission slots of limited queues between workflows
+    # (see FairSharePendingQueue)
+    _fair_share = False
+    # boolean: compute the critical path of the jobs of submitted workflows
+    # (see EngineWorkflow.set_critical_path_priorities())
+    _critical_path_priorities = False
+    # Jobs submitted to the scheduler which have not ended yet (no exit
+    # status). They are the only ones which need to be polled.
+    # Dictionary job_id => EngineJob
+    _active_jobs = None
+    # Jobs which status has changed and has to be written in the database at
+    # the end of the current loop iteration.
+    # Dictionary job_id => EngineJob
+    _changed_jobs = None
+    # datetime of the last write of all the jobs status in the database (and
+    # heartbeat of the workflows)
+    _last_status_update = None
+    # Workflow status last written in the database by the loop. The loop
+    # only writes the status of the workflows which have changed.
+    # Dictionary wf_id => status (str)
+    _persisted_wf_status = None
+    # DatabaseUpdateBuffer: database updates of the loop not written yet
+    _db_updates = None
+    # maximum time (in seconds) the loop database updates may be delayed in
+    # _db_updates. They are written at the end of the first loop iteration
+    # after this delay. 0: they are written at the end of each iteration.
+    update_window = 0.
     # boolean
     _running = None
     # boolean
     _j_wf_ended = None
 
     _lock = None
+    # threading.Event set whenever something happens that the loop should
+    # process without waiting for the end of its time interval (job end,
+    # submission, kill / delete request, ended transfer...)
+    _wake_event = None
 
     logger = None
 
@@ -162,7 +527,9 @@ class WorkflowEngineLoop(object):
                  scheduler,
                  path_translation=None,
                  queue_limits={},
-                 running_jobs_limits={}):
+                 running_jobs_limits={},
+                 fair_share=False,
+                 critical_path_priorities=False):
 
         self.logger = logging.getLogger('engine.WorkflowEngineLoop')
 
@@ -179,11 +546,20 @@ class WorkflowEngineLoop(object):
 
         self._running_jobs_limits = running_jobs_limits
 
+        self._fair_share = fair_share
+
+        self._critical_path_priorities = critical_path_priorities
+
         self.logger.debug('queue_limits ' + repr(self._queue_limits))
         self.logger.debug(
             'running_jobs_limits ' + repr(self._running_jobs_limits))
 
         self._pending_queues = {}
+        self._active_jobs = {}
+        self._changed_jobs = {}
+        self._last_status_update = datetime.now()
+        self._persisted_wf_status = {}
+        self._db_updates = DatabaseUpdateBuffer(self._database_server)
 
         # The running flag is set to True at the beginning, not in start_loop(),
         # to overcome race conditions which may occur in this situation:
@@ -218,6 +594,10 @@ class WorkflowEngineLoop(object):
         # counter which may be used to synchronize things
         self._loop_count = 0
 
+        self._wake_event = threading.Event()
+        if hasattr(self._scheduler, 'set_job_ended_callback'):
+            self._scheduler.set_job_ended_callback(self.wake_up)
+
     def are_jobs_and_workflow_done(self):
         with self._lock:
             ended = len(self._jobs) == 0 and len(self._workflows) == 0
@@ -227,6 +607,13 @@ class WorkflowEngineLoop(object):
         '''
         Start the workflow engine loop. The loop will run until stop() is
         called.
+
+        Between two iterations the loop waits for an event (see
+        :meth:`wake_up`): job end notified by the scheduler, new submission,
+        kill or delete request, ended transfer... time_interval is only used
+        as a fallback timeout, to catch the changes which are not notified
+        (jobs in DRMS clusters, or changes made in the database by another
+        process).
         '''
         # one_wf_processed = False
         # Modif: don't set the running flag here, because the loop may be
@@ -240,6 +627,8 @@ class WorkflowEngineLoop(object):
         while True:
             if not self._running:
                 break
+            # events received from now on will trigger the next iteration
+            self._wake_event.clear()
             with self._lock:
                 ended_jobs = drms_error_jobs  # {}
                 wf_to_inspect = set()  # set of workflow id
@@ -294,16 +683,20 @@ class WorkflowEngineLoop(object):
                             # TBI how to communicate the error ?
                             self.logger.error(
                                 "!!!ERROR!!! stop job %s :%s" % (type(e), e))
+                        if job.exit_status is not None:
+                            self._active_jobs.pop(job_id, None)
                         if job_id in jobs_to_delete and job_id in self._jobs:
                             self.logger.debug("Delete job : " + repr(job_id))
                             self._database_server.delete_job(job_id)
                             del self._jobs[job_id]
+                            self._changed_jobs.pop(job_id, None)
                         else:
-                            self._database_server.set_job_status(job_id,
-                                                                 job.status,
-                                                                 force=True)
+                            self._db_updates.set_job_status(job_id,
+                                                            job.status,
+                                                            force=True)
                             if stopped:
                                 ended_jobs[job_id] = job
+                                self._changed_jobs[job_id] = job
                                 if job.workflow_id != -1:
                                     wf_to_inspect.add(job.workflow_id)
 
@@ -311,31 +704,66 @@ class WorkflowEngineLoop(object):
                     if wf_id in self._workflows:
                         self.logger.debug("Kill workflow : " + repr(wf_id))
                         ended_jobs_in_wf = self._stop_wf(wf_id)
+                        for job_id in ended_jobs_in_wf:
+                            self._active_jobs.pop(job_id, None)
                         if wf_id in wf_to_delete:
                             self.logger.debug(
                                 "Delete workflow : " + repr(wf_id))
                             self._database_server.delete_workflow(wf_id)
+                            self._persisted_wf_status.pop(wf_id, None)
+                            wf_jobs = self._workflows[wf_id].registered_jobs
+                            for job_id in wf_jobs:
+                                self._active_jobs.pop(job_id, None)
+                                self._changed_jobs.pop(job_id, None)
                             del self._workflows[wf_id]
                         else:
                             ended_jobs.update(ended_jobs_in_wf)
+                            self._changed_jobs.update(ended_jobs_in_wf)
                             wf_to_inspect.add(wf_id)
 
                 # --- 2. Update job status from the scheduler -----------------
                 # get back the termination status and terminate the jobs which
                 # ended
-                wf_jobs = {}
-                wf_transfers = {}
-                wf_tmp = {}
-                for wf in six.itervalues(self._workflows):
-                    # one_wf_processed = True
-                    # TBI add a condition on the workflow status
-                    wf_jobs.update(wf.registered_jobs)
-                    wf_transfers.update(wf.registered_tr)
-                    wf_tmp.update(wf.registered_tmp)
-
-                for job in itertools.chain(six.itervalues(self._jobs),
-                                           six.itervalues(wf_jobs)):
+                full_status_update = datetime.now() \
+                    - self._last_status_update \
+                    > timedelta(seconds=status_update_interval)
+                if full_status_update:
+                    # rebuild the index from scratch from time to time: it is
+                    # cheap enough at this rate, and makes sure no running job
+                    # is forgotten.
+                    self._active_jobs = {}
+                    self._register_active_jobs(
+                        itertools.chain(
+                            six.itervalues(self._jobs),
+                            *[six.itervalues(wf.registered_jobs)
+                              for wf in six.itervalues(self._workflows)]))
+
+                polled_jobs = []
+                for job in list(self._active_jobs.values()):
                     if job.exit_status == None and job.drmaa_id != None:
+                        polled_jobs.append(job)
+                    else:
+                        # ended or not submitted any longer
+                        del self._active_jobs[job.job_id]
+                # query all the jobs status at once
+                jobs_status = {}
+                if polled_jobs:
+                    try:
+                        jobs_status = self._scheduler.get_jobs_status(
+                            [job.drmaa_id for job in polled_jobs])
+                    except DRMError as e:
+                        self.logger.info(
+                            "!!!ERROR!!! get_jobs_status %s: %s"
+                            % (type(e), e))
+                ended_polled_jobs = []
+                for job in polled_jobs:
+                    previous_status = job.status
+                    status = jobs_status.get(job.drmaa_id)
+                    if status is not None:
+                        job.status = status
+                    else:
+                        # not in the bulk result: ask individually to get the
+                        # error
                         try:
                             job.status = self._scheduler.get_job_status(
                                 job.drmaa_id)
@@ -349,82 +777,120 @@ class WorkflowEngineLoop(object):
                                 "Error while requesting the job status %s: %s \nWarning: the job may still be running.\n" % (type(e), e))
                             stderr_file.close()
                             drms_error_jobs[job.job_id] = job
-                        self.logger.debug(
-                            "job " + repr(job.job_id) + " : " + job.status)
-                        if job.status == constants.DONE \
-                                or job.status == constants.FAILED:
-                            self.logger.debug(
-                                "End of job %s, drmaaJobId = %s, status= %s",
-                                job.job_id, job.drmaa_id, repr(job.status))
-                            try:
-                                (job.exit_status,
-                                 job.exit_value,
-                                 job.terminating_signal,
-                                 job.str_rusage) \
-                                    = self._scheduler.get_job_exit_info(
-                                        job.drmaa_id)
-                            except Exception as e:
-                                self.logger.error(
-                                    'exception in get_job_exit_info: %s' % repr(e))
-                                raise
-
-                            self.logger.debug("  after get_job_exit_info ")
-                            self.logger.debug(
-                                "  => exit_status " + repr(job.exit_status))
-                            self.logger.debug(
-                                "  => exit_value " + repr(job.exit_value))
-                            self.logger.debug(
-                                "  => signal " + repr(job.terminating_signal))
-                            self.logger.debug(
-                                "  => rusage " + repr(job.str_rusage))
-
-                            if job.workflow_id != -1:
-                                wf_to_inspect.add(job.workflow_id)
-                            if job.status == constants.DONE:
-                                for ft in job.referenced_output_files:
-                                    if isinstance(ft, FileTransfer):
-                                        transfer_id = job.transfer_mapping[
-                                            ft].transfer_id
-                                        self._database_server.set_transfer_status(
-                                            transfer_id,
-                                            constants.FILES_ON_CR)
-                                    else:
-                                        # TemporaryPath
-                                        temp_path_id = job.transfer_mapping[
-                                            ft].temp_path_id
-                                        self._database_server.set_temporary_status(
-                                            temp_path_id,
-                                            constants.FILES_ON_CR)
-                                self.read_job_output_dict(job)
-
-                            ended_jobs[job.job_id] = job
-                            self.logger.debug(
-                                "  => exit_status " + repr(job.exit_status))
-                            self.logger.debug(
-                                "  => exit_value " + repr(job.exit_value))
-                            self.logger.debug(
-                                "  => signal " + repr(job.terminating_signal))
+                    self.logger.debug(
+                        "job " + repr(job.job_id) + " : " + job.status)
+                    if job.status != previous_status:
+                        self._changed_jobs[job.job_id] = job
+                    if job.status == constants.DONE \
+                            or job.status == constants.FAILED:
+                        del self._active_jobs[job.job_id]
+                        ended_polled_jobs.append(job)
+
+                jobs_exit_info = {}
+                if ended_polled_jobs:
+                    try:
+                        jobs_exit_info = self._scheduler.get_jobs_exit_info(
+                            [job.drmaa_id for job in ended_polled_jobs])
+                    except Exception as e:
+                        self.logger.error(
+                            'exception in get_jobs_exit_info: %s' % repr(e))
+                for job in ended_polled_jobs:
+                    self.logger.debug(
+                        "End of job %s, drmaaJobId = %s, status= %s",
+                        job.job_id, job.drmaa_id, repr(job.status))
+                    exit_info = jobs_exit_info.get(job.drmaa_id)
+                    if exit_info is None:
+                        try:
+                            exit_info = self._scheduler.get_job_exit_info(
+                                job.drmaa_id)
+                        except Exception as e:
+                            self.logger.error(
+                                'exception in get_job_exit_info: %s' % repr(e))
+                            raise
+                    (job.exit_status,
+                     job.exit_value,
+                     job.terminating_signal,
+                     job.str_rusage) = exit_info
+
+                    self.logger.debug("  after get_job_exit_info ")
+                    self.logger.debug(
+                        "  => exit_status " + repr(job.exit_status))
+                    self.logger.debug(
+                        "  => exit_value " + repr(job.exit_value))
+                    self.logger.debug(
+                        "  => signal " + repr(job.terminating_signal))
+                    self.logger.debug(
+                        "  => rusage " + repr(job.str_rusage))
+
+                    if job.workflow_id != -1:
+                        wf_to_inspect.add(job.workflow_id)
+                    if job.status == constants.DONE:
+                        for ft in job.referenced_output_files:
+                            if isinstance(ft, FileTransfer):
+                                transfer_id = job.transfer_mapping[
+                                    ft].transfer_id
+                                self._db_updates.set_transfer_status(
+                                    transfer_id,
+                                    constants.FILES_ON_CR)
+                            else:
+                                # TemporaryPath
+                                temp_path_id = job.transfer_mapping[
+                                    ft].temp_path_id
+                                self._db_updates.set_temporary_status(
+                                    temp_path_id,
+                                    constants.FILES_ON_CR)
+                        self.read_job_output_dict(job)
+
+                    ended_jobs[job.job_id] = job
 
                 # --- 3. Get back transfered status ---------------------------
-                for transfer_id, transfer in six.iteritems(wf_transfers):
+                # only the transfers and temporary paths which files do not
+                # exist on the computing resource side yet can still change
+                # in a way which matters to the engine: the others are not
+                # polled.
+                wf_transfers = dict(
+                    [(transfer_id, transfer)
+                     for wf in six.itervalues(self._workflows)
+                     for transfer_id, transfer in six.iteritems(
+                         wf.registered_tr)
+                     if not transfer.files_exist_on_server()])
+                wf_tmp = dict(
+                    [(tmp_id, tmp)
+                     for wf in six.itervalues(self._workflows)
+                     for tmp_id, tmp in six.iteritems(wf.registered_tmp)
+                     if not tmp.files_exist_on_server()])
+                if wf_transfers:
                     try:
-                        status = self._database_server.get_transfer_status(
-                            transfer_id,
-                            self._user_id)
-                        transfer.status = status
+                        transfers_status \
+                            = self._database_server.get_transfers_status(
+                                list(wf_transfers.keys()), self._user_id)
                     except Exception:
-                        self.logger.exception('WorkflowEngineLoop')
-                for tmp_id, tmp in six.iteritems(wf_tmp):
+                        self.logger.exception(
+                            'WorkflowEngineLoop: get_transfers_status')
+                        transfers_status = {}
+                    for transfer_id, transfer in six.iteritems(wf_transfers):
+                        status = transfers_status.get(transfer_id,
+                                                      transfer.status)
+                        transfer.status = self._db_updates.transfer_status(
+                            transfer_id, status)
+                if wf_tmp:
                     try:
-                        status = self._database_server.get_temporary_status(
-                            tmp_id,
-                            self._user_id)
-                        tmp.status = status
+                        tmp_status \
+                            = self._database_server.get_temporaries_status(
+                                list(wf_tmp.keys()), self._user_id)
                     except Exception:
-                        logger.exception()
+                        self.logger.exception(
+                            'WorkflowEngineLoop: get_temporaries_status')
+                        tmp_status = {}
+                    for tmp_id, tmp in six.iteritems(wf_tmp):
+                        status = tmp_status.get(tmp_id, tmp.status)
+                        tmp.status = self._db_updates.temporary_status(
+                            tmp_id, status)
 
-                for wf_id in six.iterkeys(self._workflows):
-                    if self._database_server.pop_workflow_ended_transfer(wf_id):
+                if self._workflows:
+                    ended_transfers = self._database_server.pop_ended_transfers(
+                        list(self._workflows.keys()))
+                    for wf_id in ended_transfers:
                         self.logger.debug(
                             "ended transfer for the workflow " + repr(wf_id))
                         wf_to_inspect.add(wf_id)
@@ -442,8 +908,8 @@ class WorkflowEngineLoop(object):
                         "NEW status wf " + repr(wf_id) + " " + repr(status))
                     # jobs_to_run.extend(to_run)
                     ended_jobs.update(aborted_jobs)
-                    for job in to_run:
-                        self._pend_for_submission(job)
+                    self._changed_jobs.update(aborted_jobs)
+                    self._pend_jobs_for_submission(to_run)
 
                 # --- 5. Check if pending jobs can now be submitted -----------
                 self.logger.debug("Check pending jobs")
@@ -479,15 +945,17 @@ class WorkflowEngineLoop(object):
                         drms_error_jobs[job.job_id] = job
                     else:
                         drmaa_id_for_db_up[job.job_id] = job.drmaa_id
+                        self._active_jobs[job.job_id] = job
                         if job.is_engine_execution:
                             # Engine execution jobs immediately get the status
                             # DONE to avoid losing one time cycle
                             job.status = constants.DONE
                         else:
                             job.status = constants.UNDETERMINED
+                    self._changed_jobs[job.job_id] = job
 
                 if drmaa_id_for_db_up:
-                    self._database_server.set_submission_information(
+                    self._db_updates.set_submission_information(
                         drmaa_id_for_db_up,
                         datetime.now())
 
@@ -496,8 +964,15 @@ class WorkflowEngineLoop(object):
                 ended_wf_ids = []
                 self.logger.debug("update job and wf status ~~~~~~~~~~~~~~~ ")
                 job_status_for_db_up = {}
-                for job_id, job in itertools.chain(six.iteritems(self._jobs),
-                                                   six.iteritems(wf_jobs)):
+                updated_jobs = six.iteritems(self._changed_jobs)
+                if full_status_update:
+                    # the jobs which do not belong to a workflow are all
+                    # written (they are few). The workflows jobs only get a
+                    # heartbeat below.
+                    updated_jobs = itertools.chain(updated_jobs,
+                                                   six.iteritems(self._jobs))
+                    self._last_status_update = datetime.now()
+                for job_id, job in updated_jobs:
                     job_status_for_db_up[job_id] = job.status
                     self._j_wf_ended = self._j_wf_ended and \
                         (job.status == constants.DONE or
@@ -510,35 +985,84 @@ class WorkflowEngineLoop(object):
                         "job " + repr(job_id) + " " + repr(job.status))
 
                 if job_status_for_db_up:
-                    self._database_server.set_jobs_status(job_status_for_db_up)
+                    self._db_updates.set_jobs_status(job_status_for_db_up)
+                if full_status_update and self._workflows:
+                    # after the status update: the jobs which have just
+                    # ended are not touched
+                    self._db_updates.touch_workflow_jobs(
+                        list(self._workflows.keys()))
+                self._changed_jobs = {}
 
                 if len(ended_jobs):
-                    self._database_server.set_jobs_exit_info(ended_jobs)
+                    self._db_updates.set_jobs_exit_info(ended_jobs)
 
+                # only write the workflows status which have changed. The
+                # others only get a periodic heartbeat, all at once.
+                wf_to_touch = []
                 for wf_id, workflow in six.iteritems(self._workflows):
                     force = False
                     if wf_id in wf_to_kill + wf_to_delete:
                         force = True
-                    self.logger.debug("set workflow status for: %s, status: %s"
-                                      % (wf_id, workflow.status))
-                    self._database_server.set_workflow_status(
-                        wf_id, workflow.status,
-                        force=force)
+                    if force or workflow.status \
+                            != self._persisted_wf_status.get(wf_id):
+                        self.logger.debug(
+                            "set workflow status for: %s, status: %s"
+                            % (wf_id, workflow.status))
+                        self._db_updates.set_workflow_status(
+                            wf_id, workflow.status,
+                            force=force)
+                        self._persisted_wf_status[wf_id] = workflow.status
+                    elif full_status_update:
+                        wf_to_touch.append(wf_id)
                     if workflow.status == constants.WORKFLOW_DONE:
                         ended_wf_ids.append(wf_id)
                     self.logger.debug(
                         "wf " + repr(wf_id) + " " + repr(workflow.status))
+                if wf_to_touch:
+                    self._db_updates.touch_workflows(wf_to_touch)
                 self.logger.debug("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ")
 
                 for job_id in ended_job_ids:
                     del self._jobs[job_id]
                 for wf_id in ended_wf_ids:
                     del self._workflows[wf_id]
+                    del self._persisted_wf_status[wf_id]
+
+                if self._db_updates.age() >= self.update_window:
+                    self._db_updates.flush()
+
+                if drms_error_jobs:
+                    # they will be processed at the beginning of the next
+                    # iteration, no need to wait.
+                    self._wake_event.set()
 
             # if len(self._workflows) == 0 and one_wf_processed:
             #  break
             self._loop_count += 1
-            time.sleep(time_interval)
+            self._wake_event.wait(time_interval)
+
+        # write the updates still buffered before the loop ends
+        self.flush_database_updates()
+
+    def wake_up(self):
+        '''
+        Ask the loop to start a new iteration as soon as possible, without
+        waiting for the end of its time interval.
+
+        This method does not lock anything and may be called from any
+        thread, including the scheduler threads.
+        '''
+        self._wake_event.set()
+
+    def flush_database_updates(self):
+        '''
+        Write the database updates buffered by the loop.
+
+        Operations requested by clients call it first, so that they see (and
+        do not get overwritten by) the state the loop has already reached.
+        '''
+        with self._lock:
+            self._db_updates.flush()
 
     def read_job_output_dict(self, job):
         if job.has_outputs:
@@ -628,6 +1152,7 @@ class WorkflowEngineLoop(object):
     def stop_loop(self):
         with self._lock:
             self._running = False
+        self.wake_up()
 
     def wait_one_loop(self):
         # wait one full loop. The counter is incremented at the end of
@@ -642,11 +1167,13 @@ class WorkflowEngineLoop(object):
             # if the loop is not running, return immediately, otherwise we will
             # wait indefinitely.
             return
+        self.wake_up()
         next_count = current_count
         while next_count < current_count + 2:
             with self._lock:
                 next_count = self._loop_count
             if next_count < current_count + 2:
+                self.wake_up()
                 time.sleep(time_interval)
 
     def set_queue_limits(self, queue_limits):
@@ -700,6 +1227,7 @@ class WorkflowEngineLoop(object):
         # add to the engine managed job list
         with self._lock:
             self._jobs[engine_job.job_id] = engine_job
+        self.wake_up()
 
         return engine_job
 
@@ -709,15 +1237,64 @@ class WorkflowEngineLoop(object):
         The jobs to submit after add_job, add_workflow and restart_workflow are
         first stored in _pending_queues waiting to be submitted.
         '''
+        self._pend_jobs_for_submission([engine_job])
+
+    def _pend_jobs_for_submission(self, engine_jobs):
+        '''
+        Same as _pend_for_submission() for several jobs at once.
+        '''
         with self._lock:
-            if engine_job.queue in self._pending_queues:
-                self._pending_queues[engine_job.queue].append(engine_job)
-                self._pending_queues[engine_job.queue].sort(
-                    key=lambda job: job.priority,
-                    reverse=True)
-            else:
-                self._pending_queues[engine_job.queue] = [engine_job]
-            engine_job.status = constants.SUBMISSION_PENDING
+            queues = {}
+            for engine_job in engine_jobs:
+                queues.setdefault(engine_job.queue, []).append(engine_job)
+                engine_job.status = constants.SUBMISSION_PENDING
+                self._changed_jobs[engine_job.job_id] = engine_job
+            for queue_name, jobs in six.iteritems(queues):
+                pending_queue = self._pending_queues.get(queue_name)
+                if pending_queue is None:
+                    if self._fair_share:
+                        pending_queue = FairSharePendingQueue()
+                    else:
+                        pending_queue = PendingQueue()
+                    self._pending_queues[queue_name] = pending_queue
+                pending_queue.extend(jobs)
+
+    def pending_queues_info(self):
+        '''
+        State of the submission pending queues.
+
+        Returns
+        -------
+        info: dict
+            queue name -> (number of pending jobs, time in seconds the oldest
+            pending job has been waiting, or None if the queue is empty)
+        '''
+        with self._lock:
+            return dict([(queue_name, (len(pending_queue),
+                                       pending_queue.oldest_wait()))
+                         for queue_name, pending_queue
+                         in six.iteritems(self._pending_queues)])
+
+    def scheduler_stats(self):
+        '''
+        Current state of the scheduler: see :meth:`Scheduler.stats
+        <soma_workflow.scheduler.Scheduler.stats>`.
+        '''
+        return self._scheduler.stats()
+
+    def _register_active_jobs(self, jobs):
+        '''
+        Index the jobs which have been submitted to the scheduler and have not
+        ended yet, so that the loop polls their status.
+
+        Parameters
+        ----------
+        jobs: iterable of EngineJob
+        '''
+        with self._lock:
+            for job in jobs:
+                if job.exit_status is None and job.drmaa_id is not None:
+                    self._active_jobs[job.job_id] = job
 
     def _get_pending_job_to_submit(self):
         '''
@@ -744,7 +1321,7 @@ class WorkflowEngineLoop(object):
                                   + repr(nb_jobs_to_run))
                 while nb_jobs_to_run > 0 and \
                         len(self._pending_queues[queue_name]) > 0:
-                    to_run.append(self._pending_queues[queue_name].pop(0))
+                    to_run.append(self._pending_queues[queue_name].pop())
                     nb_jobs_to_run = nb_jobs_to_run - 1
             elif jobs and queue_name in self._queue_limits:
                 nb_queued_jobs = self._database_server.nb_queued_jobs(
@@ -756,11 +1333,10 @@ class WorkflowEngineLoop(object):
                     nb_queued_jobs) + " nb_jobs_to_run " + repr(nb_jobs_to_run))
                 while nb_jobs_to_run > 0 and \
                         len(self._pending_queues[queue_name]) > 0:
-                    to_run.append(self._pending_queues[queue_name].pop(0))
+                    to_run.append(self._pending_queues[queue_name].pop())
                     nb_jobs_to_run = nb_jobs_to_run - 1
             else:
-                to_run.extend(jobs)
-                self._pending_queues[queue_name] = []
+                to_run.extend(jobs.pop_all())
         # self.logger.debug("to_run " + repr(to_run))
         return to_run
 
@@ -783,6 +1359,8 @@ class WorkflowEngineLoop(object):
                                          expiration_date,
                                          name,
                                          container_command=container_command)
+        if self._critical_path_priorities:
+            self._set_critical_path_priorities(engine_workflow)
 
         engine_workflow = self._database_server.add_workflow(
             self._user_id, engine_workflow, login=self._user_login)
@@ -831,14 +1409,31 @@ class WorkflowEngineLoop(object):
         # submit independant jobs
         (jobs_to_run,
          engine_workflow.status) = engine_workflow.find_out_independant_jobs()
-        for job in jobs_to_run:
-            self._pend_for_submission(job)
+        self._pend_jobs_for_submission(jobs_to_run)
         # add to the engine managed workflow list
         with self._lock:
             self._workflows[engine_workflow.wf_id] = engine_workflow
+        self.wake_up()
 
         return engine_workflow.wf_id
 
+    def _set_critical_path_priorities(self, engine_workflow):
+        '''
+        Compute the critical path of the jobs of a workflow, using their
+        duration hints or the mean duration of the previous runs of jobs with
+        the same name.
+        '''
+        names = set([job.name
+                     for job in six.itervalues(engine_workflow.job_mapping)
+                     if job.duration_hint is None
+                     and not job.is_engine_execution])
+        durations = self._database_server.get_jobs_mean_duration(
+            self._user_id, names)
+        length = engine_workflow.set_critical_path_priorities(durations)
+        self.logger.debug('workflow %s: critical path: %f s, %d durations '
+                          'known from previous runs'
+                          % (engine_workflow.name, length, len(durations)))
+
     def _stop_job(self, job_id, job):
         if job.status == constants.DONE or job.status == constants.FAILED:
             return False
@@ -855,6 +1450,11 @@ class WorkflowEngineLoop(object):
                 elif job.queue in self._pending_queues and \
                         job in self._pending_queues[job.queue]:
                     self._pending_queues[job.queue].remove(job)
+                if job.status == constants.NOT_SUBMITTED \
+                        and job.workflow_id in self._workflows:
+                    # the workflow does not follow the jobs which are
+                    # waiting for their dependencies
+                    self._workflows[job.workflow_id].reset_dependency_state()
                 if job.status in (
                     constants.RUNNING, constants.SYSTEM_SUSPENDED,
                     constants.USER_SUSPENDED,
@@ -886,28 +1486,34 @@ class WorkflowEngineLoop(object):
 
     def restart_workflow(self, wf_id, queue):
         with self._lock:
+            self._db_updates.flush()
+            # the status may have been changed in the database: make sure it
+            # is written again
+            self._persisted_wf_status.pop(wf_id, None)
             if wf_id in self._workflows:
                 workflow = self._workflows[wf_id]
                 workflow.queue = queue
                 (jobs_to_run, status) \
                     = workflow.restart(self._database_server, queue)
                 workflow.status = status
-                for job in jobs_to_run:
-                    self._pend_for_submission(job)
+                self._pend_jobs_for_submission(jobs_to_run)
             else:
                 workflow = self._database_server.get_engine_workflow(
                     wf_id, self._user_id)
                 (jobs_to_run, status) = workflow.restart(
                     self._database_server, queue)
+                self._register_active_jobs(
+                    six.itervalues(workflow.registered_jobs))
                 workflow.status = status
-                for job in jobs_to_run:
-                    self._pend_for_submission(job)
+                self._pend_jobs_for_submission(jobs_to_run)
                 # add to the engine managed workflow list
                 with self._lock:
                     self._workflows[wf_id] = workflow
+            self.wake_up()
             return status
 
     def force_stop(self, wf_id):
+        self.flush_database_updates()
         if wf_id in self._workflows:
             pass
         else:
@@ -915,9 +1521,12 @@ class WorkflowEngineLoop(object):
                                                                  self._user_id)
             workflow.force_stop(self._database_server)
             with self._lock:
+                self._persisted_wf_status.pop(wf_id, None)
                 self._workflows[wf_id] = workflow
+            self.wake_up()
 
     def restart_job(self, job_id, status):
+        self.flush_database_updates()
         (job, workflow_id) = self._database_server.get_engine_job(
             job_id, self._user_id)
         if workflow_id == -1:
@@ -930,8 +1539,10 @@ class WorkflowEngineLoop(object):
         else:
             self._database_server.set_job_status(
                 job_id, constants.NOT_SUBMITTED)
+        self.wake_up()
 
     def stop_jobs(self, workflow_id, job_ids):
+        self.flush_database_updates()
         (status, last_status_update) \
             = self._database_server.get_workflow_status(
                 workflow_id, self._user_id)
@@ -939,6 +1550,7 @@ class WorkflowEngineLoop(object):
         if status != constants.WORKFLOW_DONE:
             self._database_server.set_jobs_status(
                 dict([(job_id, constants.KILL_PENDING) for job_id in job_ids]))
+            self.wake_up()
 
     def restart_jobs(self, wf_id, job_ids):
         with self._lock:
@@ -956,8 +1568,8 @@ class WorkflowEngineLoop(object):
             jobs_to_run = workflow.restart_jobs(
                 self._database_server, extended_job_ids, check_deps=False)
             print('can re-run immediately:', [j.job_id for j in jobs_to_run])
-            for job in jobs_to_run:
-                self._pend_for_submission(job)
+            self._pend_jobs_for_submission(jobs_to_run)
+        self.wake_up()
 
     def drms_job_id(self, wf_id, job_id):
         engine_wf = self._workflows.get(wf_id)
@@ -990,7 +1602,9 @@ class WorkflowEngine(RemoteFileController):
                  path_translation=None,
                  queue_limits={},
                  running_jobs_limits={},
-                 container_command=None):
+                 container_command=None,
+                 fair_share=False,
+                 critical_path_priorities=False):
         '''
         @type  database_server:
                L{soma_workflow.database_server.WorkflowDatabaseServer}
@@ -1018,7 +1632,9 @@ class WorkflowEngine(RemoteFileController):
                                               scheduler,
                                               path_translation,
                                               queue_limits,
-                                              running_jobs_limits)
+                                              running_jobs_limits,
+                                              fair_share,
+                                              critical_path_priorities)
         self.engine_loop_thread = EngineLoopThread(self.engine_loop)
         self.engine_loop_thread.setDaemon(True)
         self.engine_loop_thread.start()
@@ -1072,6 +1688,7 @@ class WorkflowEngine(RemoteFileController):
         Set a transfer status.
         '''
         self._database_server.set_transfer_status(transfer_id, status)
+        self.engine_loop.wake_up()
 
     def delete_transfer(self, transfer_id):
         '''
@@ -1090,6 +1707,7 @@ class WorkflowEngine(RemoteFileController):
         if workflow_id != -1:
             self._database_server.add_workflow_ended_transfer(
                 workflow_id, transfer_id)
+            self.engine_loop.wake_up()
 
     # JOB SUBMISSION ##################################################
     def submit_job(self, job, queue):
@@ -1108,6 +1726,7 @@ class WorkflowEngine(RemoteFileController):
         '''
         Implementation of soma_workflow.client.WorkflowController API
         '''
+        self.engine_loop.flush_database_updates()
         status = self._database_server.get_job_status(job_id,
                                                       self._user_id)[0]
         if status == constants.DONE or status == constants.FAILED:
@@ -1116,6 +1735,7 @@ class WorkflowEngine(RemoteFileController):
         else:
             self._database_server.set_job_status(
                 job_id, constants.DELETE_PENDING)
+            self.engine_loop.wake_up()
             if force and not self._wait_for_job_deletion(job_id):
                 self.logger.critical(
                     "!! The job may not be properly deleted !!")
@@ -1155,7 +1775,7 @@ class WorkflowEngine(RemoteFileController):
         '''
         Implementation of soma_workflow.client.WorkflowController API
         '''
-
+        self.engine_loop.flush_database_updates()
         status = self._database_server.get_workflow_status(workflow_id,
                                                            self._user_id)[0]
         if status == constants.WORKFLOW_DONE:
@@ -1173,6 +1793,7 @@ class WorkflowEngine(RemoteFileController):
 
             self._database_server.set_workflow_status(workflow_id,
                                                       constants.DELETE_PENDING)
+            self.engine_loop.wake_up()
             if force and not self._wait_for_wf_deletion(workflow_id):
                 self.logger.critical(
                     "The workflow may not be properly deleted.")
@@ -1181,7 +1802,7 @@ class WorkflowEngine(RemoteFileController):
             return True
 
     def stop_workflow(self, workflow_id):
-
+        self.engine_loop.flush_database_updates()
         (status,
          last_status_update) = self._database_server.get_workflow_status(workflow_id, self._user_id)
 
@@ -1192,6 +1813,7 @@ class WorkflowEngine(RemoteFileController):
             else:
                 self._database_server.set_workflow_status(
                     workflow_id, constants.KILL_PENDING)
+                self.engine_loop.wake_up()
                 self._wait_wf_status_update(
                     workflow_id, expected_status=constants.WORKFLOW_DONE)
 
@@ -1372,6 +1994,13 @@ class WorkflowEngine(RemoteFileController):
 
         return job_exit_info
 
+    def workflow_resource_usage(self, wf_id):
+        '''
+        Implementation of soma_workflow.client.WorkflowController API
+        '''
+        return self._database_server.get_workflow_resource_usage(
+            wf_id, self._user_id)
+
     def stdouterr_file_path(self, job_id):
         (stdout_file,
          stderr_file) = self._database_server.get_std_out_err_file_path(job_id,
@@ -1457,7 +2086,7 @@ class WorkflowEngine(RemoteFileController):
         '''
         Implementation of soma_workflow.client.WorkflowController API
         '''
-
+        self.engine_loop.flush_database_updates()
         (status,
          last_status_update) = self._database_server.get_job_status(job_id,
                                                                     self._user_id)
@@ -1472,7 +2101,7 @@ class WorkflowEngine(RemoteFileController):
         '''
         Implementation of soma_workflow.client.WorkflowController API
         '''
-
+        self.engine_loop.flush_database_updates()
         (status,
          last_status_update) = self._database_server.get_job_status(job_id,
                                                                     self._user_id)
@@ -1484,6 +2113,7 @@ class WorkflowEngine(RemoteFileController):
             else:
                 self._database_server.set_job_status(job_id,
                                                      constants.KILL_PENDING)
+                self.engine_loop.wake_up()
 
             self._wait_job_status_update(job_id)
 
@@ -1569,6 +2199,19 @@ class WorkflowEngine(RemoteFileController):
     def drms_job_id(self, wf_id, job_id):
         return self.engine_loop.drms_job_id(wf_id, job_id)
 
+    def pending_queues_info(self):
+        '''
+        State of the engine submission pending queues: see
+        :meth:`WorkflowEngineLoop.pending_queues_info`.
+        '''
+        return self.engine_loop.pending_queues_info()
+
+    def scheduler_stats(self):
+        '''
+        Implementation of soma_workflow.client.WorkflowController API
+        '''
+        return self.engine_loop.scheduler_stats()
+
 
 class ConfiguredWorkflowEngine(WorkflowEngine):
 
@@ -1591,7 +2234,9 @@ class ConfiguredWorkflowEngine(WorkflowEngine):
             path_translation=config.get_path_translation(),
             queue_limits=config.get_queue_limits(),
             running_jobs_limits=config.get_running_jobs_limits(),
-            container_command=config.get_container_command())
+            container_command=config.get_container_command(),
+            fair_share=config.get_fair_share(),
+            critical_path_priorities=config.get_critical_path_priorities())
 
         self.config = config
 
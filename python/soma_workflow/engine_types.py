@@ -25,6 +25,7 @@ module required in the engine module.
 
 import io
 import os
+import collections
 import logging
 import tempfile
 import weakref
@@ -43,6 +44,103 @@ from soma_workflow.client import Job, EngineExecutionJob, SpecialPath, \
 import sys
 
 
+# version of the representation of engine workflows and jobs stored in the
+# database (see EngineWorkflow.to_database_dict()). Format 1 was encoded
+# using utils.to_json(), format 2 uses utils.to_json_dicts().
+DATABASE_DICT_FORMAT = 2
+
+
+# serialized jobs attributes (see Job.to_dict()) which are not stored in the
+# database when they have these values: Job.from_dict() gives them the same
+# values when they are missing.
+_job_dict_defaults = {'class': 'soma_workflow.client_types.Job',
+                      'join_stderrout': False,
+                      'priority': 0,
+                      'native_specification': None,
+                      'parallel_job_info': None,
+                      'disposal_timeout': 168,
+                      'env': None,
+                      'use_input_params_file': False,
+                      'has_outputs': False,
+                      'configuration': {},
+                      'duration_hint': None,
+                      'memory_requirement': None}
+
+
+def _check_database_dict_format(d):
+    if d.get('format', 0) > DATABASE_DICT_FORMAT:
+        raise WorkflowError('The workflow or job has been stored by a newer '
+                            'version of Soma-Workflow (format %s, this '
+                            'version supports format %d)'
+                            % (d.get('format'), DATABASE_DICT_FORMAT))
+
+
+def _date_to_list(value):
+    if value is None:
+        return None
+    return list(value.timetuple()[:6]) + [value.microsecond]
+
+
+def _transfers_database_info(id_maps, transfer_mapping):
+    '''
+    Engine information of the transfers and temporary paths of a serialized
+    workflow (see Workflow.to_dict()), which cannot be rebuilt from the client
+    objects: ids, engine paths (and client paths which may have been changed
+    by jobs outputs) and status, indexed by serialization ids.
+    '''
+    transfers = {}
+    for transfer, ident in six.iteritems(id_maps['file_transfers']):
+        etransfer = transfer_mapping.get(transfer)
+        if etransfer is not None:
+            transfers[str(ident)] = [etransfer.transfer_id,
+                                     etransfer.engine_path,
+                                     etransfer.status,
+                                     etransfer.client_path,
+                                     etransfer.client_paths]
+    temporaries = {}
+    for temp_path, ident in six.iteritems(id_maps['temporary_paths']):
+        etemp = transfer_mapping.get(temp_path)
+        if etemp is not None:
+            temporaries[str(ident)] = [etemp.temp_path_id,
+                                       etemp.engine_path, etemp.status]
+    return {'file_transfers': transfers, 'temporary_paths': temporaries}
+
+
+def _set_transfers_database_info(info, id_maps, transfer_mapping,
+                                 workflow_id):
+    '''
+    Set back the information built by _transfers_database_info() into the
+    engine transfers and temporary paths.
+
+    Returns
+    -------
+    registered: tuple
+        (dict transfer_id -> EngineTransfer,
+        dict temp_path_id -> EngineTemporaryPath)
+    '''
+    registered_tr = {}
+    for ident, (transfer_id, engine_path, status, client_path,
+                client_paths) in six.iteritems(info['file_transfers']):
+        etransfer = transfer_mapping[id_maps['file_transfers'][int(ident)]]
+        etransfer.transfer_id = transfer_id
+        etransfer.engine_path = engine_path
+        etransfer.status = status
+        etransfer.client_path = client_path
+        etransfer.client_paths = client_paths
+        etransfer.workflow_id = workflow_id
+        registered_tr[transfer_id] = etransfer
+    registered_tmp = {}
+    for ident, (temp_path_id, engine_path, status) \
+            in six.iteritems(info['temporary_paths']):
+        etemp = transfer_mapping[id_maps['temporary_paths'][int(ident)]]
+        etemp.temp_path_id = temp_path_id
+        etemp.engine_path = engine_path
+        etemp.status = status
+        etemp.workflow_id = workflow_id
+        registered_tmp[temp_path_id] = etemp
+    return (registered_tr, registered_tmp)
+
+
 class EngineJob(Job):
 
     '''
@@ -128,6 +226,12 @@ class EngineJob(Job):
     # job class
     job_class = None
 
+    # length (in seconds) of the longest dependencies path from the job to the
+    # end of its workflow, including the job itself (see
+    # EngineWorkflow.set_critical_path_priorities()). Jobs of the same
+    # priority are scheduled by decreasing critical path.
+    critical_path = 0.
+
     def __init__(self,
                  client_job,
                  queue,
@@ -157,7 +261,9 @@ class EngineJob(Job):
             has_outputs=client_job.has_outputs,
             input_params_file=client_job.input_params_file,
             output_params_file=client_job.output_params_file,
-            configuration=client_job.configuration)
+            configuration=client_job.configuration,
+            duration_hint=client_job.duration_hint,
+            memory_requirement=client_job.memory_requirement)
 
         self.job_id = -1
 
@@ -196,6 +302,80 @@ class EngineJob(Job):
 
         self._map()
 
+    @classmethod
+    def _restore(cls, client_job, queue, workflow_id, path_translation,
+                 transfer_mapping, container_command, wf_env):
+        '''
+        Build the engine job of a client job of a workflow restored from the
+        database (see :meth:`EngineWorkflow.from_database_dict`), like the
+        constructor does, but without copying the client job attributes
+        through the Job constructor. transfer_mapping must already contain
+        the engine versions of the workflow transfers and temporary paths.
+
+        Mapping the paths of the job to their engine version is postponed
+        until they are needed to build its command (see
+        :meth:`_get_path_mapping`), unless it also changes the referenced
+        files.
+        '''
+        job = cls.__new__(cls)
+        state = job.__dict__
+        state.update(client_job.__dict__)
+        state.pop('class', None)
+        # as Job.__init__() does
+        if not job.referenced_input_files:
+            job.referenced_input_files = []
+        if not job.referenced_output_files:
+            job.referenced_output_files = []
+        if not job.param_dict:
+            job.param_dict = {}
+        if not job.name and len(job.command) != 0:
+            job.name = job.command[0]
+
+        state.update({
+            'job_id': -1,
+            'drmaa_id': None,
+            'status': constants.NOT_SUBMITTED,
+            'exit_status': None,
+            'exit_value': None,
+            'terminating_signal': None,
+            'workflow_id': workflow_id,
+            'queue': queue,
+            'path_translation': path_translation,
+            'container_command': container_command,
+            'transfer_mapping': transfer_mapping,
+            'is_engine_execution': isinstance(client_job,
+                                              EngineExecutionJob)})
+        if wf_env:
+            env = dict(wf_env)
+            if job.env:
+                env.update(job.env)
+            job.env = env
+        job.job_class = type(client_job)
+
+        job.path_mapping = None
+        if isinstance(job.stdin, SpecialPath) \
+                or isinstance(job.working_directory, SpecialPath) \
+                or isinstance(job.stdout_file, SpecialPath) \
+                or isinstance(job.stderr_file, SpecialPath) \
+                or (job.use_input_params_file
+                    and isinstance(job.input_params_file, SpecialPath)) \
+                or (job.has_outputs
+                    and isinstance(job.output_params_file, SpecialPath)):
+            # _map() adds them to the referenced files
+            job._get_path_mapping()
+        return job
+
+    def _get_path_mapping(self):
+        '''
+        Mapping between the SpecialPath objects of the job and their engine
+        version. It is built when first needed for jobs restored from the
+        database (see :meth:`_restore`).
+        '''
+        if self.path_mapping is None:
+            self.path_mapping = {}
+            self._map()
+        return self.path_mapping
+
     def _map(self):
         '''
         Fill the transfer_mapping and srp_mapping attributes.
@@ -376,15 +556,16 @@ class EngineJob(Job):
             # done on a tuple (mode=="Tuple"), we only recover the directory path
             # (get_engine_path), else we get the path to the main file
             # (get_engine_main_path)
+            path_mapping = self._get_path_mapping()
             if mode == "Tuple":
                 new_command = (
                     command.pattern
-                    % self.path_mapping[command].get_engine_path())
+                    % path_mapping[command].get_engine_path())
                 new_command = six.ensure_str(new_command, 'utf-8')
             else:
                 new_command = (
                     command.pattern
-                    % self.path_mapping[command].get_engine_main_path())
+                    % path_mapping[command].get_engine_main_path())
                 new_command = six.ensure_str(new_command, 'utf-8')
         else:
             # If the entry is anything else, we return its string
@@ -472,6 +653,18 @@ class EngineJob(Job):
             self.status != constants.DONE
         return running
 
+    def scheduling_priority(self):
+        '''
+        Key used to order the jobs waiting to be run: jobs with higher keys
+        are run first.
+
+        Returns
+        -------
+        priority: tuple
+            (priority, critical_path)
+        '''
+        return (self.priority, self.critical_path)
+
     def is_done(self):
         done = self.status == constants.DONE or self.status == constants.FAILED
         return done
@@ -490,6 +683,72 @@ class EngineJob(Job):
             self.terminating_signal == None
         return success
 
+    # job attributes which values may be allocated by the database server
+    _database_files = ('stdout_file', 'stderr_file', 'input_params_file',
+                       'output_params_file')
+
+    def _database_info(self, client_job):
+        '''
+        Engine information of the job which cannot be rebuilt from its client
+        job: [job_id, critical_path, files allocated by the database server
+        (None when they are given by the client job)].
+        '''
+        info = [self.job_id, self.critical_path]
+        for attribute in self._database_files:
+            if getattr(client_job, attribute, None):
+                info.append(None)
+            else:
+                info.append(getattr(self, attribute))
+        return info
+
+    def _set_database_info(self, info):
+        '''
+        Set back the information built by _database_info().
+        '''
+        self.job_id, self.critical_path = info[:2]
+        for attribute, value in zip(self._database_files, info[2:]):
+            if value is not None:
+                setattr(self, attribute, value)
+
+    def to_database_dict(self):
+        '''
+        Compact, JSON-serializable representation of a job which does not
+        belong to a workflow, stored in the database instead of a pickle. See
+        :meth:`EngineWorkflow.to_database_dict`.
+        '''
+        id_maps = {}
+        # the job is serialized as a client job, files included
+        wf_dict = Workflow([self]).to_dict(id_maps)
+        job_dict = wf_dict['serialized_jobs'][str(id_maps['jobs'][self])]
+        job_dict['class'] = '%s.%s' % (self.job_class.__module__,
+                                       self.job_class.__name__)
+        d = {'format': DATABASE_DICT_FORMAT,
+             'workflow': wf_dict,
+             'info': self._database_info(self),
+             'queue': self.queue,
+             'workflow_id': self.workflow_id,
+             'path_translation': self.path_translation,
+             'container_command': self.container_command}
+        d.update(_transfers_database_info(id_maps, self.transfer_mapping))
+        return d
+
+    @classmethod
+    def from_database_dict(cls, d):
+        '''
+        Build a job from its database representation (see
+        :meth:`to_database_dict`).
+        '''
+        _check_database_dict_format(d)
+        id_maps = {}
+        client_job = Workflow.from_dict(d['workflow'], id_maps).jobs[0]
+        job = cls(client_job, d['queue'], workflow_id=d['workflow_id'],
+                  path_translation=d['path_translation'],
+                  container_command=d['container_command'])
+        job._set_database_info(d['info'])
+        _set_transfers_database_info(d, id_maps, job.transfer_mapping,
+                                     job.workflow_id)
+        return job
+
     def engine_execution(self):
         func = getattr(self.job_class, 'engine_execution', None)
         if func:
@@ -547,16 +806,34 @@ class EngineWorkflow(Workflow):
     container_command = None
 
     # for each job: list of all the jobs which have to end before a job can start
-    # dictionary: job_id -> list of job id
+    # dictionary: Job -> list of Job
     _dependency_dict = None
 
+    # for each job: list of the jobs which depend on it (reverse of
+    # _dependency_dict). Built when needed, see _get_successor_dict().
+    # dictionary: Job -> list of Job
+    _successor_dict = None
+
+    # registered jobs ids index. Built when needed, see _get_client_job().
+    # dictionary: job_id -> Job
+    _client_job_dict = None
+
     # A workflow object. For serialisation purposes with serpent
     _client_workflow = None
 
+    # environment variables set to all jobs (see get_environ()), dict
+    _environ = None
+
+    # EngineWorkflow.DependencyState, built when needed. It is reset (set to
+    # None) whenever the jobs states are changed outside of the engine loop
+    # follow-up (restart, force stop, kill of waiting jobs...).
+    cache = None
+    _do_not_pickle = ('cache', '_successor_dict', '_client_job_dict')
+
     logger = None
 
-    def to_dict(self):
-        wf_dict = super(EngineWorkflow, self).to_dict()
+    def to_dict(self, id_maps=None):
+        wf_dict = super(EngineWorkflow, self).to_dict(id_maps)
 
         # path_translation
         # queue
@@ -590,16 +867,108 @@ class EngineWorkflow(Workflow):
         return cls(client_workflow, path_translation, queue, expiration_date,
                    name, container_command=container_command)
 
-    class WorkflowCache(object):
+    def to_database_dict(self):
+        '''
+        Compact, JSON-serializable representation of the workflow, stored in
+        the database instead of a pickle: it does not depend on the python
+        version, and is much smaller.
+
+        It contains the client workflow (see :meth:`Workflow.to_dict`) and
+        the engine information which cannot be rebuilt from it: identifiers
+        and files allocated by the database server. The environment variables
+        common to all jobs are stored once. See :meth:`from_database_dict`.
+        '''
+        id_maps = {}
+        wf_dict = self.to_dict(id_maps)
+        for job_dict in six.itervalues(wf_dict['serialized_jobs']):
+            for key, value in six.iteritems(_job_dict_defaults):
+                if key in job_dict and job_dict[key] == value \
+                        and type(job_dict[key]) is type(value):
+                    del job_dict[key]
+        jobs = {}
+        for job, ident in six.iteritems(id_maps['jobs']):
+            jobs[str(ident)] = self.job_mapping[job]._database_info(job)
+        d = {'format': DATABASE_DICT_FORMAT,
+             'workflow': wf_dict,
+             'jobs': jobs,
+             'wf_id': self.wf_id,
+             'name': self.name,
+             'queue': self.queue,
+             'expiration_date': _date_to_list(self.expiration_date),
+             'path_translation': self._path_translation,
+             'environ': self._environ}
+        d.update(_transfers_database_info(id_maps, self.transfer_mapping))
+        if self.user_storage is not None:
+            d['user_storage'] = self.user_storage
+        return d
+
+    @classmethod
+    def from_database_dict(cls, d):
+        '''
+        Build a workflow from its database representation (see
+        :meth:`to_database_dict`).
+        '''
+        _check_database_dict_format(d)
+        id_maps = {}
+        client_workflow = Workflow.from_dict(d['workflow'], id_maps)
+        client_workflow.user_storage = d.get('user_storage')
+        if 'uuid' in d['workflow']:
+            client_workflow.uuid = d['workflow']['uuid']
+        expiration_date = d['expiration_date']
+        if expiration_date is not None:
+            expiration_date = datetime.datetime(*expiration_date)
+        container_command = d['workflow'].get('container_command')
+        # the engine jobs are restored directly, rather than built again by
+        # the constructor
+        transfer_mapping = {}
+        for transfer in six.itervalues(id_maps['file_transfers']):
+            transfer_mapping[transfer] = EngineTransfer(transfer)
+        for temp_path in six.itervalues(id_maps['temporary_paths']):
+            transfer_mapping[temp_path] = get_EngineTemporaryPath(temp_path)
+        job_mapping = {}
+        for job in client_workflow.jobs:
+            job_mapping[job] = EngineJob._restore(
+                job, d['queue'], -1, d['path_translation'], transfer_mapping,
+                container_command, d['environ'])
+        workflow = cls(client_workflow, d['path_translation'], d['queue'],
+                       expiration_date, d['name'],
+                       container_command=container_command,
+                       environ=d['environ'], job_mapping=job_mapping,
+                       transfer_mapping=transfer_mapping)
+        workflow.wf_id = d['wf_id']
+        workflow.registered_tr, workflow.registered_tmp \
+            = _set_transfers_database_info(d, id_maps,
+                                           workflow.transfer_mapping,
+                                           workflow.wf_id)
+        job_from_ids = id_maps['jobs']
+        for ident, info in six.iteritems(d['jobs']):
+            job = workflow.job_mapping[job_from_ids[int(ident)]]
+            job._set_database_info(info)
+            job.workflow_id = workflow.wf_id
+            workflow.registered_jobs[job.job_id] = job
+        return workflow
+
+    class DependencyState(object):
+
+        '''
+        Incremental state of the workflow jobs used by
+        :meth:`EngineWorkflow.find_out_jobs_to_process`. Jobs are client jobs
+        (keys of job_mapping).
+        '''
 
         def __init__(self):
-            self.waiting_jobs = set()
-            self.to_run = set()
-            self.dependencies = {}
-            self.done = set()
-            self.running = set()
-            self.to_abort = set()
-            self.has_new_failed_jobs = False
+            # job -> number of dependencies which have not ended with success
+            self.unmet = {}
+            # not submitted jobs which dependencies have all ended with
+            # success: they can run as soon as their input files are there.
+            self.candidates = set()
+            # submitted jobs which have not ended yet
+            self.active = set()
+            # number of ended jobs
+            self.ndone = 0
+            # ended jobs which failed, and which successors have not been
+            # aborted yet
+            self.new_failed = []
 
     def __init__(self,
                  client_workflow,
@@ -607,7 +976,28 @@ class EngineWorkflow(Workflow):
                  queue,
                  expiration_date,
                  name,
-                 container_command=None):
+                 container_command=None,
+                 environ=None,
+                 job_mapping=None,
+                 transfer_mapping=None):
+        '''
+        Parameters
+        ----------
+        client_workflow: Workflow
+        path_translation: dict
+        queue: str
+        expiration_date: datetime.datetime
+        name: str
+        container_command: list or None
+        environ: dict or None
+            environment variables set to all jobs. If None, they are built by
+            get_environ().
+        job_mapping: dict or None
+            engine jobs already built for (some of) the client jobs
+        transfer_mapping: dict or None
+            engine transfers and temporary paths already built for (some of)
+            the client ones. It is shared with the jobs of job_mapping.
+        '''
         logging.debug("Within Engine workflow constructor")
 
         super(EngineWorkflow, self).__init__(
@@ -634,9 +1024,12 @@ class EngineWorkflow(Workflow):
         if hasattr(client_workflow, 'uuid'):
             self.uuid = client_workflow.uuid
 
-        self.job_mapping = {}
-        self.transfer_mapping = {}
+        self.job_mapping = job_mapping or {}
+        if transfer_mapping is None:
+            transfer_mapping = {}
+        self.transfer_mapping = transfer_mapping
         self.container_command = container_command
+        self._environ = environ
         self._map()
 
         self.registered_tr = {}
@@ -650,8 +1043,6 @@ class EngineWorkflow(Workflow):
             else:
                 self._dependency_dict[dep[1]] = [dep[0]]
         self.cache = None
-        # begin without cache because it also has an overhead
-        self.use_cache = False
 
     def get_environ(self):
         ''' Get environment variables dict for the workflow. This environment
@@ -688,7 +1079,9 @@ class EngineWorkflow(Workflow):
         + type checking
         '''
         # get workflow environment variables
-        env = self.get_environ()
+        if self._environ is None:
+            self._environ = self.get_environ()
+        env = self._environ
 
         # jobs
         for job in self.jobs:
@@ -806,6 +1199,13 @@ class EngineWorkflow(Workflow):
         '''
         Workflow exploration to find out new node to process.
 
+        The jobs states are followed incrementally (see
+        :class:`DependencyState`): only the jobs which are ready to run or
+        running are inspected, and the end of a job only updates the jobs
+        which depend on it. The result is the same as
+        :meth:`find_out_jobs_to_process_nocache`, which scans the whole
+        workflow.
+
         @rtype: tuple (sequence of EngineJob,
                        sequence of EngineJob,
                        constants.WORKFLOW_STATUS)
@@ -813,128 +1213,51 @@ class EngineWorkflow(Workflow):
                   ended jobs
                   workflow status)
         '''
-
-        if not self.use_cache:
-            return self.find_out_jobs_to_process_nocache()
-
         self.logger = logging.getLogger('engine.EngineWorkflow')
-        self.logger.debug("self.jobs=" + repr(self.jobs))
         if self.cache is None:
-            self.cache = EngineWorkflow.WorkflowCache()
-            self.cache.waiting_jobs = set(self.jobs)
-            self.cache.dependencies = dict(
-                (k, set(v)) for k, v in six.iteritems(self._dependency_dict))
-            self.cache.has_new_failed_jobs = False
-        cache = self.cache
-        to_run = set()
-        to_abort = set()
-        done = set()
-        running = set()
-        rmap = {}
-        # jcount = 0
-        # dcount = 0
-        # fcount = 0
-        has_failed_jobs = self.cache.has_new_failed_jobs
-        self.cache.has_new_failed_jobs = False
-        # import time
-        # t0 = time.clock()
-        for client_job in cache.waiting_jobs:
-            self.logger.debug("client_job=" + repr(client_job))
+            self.cache = self._build_dependency_state()
+        state = self.cache
+
+        # jobs which have started or ended since the last inspection
+        ended = []
+        for client_job in list(state.candidates):
             job = self.job_mapping[client_job]
-            # jcount += 1
             if job.is_done():
-                done.add(job)
-                rmap[job] = client_job
-                if job.failed():
-                    has_failed_jobs = True
-                    self.has_new_failed_jobs = True
+                state.candidates.remove(client_job)
+                ended.append(client_job)
             elif job.is_running():
-                running.add(job)
-                rmap[job] = client_job
-            elif job.status == constants.NOT_SUBMITTED:
-                job_to_run = True
-                job_to_abort = False
-                for ft in job.referenced_input_files:
-                    # fcount += 1
-                    eft = job.transfer_mapping[ft]
-                    if not eft.files_exist_on_server():
-                        if eft.status == constants.TRANSFERING_FROM_CR_TO_CLIENT:
-                        # TBI stop the transfer
-                            pass
-                        job_to_run = False
-                        break
-                deps = cache.dependencies.get(client_job)
-                if deps is not None:
-                    remove_deps = []
-                    for dep_client_job in deps:
-                        # dcount += 1
-                        dep_job = self.job_mapping[dep_client_job]
-                        if not dep_job.ended_with_success():
-                            job_to_run = False
-                            if dep_job.failed():
-                                job_to_abort = True
-                                has_failed_jobs = True
-                                self.has_new_failed_jobs = True
-                                break
-                            if not has_failed_jobs:
-                                # if no new failed jobs have been encountered,
-                                # no need to scan every dep to propagate
-                                # abort.
-                                break
-                        else:
-                            remove_deps.append(dep_client_job)
-                        # TO DO to abort
-                    for dep_client_job in remove_deps:
-                        deps.remove(dep_client_job)
-                if job_to_run:
-                    to_run.add(job)
-                if job_to_abort:
-                    to_abort.add(job)
-                if job_to_run or job_to_abort:
-                    rmap[job] = client_job
-
-        # update status of former cache
-        to_remove = []
-        for job in cache.to_run:
-            if job.is_done():
-                done.add(job)
-                to_remove.append(job)
-            elif job.is_running():
-                running.add(job)
-                to_remove.append(job)
-        cache.to_run.difference_update(to_remove)
-        to_remove = []
-        for job in cache.running:
-            if job.is_done():
-                done.add(job)
-                to_remove.append(job)
-        cache.running.difference_update(to_remove)
-        to_remove = []
-        for job in cache.to_abort:
+                state.candidates.remove(client_job)
+                state.active.add(client_job)
+        for client_job in list(state.active):
+            job = self.job_mapping[client_job]
             if job.is_done():
-                done.add(job)
-                to_remove.append(job)
-        cache.to_abort.difference_update(to_remove)
-
-        cache.waiting_jobs.difference_update(rmap.values())
+                state.active.remove(client_job)
+                ended.append(client_job)
+            elif job.status == constants.NOT_SUBMITTED:
+                state.active.remove(client_job)
+                state.candidates.add(client_job)
+        for client_job in ended:
+            self._job_ended(state, client_job)
+        done_count = state.ndone
 
-        cache.to_run.update(to_run)
-        cache.running.update(running)
-        cache.to_abort.update(to_abort)
-        to_run = cache.to_run
-        running = cache.running
+        to_run = set()
+        for client_job in state.candidates:
+            job = self.job_mapping[client_job]
+            job_to_run = True
+            for ft in job.referenced_input_files:
+                eft = job.transfer_mapping[ft]
+                if not eft.files_exist_on_server():
+                    self.logger.debug("Transfer not complete: %s / %s"
+                                      % (eft,  eft.engine_path)
+                                      + ', status: ' + repr(eft.status))
+                    job_to_run = False
+                    break
+            if job_to_run:
+                to_run.add(job)
 
         # if a job fails the whole workflow branch has to be stopped
-        # look for the node in the branch to abort
-        previous_size = 0
-        while previous_size != len(to_abort):
-            previous_size = len(to_abort)
-            for dep in self.dependencies:
-                job_a = self.job_mapping[dep[0]]
-                job_b = self.job_mapping[dep[1]]
-                if job_a in to_abort and not job_b in to_abort:
-                    to_abort.add(job_b)
-                    break
+        to_abort = self._propagate_abort(state.new_failed)
+        state.new_failed = []
 
         # stop the whole branch
         ended_jobs = {}
@@ -945,23 +1268,15 @@ class EngineWorkflow(Workflow):
                 ended_jobs[job.job_id] = job
                 job.status = constants.FAILED
                 job.exit_status = constants.EXIT_NOTRUN
-                # remove job from to_run and running sets otherwise the
-                # workflow status could be wrong
                 to_run.discard(job)
-                running.discard(job)
-
-        # counts
-        to_run.difference_update(done)
-        to_abort.difference_update(done)
-        running.difference_update(done)
-        cache.done.update(done)
-        done = cache.done
+                state.ndone += 1
+        running_count = len(state.active)
 
-        if len(running) + len(to_run) > 0:
+        if running_count + len(to_run) > 0:
             status = constants.WORKFLOW_IN_PROGRESS
-        elif len(done) + len(to_abort) == len(self.jobs):
+        elif done_count + len(to_abort) == len(self.jobs):
             status = constants.WORKFLOW_DONE
-        elif len(done) > 0:
+        elif done_count > 0:
             # set it to DONE to avoid hangout
             status = constants.WORKFLOW_DONE
             # !!!! the workflow may be stuck !!!!
@@ -971,21 +1286,278 @@ class EngineWorkflow(Workflow):
             self.logger.error(
                 "total jobs: %d, done/aborted: %d, to abort: %d, running: %d, "
                 "to run: %d"
-                % (len(self.jobs), len(done), len(to_abort), len(running),
+                % (len(self.jobs), done_count, len(to_abort), running_count,
                    len(to_run)))
         else:
             status = constants.WORKFLOW_NOT_STARTED
 
-        # t1 = time.clock()
-        # print('jcount:', jcount, ', dcount:', dcount, ', fcount:', fcount, ',
-        # time:', t1 - t0, ', to_run:', len(to_run), ', ended:',
-        # len(ended_jobs), ', done:', len(done), ', running:', len(running))
-
         return (list(to_run), ended_jobs, status)
 
+    def _build_dependency_state(self):
+        '''
+        Build the DependencyState of the workflow from the current jobs
+        states.
+        '''
+        state = EngineWorkflow.DependencyState()
+        self._get_successor_dict()
+        for client_job in self.jobs:
+            job = self.job_mapping[client_job]
+            if job.is_done():
+                state.ndone += 1
+                if job.failed():
+                    state.new_failed.append(client_job)
+            elif job.is_running():
+                state.active.add(client_job)
+            else:
+                unmet = 0
+                for dep_client_job in self._dependency_dict.get(client_job,
+                                                                 ()):
+                    if not self.job_mapping[
+                            dep_client_job].ended_with_success():
+                        unmet += 1
+                if unmet == 0:
+                    state.candidates.add(client_job)
+                else:
+                    state.unmet[client_job] = unmet
+        return state
+
+    def _job_ended(self, state, client_job):
+        '''
+        Update the DependencyState when a job ends: the jobs depending on it
+        have one less dependency to wait for, or have to be aborted if it
+        failed.
+        '''
+        state.ndone += 1
+        job = self.job_mapping[client_job]
+        if job.ended_with_success():
+            for succ_client_job in self._get_successor_dict().get(client_job,
+                                                                  ()):
+                unmet = state.unmet.get(succ_client_job, 0) - 1
+                if unmet > 0:
+                    state.unmet[succ_client_job] = unmet
+                else:
+                    state.unmet.pop(succ_client_job, None)
+                    if self.job_mapping[succ_client_job].status \
+                            == constants.NOT_SUBMITTED:
+                        state.candidates.add(succ_client_job)
+        elif job.failed():
+            state.new_failed.append(client_job)
+
+    def _get_successor_dict(self):
+        '''
+        Index of the jobs depending on each job (Job -> list of Job), built
+        on first use.
+        '''
+        if self._successor_dict is None:
+            successors = {}
+            for dep in self.dependencies:
+                successors.setdefault(dep[0], []).append(dep[1])
+            self._successor_dict = successors
+        return self._successor_dict
+
+    def _get_client_job(self, job_id):
+        '''
+        Client Job of a registered job id, or None if the id is not part of
+        the workflow. The index is built on first use.
+        '''
+        if self._client_job_dict is None:
+            self._client_job_dict = dict(
+                [(job.job_id, client_job)
+                 for client_job, job in six.iteritems(self.job_mapping)])
+        return self._client_job_dict.get(job_id)
+
+    def _downstream_jobs(self, client_job, seed_filter, visited):
+        '''
+        Breadth-first search of the jobs depending (directly or not) on a
+        job.
+
+        Parameters
+        ----------
+        client_job: Job
+            job to start from
+        seed_filter: function
+            the direct successors of client_job (Job) for which it returns
+            False are not followed. Jobs further down are not filtered.
+        visited: set
+            jobs (Job) already found, which are not followed again. Found
+            jobs are added to it.
+
+        Returns
+        -------
+        jobs: list of Job
+            jobs found, in breadth-first order
+        '''
+        successors = self._get_successor_dict()
+        found = []
+        for succ_client_job in successors.get(client_job, ()):
+            if succ_client_job not in visited \
+                    and seed_filter(succ_client_job):
+                visited.add(succ_client_job)
+                found.append(succ_client_job)
+        i = 0
+        while i < len(found):
+            for succ_client_job in successors.get(found[i], ()):
+                if succ_client_job not in visited:
+                    visited.add(succ_client_job)
+                    found.append(succ_client_job)
+            i += 1
+        return found
+
+    def _propagate_abort(self, failed_jobs):
+        '''
+        Find out the jobs to abort because of failed jobs: the not submitted
+        jobs which directly depend on a failed job, and all the jobs which
+        depend on them.
+
+        Parameters
+        ----------
+        failed_jobs: list of Job
+            failed jobs
+
+        Returns
+        -------
+        to_abort: set of EngineJob
+            jobs to abort. The jobs aborted because of each failed job are
+            logged.
+        '''
+        visited = set()
+        to_abort = set()
+
+        def not_submitted(client_job):
+            return self.job_mapping[client_job].status \
+                == constants.NOT_SUBMITTED
+
+        for client_job in failed_jobs:
+            cancelled = self._downstream_jobs(client_job, not_submitted,
+                                              visited)
+            if cancelled:
+                jobs = [self.job_mapping[job] for job in cancelled]
+                to_abort.update(jobs)
+                self.logger.info(
+                    'job %s failed: %d downstream jobs cancelled: %s'
+                    % (self.job_mapping[client_job].name, len(jobs),
+                       ', '.join([job.name for job in jobs[:20]])
+                       + (', ...' if len(jobs) > 20 else '')))
+        return to_abort
+
+    def set_critical_path_priorities(self, durations=None):
+        '''
+        Compute the critical path of each job: the duration of the longest
+        dependencies path from the job to the end of the workflow (bottom
+        level). Ready jobs of the same priority are then scheduled by
+        decreasing critical path, which shortens the workflow execution on a
+        limited number of processors.
+
+        Parameters
+        ----------
+        durations: dict
+            job name -> expected duration, in seconds (durations of the
+            previous runs of the jobs for instance). The duration of a job is
+            its duration_hint if it has one, else its duration in this dict.
+            Jobs with unknown durations get the mean of the known ones (or 1
+            if none is known). Barrier jobs last 0.
+
+        Returns
+        -------
+        length: float
+            duration of the critical path of the workflow
+        '''
+        if durations is None:
+            durations = {}
+        job_durations = {}
+        for client_job, job in six.iteritems(self.job_mapping):
+            if job.is_engine_execution:
+                job_durations[client_job] = 0.
+            elif job.duration_hint is not None:
+                job_durations[client_job] = float(job.duration_hint)
+            elif job.name in durations:
+                job_durations[client_job] = float(durations[job.name])
+        known = [duration for duration in six.itervalues(job_durations)
+                 if duration > 0]
+        if known:
+            default_duration = sum(known) / len(known)
+        else:
+            default_duration = 1.
+
+        # jobs are processed from the end of the workflow, once all the jobs
+        # depending on them are processed
+        successors = self._get_successor_dict()
+        nsucc = dict([(client_job, len(succ))
+                      for client_job, succ in six.iteritems(successors)])
+        to_process = [client_job for client_job in self.jobs
+                      if client_job not in nsucc]
+        critical_path = {}
+        length = 0.
+        while to_process:
+            client_job = to_process.pop()
+            path = job_durations.get(client_job, default_duration) \
+                + max([critical_path[succ_client_job]
+                       for succ_client_job
+                       in successors.get(client_job, ())] or [0.])
+            critical_path[client_job] = path
+            self.job_mapping[client_job].critical_path = path
+            length = max(length, path)
+            for dep_client_job in self._dependency_dict.get(client_job, ()):
+                nsucc[dep_client_job] -= 1
+                if nsucc[dep_client_job] == 0:
+                    to_process.append(dep_client_job)
+        if len(critical_path) != len(self.jobs):
+            self.logger.warning(
+                'workflow %s: %d jobs are in dependency cycles, their '
+                'critical path is not computed'
+                % (self.name, len(self.jobs) - len(critical_path)))
+        return length
+
+    def cancelled_jobs(self, failed_job_ids, aborted_job_ids):
+        '''
+        Report of the jobs which have not run because of failed jobs.
+
+        Parameters
+        ----------
+        failed_job_ids: list of int
+            ids of the jobs which failed
+        aborted_job_ids: list of int
+            ids of the jobs which have been aborted because of a failed
+            dependency (exit status constants.EXIT_NOTRUN)
+
+        Returns
+        -------
+        report: dict
+            failed job id -> list of aborted jobs ids which are downstream of
+            it. Each aborted job is only reported for the first failed job it
+            depends on.
+        '''
+        aborted_job_ids = set(aborted_job_ids)
+
+        def aborted(client_job):
+            return self.job_mapping[client_job].job_id in aborted_job_ids
+
+        visited = set()
+        report = {}
+        for job_id in failed_job_ids:
+            client_job = self._get_client_job(job_id)
+            if client_job is None:
+                continue
+            cancelled = [self.job_mapping[job].job_id
+                         for job in self._downstream_jobs(client_job,
+                                                          aborted, visited)]
+            report[job_id] = [cancelled_id for cancelled_id in cancelled
+                              if cancelled_id in aborted_job_ids]
+        return report
+
+    def reset_dependency_state(self):
+        '''
+        Discard the incremental jobs state used by
+        :meth:`find_out_jobs_to_process`. It has to be called when jobs
+        states are changed outside of the jobs follow-up of the engine loop.
+        '''
+        self.cache = None
+
     def find_out_jobs_to_process_nocache(self):
         '''
-        Workflow exploration to find out new node to process.
+        Workflow exploration to find out new node to process, scanning the
+        whole workflow. This is the reference algorithm for
+        :meth:`find_out_jobs_to_process`.
 
         @rtype: tuple (sequence of EngineJob,
                        sequence of EngineJob,
@@ -998,7 +1570,7 @@ class EngineWorkflow(Workflow):
         self.logger = logging.getLogger('engine.EngineWorkflow')
         self.logger.debug("self.jobs=" + repr(self.jobs))
         to_run = set()
-        to_abort = set()
+        failed_jobs = []
         done = []
         running = set()
         # jcount = 0
@@ -1016,13 +1588,14 @@ class EngineWorkflow(Workflow):
             job = self.job_mapping[client_job]
             if job.is_done():
                 done.append(job)
+                if job.failed():
+                    failed_jobs.append(client_job)
                 j_to_discard += 1
             elif job.is_running():
                 running.add(job)
                 j_to_discard += 1
             elif job.status == constants.NOT_SUBMITTED:
                 job_to_run = True
-                job_to_abort = False
                 self.logger.debug(
                     "job not submitted, referenced_input_files: " + repr(job.referenced_input_files))
                 for ft in job.referenced_input_files:
@@ -1046,28 +1619,16 @@ class EngineWorkflow(Workflow):
                         if not dep_job.ended_with_success():
                             job_to_run = False
                             if dep_job.failed():
-                                job_to_abort = True
+                                # it will be aborted
                                 break
                         # else: d_to_discard += 1
-                        # TO DO to abort
                 if job_to_run:
                     to_run.add(job)
                     j_to_discard += 1
-                if job_to_abort:
-                    j_to_discard += 1
-                    to_abort.add(job)
         # if a job fails the whole workflow branch has to be stopped
         # look for the node in the branch to abort
-        previous_size = 0
-        while previous_size != len(to_abort):
-            previous_size = len(to_abort)
-            for dep in self.dependencies:
-                job_a = self.job_mapping[dep[0]]
-                job_b = self.job_mapping[dep[1]]
-                if job_a in to_abort and not job_b in to_abort:
-                    to_abort.add(job_b)
-                    j_to_discard += 1
-                    break
+        to_abort = self._propagate_abort(failed_jobs)
+        j_to_discard += len(to_abort)
 
         # stop the whole branch
         ended_jobs = {}
@@ -1107,13 +1668,11 @@ class EngineWorkflow(Workflow):
         # to_run:', len(to_run), ', done:', len(done), ', running:',
         # len(running), 'j_to_discard:', j_to_discard, ', d_to_discard:',
         # d_to_discard)
-        if j_to_discard >= 2000:
-            self.use_cache = True
-            self.logger.debug('enabling cache.')
 
         return (list(to_run), ended_jobs, status)
 
     def _update_state_from_database_server(self, database_server):
+        self.cache = None
         wf_status = database_server.get_detailed_workflow_status(
             self.wf_id, with_drms_id=True)
 
@@ -1184,7 +1743,6 @@ class EngineWorkflow(Workflow):
         sub_info_to_resert = {}
         new_status = {}
         jobs_queue_changed = []
-        self.cache = None
         for client_job in self.jobs:
             job = self.job_mapping[client_job]
             undone = False
@@ -1209,7 +1767,7 @@ class EngineWorkflow(Workflow):
 
             if undone or (self.status != constants.WORKFLOW_IN_PROGRESS
                           and not job.ended_with_success()):
-                undone_jobs.append(job)
+                undone_jobs.append(client_job)
                 job.queue = self.queue
                 jobs_queue_changed.append(job.job_id)
 
@@ -1220,7 +1778,8 @@ class EngineWorkflow(Workflow):
         to_run = []
         if undone_jobs:
             # look for jobs to run
-            for job in undone_jobs:
+            for client_job in undone_jobs:
+                job = self.job_mapping[client_job]
                 job_to_run = True  # a node is run when all its dependencies succeed
                 for ft in job.referenced_input_files:
                     eft = self.transfer_mapping[ft]
@@ -1231,11 +1790,10 @@ class EngineWorkflow(Workflow):
                         job_to_run = False
                         break
                 if job_to_run:
-                    for dep in self.dependencies:
-                        job_a = self.job_mapping[dep[0]]
-                        job_b = self.job_mapping[dep[1]]
-
-                        if job_b == job and not job_a.ended_with_success():
+                    for dep_client_job in self._dependency_dict.get(
+                            client_job, ()):
+                        if not self.job_mapping[
+                                dep_client_job].ended_with_success():
                             job_to_run = False
                             break
 
@@ -1254,33 +1812,35 @@ class EngineWorkflow(Workflow):
         them in an extended list if they should re-run if job_ids are restarted.
         '''
         ext_job_ids = set(job_ids)
-        to_test = []
-        jobsdeps_f = {}
-        jobsdeps_t = {}
-        for dep in self.dependencies:
-            j1 = self.job_mapping[dep[0]]  # get engine jobs
-            j2 = self.job_mapping[dep[1]]
-            # if j2.status == constants.FAILED \
-                    # and j2.job_id not in ext_job_ids:
-            if j2.job_id not in ext_job_ids:
-                # dep[1] may change state
-                jobsdeps_f.setdefault(j2, set()).add(j1)
-                if j1.job_id in ext_job_ids \
-                        and j2.job_id not in ext_job_ids:
-                    to_test.append(j2)
-            # if j1.status == constants.FAILED \
-                    # and j1.job_id not in ext_job_ids:
-            if j1.job_id not in ext_job_ids:
-                jobsdeps_t.setdefault(j1, set()).add(j2)
+        successors = self._get_successor_dict()
+        # a job is tested again each time one of its dependencies is added,
+        # thus at most once per dependency
+        to_test = collections.deque()
+        queued = set()
+        for job_id in ext_job_ids:
+            client_job = self._get_client_job(job_id)
+            if client_job is None:
+                continue
+            for succ_client_job in successors.get(client_job, ()):
+                if succ_client_job not in queued:
+                    queued.add(succ_client_job)
+                    to_test.append(succ_client_job)
         while to_test:
-            job = to_test.pop(0)
+            client_job = to_test.popleft()
+            queued.remove(client_job)
+            job = self.job_mapping[client_job]
             if job.job_id in ext_job_ids:
                 continue
-            if all([j.status != constants.FAILED or j.job_id in ext_job_ids
-                    for j in jobsdeps_f[job]]):
+            if all([self.job_mapping[dep_client_job].status
+                    != constants.FAILED
+                    or self.job_mapping[dep_client_job].job_id in ext_job_ids
+                    for dep_client_job
+                    in self._dependency_dict.get(client_job, ())]):
                 ext_job_ids.add(job.job_id)
-                to_test += [j for j in jobsdeps_t.get(job, set())
-                            if j not in to_test]
+                for succ_client_job in successors.get(client_job, ()):
+                    if succ_client_job not in queued:
+                        queued.add(succ_client_job)
+                        to_test.append(succ_client_job)
         return ext_job_ids
 
     def restart_jobs(self, database_server, job_ids, check_deps=True):
@@ -1314,16 +1874,17 @@ class EngineWorkflow(Workflow):
         sub_info_to_resert = {}
         new_status = {}
         jobs_to_run = set()
-        for client_job in self.jobs:
-            job = self.job_mapping[client_job]
-            job_id = job.job_id
-            if job_id not in extended_job_ids:
+        restarted = []
+        for job_id in extended_job_ids:
+            client_job = self._get_client_job(job_id)
+            if client_job is None:
                 continue
+            job = self.job_mapping[client_job]
             if job.status not in (constants.DONE, constants.FAILED):
                 print('job', job_id, 'is not ready for restart:', job.status)
                 continue
 
-            jobs_to_run.add(job)
+            restarted.append(client_job)
             # clear all the information related to the previous job
             # submission
             job.status = constants.NOT_SUBMITTED
@@ -1343,13 +1904,12 @@ class EngineWorkflow(Workflow):
         database_server.set_submission_information(sub_info_to_resert, None)
         database_server.set_jobs_status(new_status)
 
-        extended_jobs = set(jobs_to_run)
         # look for jobs which can restart immediately (all deps met)
-        for dep in self.dependencies:
-            j1 = self.job_mapping[dep[0]]  # get engine jobs
-            j2 = self.job_mapping[dep[1]]
-            if j2 in jobs_to_run and j1.status != constants.DONE:
-                jobs_to_run.remove(j2)
+        for client_job in restarted:
+            if all([self.job_mapping[dep_client_job].status == constants.DONE
+                    for dep_client_job
+                    in self._dependency_dict.get(client_job, ())]):
+                jobs_to_run.add(self.job_mapping[client_job])
 
         return jobs_to_run
 
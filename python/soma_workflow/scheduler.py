@@ -6,6 +6,7 @@ import six
 import os
 import inspect
 import importlib
+from soma_workflow.errors import DRMError
 
 
 class Scheduler(object):
@@ -32,9 +33,12 @@ class Scheduler(object):
 
     is_sleeping = None
 
+    _job_ended_callback = None
+
     def __init__(self):
         self.parallel_job_submission_info = None
         self.is_sleeping = False
+        self._job_ended_callback = None
 
     def sleep(self):
         self.is_sleeping = True
@@ -42,6 +46,34 @@ class Scheduler(object):
     def wake(self):
         self.is_sleeping = False
 
+    def set_job_ended_callback(self, callback):
+        '''
+        Register a function which will be called (without arguments) each time
+        the scheduler detects that one or several jobs have ended. The engine
+        uses it to process ended jobs immediately rather than at its next
+        polling time.
+
+        Schedulers which cannot detect job ends by themselves (DRMS clusters
+        polled by the engine) never call it, and the engine falls back to
+        polling.
+
+        Parameters
+        ----------
+        callback: callable or None
+            function to call. It should return quickly and must not call back
+            the scheduler.
+        '''
+        self._job_ended_callback = callback
+
+    def _notify_job_ended(self):
+        '''
+        Call the job ended callback, if any. To be used by scheduler
+        implementations.
+        '''
+        callback = self._job_ended_callback
+        if callback is not None:
+            callback()
+
     def clean(self):
         pass
 
@@ -108,6 +140,66 @@ class Scheduler(object):
         '''
         raise Exception("Scheduler is an abstract class!")
 
+    def get_jobs_status(self, scheduler_job_ids):
+        '''
+        Get the status of several jobs at once. The engine calls it once per
+        loop iteration for all the running jobs, so implementations should
+        query the DRMS once for all of them whenever possible.
+
+        The default implementation calls :meth:`get_job_status` for each job.
+
+        Parameters
+        ----------
+        scheduler_job_ids: list
+            Job ids for the scheduling system
+
+        Returns
+        -------
+        status: dict
+            scheduler_job_id -> job status as defined in constants.JOB_STATUS.
+            Jobs whose status could not be determined are missing from the
+            dict: the caller should use :meth:`get_job_status` for them to
+            get the error.
+        '''
+        status = {}
+        for scheduler_job_id in scheduler_job_ids:
+            try:
+                status[scheduler_job_id] \
+                    = self.get_job_status(scheduler_job_id)
+            except DRMError:
+                pass
+        return status
+
+    def get_jobs_exit_info(self, scheduler_job_ids):
+        '''
+        Get the exit info of several ended jobs at once (see
+        :meth:`get_job_exit_info`).
+
+        The default implementation calls :meth:`get_job_exit_info` for each
+        job.
+
+        Parameters
+        ----------
+        scheduler_job_ids: list
+            Job ids for the scheduling system
+
+        Returns
+        -------
+        exit_info: dict
+            scheduler_job_id -> exit info tuple (exit_status, exit_value,
+            term_sig, resource_usage). Jobs whose exit info could not be
+            retrieved are missing from the dict: the caller should use
+            :meth:`get_job_exit_info` for them to get the error.
+        '''
+        exit_info = {}
+        for scheduler_job_id in scheduler_job_ids:
+            try:
+                exit_info[scheduler_job_id] \
+                    = self.get_job_exit_info(scheduler_job_id)
+            except Exception:
+                pass
+        return exit_info
+
     def kill_job(self, scheduler_job_id):
         '''
         Parameters
@@ -117,6 +209,20 @@ class Scheduler(object):
         '''
         raise Exception("Scheduler is an abstract class!")
 
+    def stats(self):
+        '''
+        Current state of the scheduler: allocated resources, queue depth,
+        dispatch latency... The available items depend on the scheduler
+        implementation (see :meth:`LocalScheduler.stats
+        <soma_workflow.schedulers.local_scheduler.LocalScheduler.stats>`).
+
+        Returns
+        -------
+        stats: dict or None
+            None if the scheduler does not keep track of it (the default)
+        '''
+        return None
+
     @classmethod
     def build_scheduler(cls, config):
         ''' Create a scheduler of the expected type, using configuration to
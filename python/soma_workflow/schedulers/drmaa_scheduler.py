@@ -398,6 +398,43 @@ if DRMAA_LIB_FOUND:
                 raise DRMError("%s" % (e))
             return status
 
+        def get_jobs_status(self, scheduler_job_ids):
+            '''
+            Get the status of several jobs in a single pass over the DRMAA
+            session. Jobs for which DRMAA returns an error are not in the
+            returned dict.
+            '''
+            if self.is_sleeping:
+                self.wake()
+            status = {}
+            for scheduler_job_id in scheduler_job_ids:
+                if scheduler_job_id == self.FAKE_JOB:
+                    # a barrier job is done as soon as it is started.
+                    status[scheduler_job_id] = constants.DONE
+                    continue
+                try:
+                    status[scheduler_job_id] \
+                        = self._drmaa.jobStatus(scheduler_job_id)
+                except DrmaaException as e:
+                    self.logger.error("%s" % (e))
+            return status
+
+        def get_jobs_exit_info(self, scheduler_job_ids):
+            '''
+            DRMAA has no bulk query of job termination: the jobs are reaped
+            one by one (without waiting), within a single call.
+            '''
+            if self.is_sleeping:
+                self.wake()
+            exit_info = {}
+            for scheduler_job_id in scheduler_job_ids:
+                try:
+                    exit_info[scheduler_job_id] \
+                        = self.get_job_exit_info(scheduler_job_id)
+                except DrmaaException as e:
+                    self.logger.error("%s" % (e))
+            return exit_info
+
         def get_job_exit_info(self, scheduler_job_id):
             if self.is_sleeping:
                 self.wake()
@@ -41,6 +41,11 @@ import threading
 import time
 import os
 import signal
+import select
+import errno
+import heapq
+import itertools
+import collections
 import ctypes
 import atexit
 import six
@@ -53,6 +58,10 @@ try:
 except ImportError:
     have_psutil = False
 
+# the end of jobs processes can be waited for through file descriptors
+# (Linux >= 5.3, python >= 3.9). Otherwise they are polled.
+have_pidfd = hasattr(os, 'pidfd_open') and hasattr(select, 'poll')
+
 import soma_workflow.constants as constants
 from soma_workflow.configuration import LocalSchedulerCfg
 from soma_workflow.configuration import default_cpu_number, cpu_count
@@ -70,12 +79,29 @@ class LocalScheduler(Scheduler):
 
     * _proc_nb *int*
 
-    * _queue *list of scheduler jobs ids*
+    * _queue *heap of (priority key, submission number, scheduler job id)*
+        jobs waiting to be run, the highest priority first (see
+        EngineJob.scheduling_priority()), in submission order for equal
+        priorities
+
+    * _queued_hints *int*
+        number of queued jobs which have a duration hint
+
+    * _engine_jobs *list of scheduler job ids*
+        queued engine execution jobs (barriers...), in submission order. They
+        need no CPU, thus are kept out of _queue and completed at the next
+        iteration, whatever the resources used by the running jobs.
 
     * _jobs *dictionary job_id -> soma_workflow.engine_types.EngineJob*
 
     * _processes *dictionary job_id -> subprocess.Popen*
 
+    * _job_cpus *dictionary job_id -> number of CPUs of a running job*
+
+    * _allocated_cpus *int*
+        number of CPUs used by the running jobs, updated when jobs start
+        and end
+
     * _status *dictionary job_id -> job status as defined in constants*
 
     * _exit_info * dictionay job_id -> exit info*
@@ -85,21 +111,98 @@ class LocalScheduler(Scheduler):
     * _interval *int*
 
     * _lock *threading.RLock*
+
+    * _poller *select.poll*
+        waits for the end of jobs processes (pidfds) and for the scheduler
+        wake up pipe. None if pidfds are not supported.
+
+    * _pidfds *dictionary pidfd -> (job_id, subprocess.Popen)*
+
+    * _polled_processes *dictionary job_id -> subprocess.Popen*
+        running processes which end cannot be waited for, and which are
+        polled at each iteration
+
+    * _ended_pidfds *list of pidfds of ended processes, to be reaped*
+
+    * _start_times *dictionary job_id -> process start time*
+
+    * _peak_memory *dictionary job_id -> sampled peak memory (bytes)*
+        memory of the job process and its children, sampled every
+        *_interval* seconds when psutil is available
+
+    * _memory *dictionary job_id -> last sampled memory (bytes)*
+
+    * _used_memory *int*
+        memory used or reserved by the running jobs, in bytes (sum of
+        _running_memory() over running jobs), updated when jobs start and
+        end, and when their memory is sampled
+
+    * _submission_times *dictionary job_id -> submission time of queued jobs*
+
+    * _dispatch_latencies *deque*
+        time the last started jobs have waited in the queue, in seconds
+
+    * _max_memory *int*
+        memory which running jobs may use, in megabytes. 0 means the
+        physical memory of the machine (only known when psutil is
+        available, otherwise memory is not limited).
+
+    * _physical_memory *int*
+        physical memory of the machine in bytes, None if psutil is not
+        available
+
+    A job is started when both CPUs and memory are available for it. The
+    memory of a running job is the highest of its declared memory
+    requirement (Job.memory_requirement) and its last sampled memory. A job
+    which needs more memory than the limit is run alone.
+
+    Queued jobs are started in priority order, using EASY backfilling: when
+    the first job of the queue cannot be started (typically a parallel job
+    waiting for cores), resources are reserved for it at the earliest time
+    they are expected to be free, given the expected durations
+    (Job.duration_hint) of the running jobs. Lower priority jobs are started
+    meanwhile only if they do not delay this reservation: if they are
+    expected to end before it, or if they only use resources which the
+    reserved job will not need. When *backfill* is False, jobs are strictly
+    started in priority order.
+
+    Ended processes are reaped using os.wait4() when available, to record
+    their resource usage in the job exit info (see
+    :func:`format_resource_usage`).
+
+    The scheduler thread sleeps until a job process ends or a job is
+    submitted, then reaps the ended processes and starts queued jobs
+    immediately. When the end of processes cannot be waited for, they are
+    polled every *_interval* seconds.
     '''
     parallel_job_submission_info = None
 
     # logger = None
 
+    backfill = True
+
     _proc_nb = None
 
     _max_proc_nb = None
 
+    _max_memory = None
+
     _queue = None
 
+    _submission_count = None
+
+    _queued_hints = None
+
+    _engine_jobs = None
+
     _jobs = None
 
     _processes = None
 
+    _job_cpus = None
+
+    _allocated_cpus = None
+
     _status = None
 
     _exit_info = None
@@ -110,23 +213,78 @@ class LocalScheduler(Scheduler):
 
     _lock = None
 
+    _poller = None
+
+    _wake_fds = None
+
+    _wake_event = None
+
+    _pidfds = None
+
+    _polled_processes = None
+
+    _ended_pidfds = None
+
+    _start_times = None
+
+    _peak_memory = None
+
+    _memory = None
+
+    _used_memory = None
+
+    _physical_memory = None
+
+    _submission_times = None
+
+    _dispatch_latencies = None
+
+    _dispatched_jobs = None
+
+    _last_memory_sample = None
+
     _lasttime = None
     _lastidle = None
 
     def __init__(self, proc_nb=default_cpu_number(), interval=1,
-                 max_proc_nb=0):
+                 max_proc_nb=0, max_memory=0):
         super(LocalScheduler, self).__init__()
 
         self.parallel_job_submission_info = None
 
         self._proc_nb = proc_nb
         self._max_proc_nb = max_proc_nb
+        self._max_memory = max_memory
         self._interval = interval
         self._queue = []
+        self._submission_count = itertools.count()
+        self._queued_hints = 0
+        self._engine_jobs = []
         self._jobs = {}
         self._processes = {}
+        self._job_cpus = {}
+        self._allocated_cpus = 0
         self._status = {}
         self._exit_info = {}
+        self._pidfds = {}
+        self._polled_processes = {}
+        self._ended_pidfds = []
+        self._start_times = {}
+        self._peak_memory = {}
+        self._memory = {}
+        self._used_memory = 0
+        if have_psutil:
+            self._physical_memory = psutil.virtual_memory().total
+        self._submission_times = {}
+        self._dispatch_latencies = collections.deque(maxlen=100)
+        self._dispatched_jobs = 0
+        self._wake_event = threading.Event()
+        if have_pidfd:
+            self._wake_fds = os.pipe()
+            for fd in self._wake_fds:
+                os.set_blocking(fd, False)
+            self._poller = select.poll()
+            self._poller.register(self._wake_fds[0], select.POLLIN)
 
         self._lock = threading.RLock()
 
@@ -136,7 +294,8 @@ class LocalScheduler(Scheduler):
             while not self.stop_thread_loop:
                 with self._lock:
                     self._iterate()
-                time.sleep(self._interval)
+                self._sample_memory()
+                self._wait_events()
 
         self._loop = threading.Thread(name="scheduler_loop",
                                       target=loop,
@@ -160,74 +319,383 @@ class LocalScheduler(Scheduler):
         with self._lock:
             self._interval = interval
 
+    def change_max_memory(self, max_memory):
+        with self._lock:
+            self._max_memory = max_memory
+        # jobs waiting for memory may be started
+        self._wake()
+
     def end_scheduler_thread(self):
         with self._lock:
             self.stop_thread_loop = True
-            self._loop.join()
+        # the lock is not held while waiting: the thread may need it to
+        # finish its iteration
+        self._wake()
+        self._loop.join()
+        with self._lock:
+            for fd in self._pidfds:
+                os.close(fd)
+            self._pidfds = {}
+            wake_fds = self._wake_fds
+            self._wake_fds = None
+            if wake_fds is not None:
+                for fd in wake_fds:
+                    os.close(fd)
             # print("Soma scheduler thread ended nicely.")
 
+    def _wake(self):
+        '''
+        Wake up the scheduler thread, to process new jobs or stop.
+        '''
+        wake_fds = self._wake_fds
+        if wake_fds is None:
+            self._wake_event.set()
+            return
+        try:
+            os.write(wake_fds[1], b'x')
+        except OSError:
+            # the pipe is full: the thread will wake up anyway
+            pass
+
+    def _wait_events(self):
+        '''
+        Wait until a job process ends, a job is submitted, or the scheduler
+        ends, for at most *_interval* seconds. Called by the scheduler thread,
+        without holding the lock.
+        '''
+        poller = self._poller
+        if poller is None:
+            if self._wake_event.wait(self._interval):
+                self._wake_event.clear()
+            return
+        wake_fd = self._wake_fds[0]
+        ended_pidfds = []
+        for fd, event in poller.poll(int(self._interval * 1000)):
+            if fd == wake_fd:
+                try:
+                    os.read(wake_fd, 4096)
+                except OSError:
+                    pass
+            else:
+                ended_pidfds.append(fd)
+        if ended_pidfds:
+            with self._lock:
+                self._ended_pidfds += ended_pidfds
+
+    def _watch_process(self, job_id, process):
+        '''
+        Register a started job process, in order to detect its end.
+        '''
+        if self._poller is not None:
+            try:
+                fd = os.pidfd_open(process.pid)
+            except OSError:
+                # not supported by the kernel, or forbidden
+                fd = None
+            if fd is not None:
+                self._pidfds[fd] = (job_id, process)
+                self._poller.register(fd, select.POLLIN)
+                return
+        self._polled_processes[job_id] = process
+
+    @staticmethod
+    def _reap_process(process):
+        '''
+        Reap a job process if it has ended, without blocking, and set its
+        returncode.
+
+        Returns
+        -------
+        ended: bool
+        rusage: resource.struct_rusage or None
+            resource usage of the process and its children, if it could be
+            obtained (os.wait4() is only available on Unix)
+        '''
+        if process.returncode is None and hasattr(os, 'wait4'):
+            try:
+                pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                # already reaped
+            else:
+                if pid == 0:
+                    return (False, None)
+                # the same value as subprocess.Popen would set
+                if os.WIFSIGNALED(status):
+                    process.returncode = -os.WTERMSIG(status)
+                else:
+                    process.returncode = os.WEXITSTATUS(status)
+                return (True, rusage)
+        return (process.poll() is not None, None)
+
+    def _ended_processes(self):
+        '''
+        Reap ended job processes: the ones which pidfd has been signaled, and
+        the polled ones.
+
+        Returns
+        -------
+        ended: list
+            list of (job_id, process, rusage)
+        '''
+        ended = []
+        for fd in self._ended_pidfds:
+            job_id, process = self._pidfds.pop(fd)
+            self._poller.unregister(fd)
+            os.close(fd)
+            # killed jobs have already been reaped and removed
+            if self._processes.get(job_id) is process:
+                ended.append((job_id, process)
+                             + self._reap_process(process)[1:])
+        self._ended_pidfds = []
+        for job_id, process in list(self._polled_processes.items()):
+            is_ended, rusage = self._reap_process(process)
+            if is_ended:
+                del self._polled_processes[job_id]
+                ended.append((job_id, process, rusage))
+        return ended
+
+    def _sample_memory(self):
+        '''
+        Update the memory and peak memory of the running jobs: resident
+        memory of their process and its children. Done every *_interval*
+        seconds, if psutil is available.
+
+        The processes are sampled without holding the scheduler lock, which
+        is only taken to get the running processes and to record the
+        results: jobs submissions and status queries are not delayed by the
+        sampling.
+        '''
+        if not have_psutil:
+            return
+        with self._lock:
+            if not self._processes:
+                return
+            now = time.time()
+            if self._last_memory_sample is not None \
+                    and now - self._last_memory_sample < self._interval:
+                return
+            self._last_memory_sample = now
+            pids = [(job_id, process.pid)
+                    for job_id, process in six.iteritems(self._processes)]
+        sampled = []
+        for job_id, pid in pids:
+            try:
+                memory = self._process_memory(pid)
+            except psutil.Error:
+                # the process has ended meanwhile
+                continue
+            sampled.append((job_id, pid, memory))
+        with self._lock:
+            for job_id, pid, memory in sampled:
+                process = self._processes.get(job_id)
+                if process is not None and process.pid == pid:
+                    # still running
+                    self._update_memory(job_id, memory)
+
+    @staticmethod
+    def _process_memory(pid):
+        '''
+        Resident memory (in bytes) of a process and its children. Needs
+        psutil.
+        '''
+        ps_process = psutil.Process(pid)
+        memory = ps_process.memory_info().rss
+        for child in ps_process.children(recursive=True):
+            memory += child.memory_info().rss
+        return memory
+
+    def _update_memory(self, job_id, memory):
+        '''
+        Record the sampled memory (in bytes) of a running job, and update
+        its peak memory and the memory used by running jobs.
+        '''
+        self._used_memory -= self._running_memory(job_id)
+        self._memory[job_id] = memory
+        self._used_memory += self._running_memory(job_id)
+        if memory > self._peak_memory.get(job_id, 0):
+            self._peak_memory[job_id] = memory
+
     def _iterate(self):
         # Nothing to do if the queue is empty and nothing is running
-        if not self._queue and not self._processes:
+        if not self._queue and not self._engine_jobs \
+                and not self._processes and not self._ended_pidfds:
             return
         # print("#############################")
         # Control the running jobs
-        ended_jobs = []
-        for job_id, process in six.iteritems(self._processes):
-            ret_value = process.poll()
+        ended_jobs = self._ended_processes()
+        end_time = self._now()
+        for job_id, process, rusage in ended_jobs:
+            ret_value = process.returncode
             # print("job_id " + repr(job_id) + " ret_value " + repr(ret_value))
-            if ret_value != None:
-                ended_jobs.append(job_id)
-                self._exit_info[job_id] = (constants.FINISHED_REGULARLY,
-                                           ret_value,
-                                           None,
-                                           None)
-
-        # update for the ended job
-        for job_id in ended_jobs:
+            resource_usage = format_resource_usage(
+                rusage, self._start_times.pop(job_id, None), end_time,
+                self._peak_memory.pop(job_id, None))
+            self._used_memory -= self._running_memory(job_id)
+            self._memory.pop(job_id, None)
+            self._exit_info[job_id] = (constants.FINISHED_REGULARLY,
+                                       ret_value,
+                                       None,
+                                       resource_usage or None)
             # print("updated job_id " + repr(job_id) + " status DONE")
             self._status[job_id] = constants.DONE
             del self._processes[job_id]
+            self._allocated_cpus -= self._job_cpus.pop(job_id)
+
+        notify = bool(ended_jobs)
+        # barrier jobs are not actually run using Popen: they succeed
+        # immediately, even if no CPU is free.
+        for job_id in self._engine_jobs:
+            self._submission_times.pop(job_id, None)
+            self._exit_info[job_id] = (constants.FINISHED_REGULARLY,
+                                       0,
+                                       None,
+                                       None)
+            self._status[job_id] = constants.DONE
+            notify = True
+        self._engine_jobs = []
 
         # run new jobs
         skipped_jobs = []
+        # [shadow time, extra cpus, extra memory] reserved for the first job
+        # which cannot be started
+        reservation = None
+        now = self._now()
+        capacity = max(self._proc_nb, self._max_cpus())
+        memory_limit = self._memory_limit()
         # print('processing queue:', len(self._queue), file=sys.stderr)
         while self._queue:
-            job_id = self._queue.pop(0)
+            if self._allocated_cpus >= capacity:
+                # no CPU is free
+                break
+            if reservation is not None and reservation[1] <= 0 \
+                    and (reservation[0] == float('inf')
+                         or self._queued_hints == 0):
+                # no other job can end before the reservation time, and no
+                # CPU is left for it after this time
+                break
+            entry = heapq.heappop(self._queue)
+            job_id = entry[2]
+            # job.drmaa_id may not be set yet: the job may be started before
+            # job_submission() returns
             job = self._jobs[job_id]
+            if job.duration_hint:
+                self._queued_hints -= 1
             # print("new job " + repr(job.job_id))
-            if job.is_engine_execution:
-                # barrier jobs are not actually run using Popen:
-                # they succeed immediately.
-                self._exit_info[job.drmaa_id] = (constants.FINISHED_REGULARLY,
-                                                 0,
-                                                 None,
-                                                 None)
-                self._status[job.drmaa_id] = constants.DONE
-            else:
-                ncpu = self._cpu_for_job(job)
-                # print('job:', job.command, ', cpus:', ncpu, file=sys.stderr)
-                if not self._can_submit_new_job(ncpu):
-                    # print('cannot submit.', file=sys.stderr)
-                    skipped_jobs.append(job_id)  # postponed
-                    if ncpu == 1:  # no other job will be able to run now
-                        break
-                    else:
+            ncpu = self._cpu_for_job(job)
+            memory = self._memory_for_job(job)
+            # print('job:', job.command, ', cpus:', ncpu, file=sys.stderr)
+            use_extra = False
+            if reservation is not None:
+                duration = job.duration_hint
+                if not duration or reservation[0] == float('inf') \
+                        or now + duration > reservation[0]:
+                    # it may still run at the reservation time
+                    if ncpu > reservation[1] \
+                            or (reservation[2] is not None
+                                and memory > reservation[2]):
+                        skipped_jobs.append(entry)  # postponed
                         continue
-                # print('submitting.', file=sys.stderr)
-                process = LocalScheduler.create_process(job)
-                if process == None:
-                    LocalScheduler.logger.error(
-                        'command process is None:' + job.name)
-                    self._exit_info[job.drmaa_id] = (constants.EXIT_ABORTED,
-                                                     None,
-                                                     None,
-                                                     None)
-                    self._status[job.drmaa_id] = constants.FAILED
-                else:
-                    self._processes[job.drmaa_id] = process
-                    self._status[job.drmaa_id] = constants.RUNNING
-        self._queue = skipped_jobs + self._queue
+                    use_extra = True
+            if not self._can_submit_new_job(ncpu, memory, memory_limit):
+                # print('cannot submit.', file=sys.stderr)
+                skipped_jobs.append(entry)  # postponed
+                if ncpu == 1 and memory == 0:
+                    # no other job will be able to run now
+                    break
+                if reservation is None:
+                    reservation = self._reservation(ncpu, memory, now,
+                                                    memory_limit)
+                    if reservation is not None and not self.backfill:
+                        break
+                continue
+            if use_extra:
+                reservation[1] -= ncpu
+                if reservation[2] is not None:
+                    reservation[2] -= memory
+            # print('submitting.', file=sys.stderr)
+            process = self.create_process(job)
+            start_time = self._now()
+            self._dispatch_latencies.append(
+                start_time - self._submission_times.pop(job_id,
+                                                        start_time))
+            self._dispatched_jobs += 1
+            if process == None:
+                LocalScheduler.logger.error(
+                    'command process is None:' + job.name)
+                self._exit_info[job_id] = (constants.EXIT_ABORTED,
+                                           None,
+                                           None,
+                                           None)
+                self._status[job_id] = constants.FAILED
+                notify = True
+            else:
+                self._processes[job_id] = process
+                self._job_cpus[job_id] = ncpu
+                self._allocated_cpus += ncpu
+                self._used_memory += memory
+                self._start_times[job_id] = start_time
+                self._watch_process(job_id, process)
+                self._status[job_id] = constants.RUNNING
+        for entry in skipped_jobs:
+            heapq.heappush(self._queue, entry)
+            if self._jobs[entry[2]].duration_hint:
+                self._queued_hints += 1
+        if notify:
+            self._notify_job_ended()
+
+    def _reservation(self, ncpu, memory, now, limit):
+        '''
+        EASY backfilling reservation for a job which cannot be started now:
+        earliest time at which enough CPUs and memory are expected to be
+        free for it, given the expected end of the running jobs (start time
+        plus Job.duration_hint, unknown without duration hint), and resources
+        which will still be free when it starts.
+
+        Returns
+        -------
+        reservation: list or None
+            [shadow_time, extra_cpus, extra_memory]. shadow_time is infinite
+            if it depends on jobs without duration hint. extra_memory is None
+            if memory is not limited. None if the job can never be started
+            with the current number of CPUs.
+        '''
+        capacity = max(self._proc_nb, self._max_cpus())
+        if ncpu > capacity:
+            return None
+        free_cpus = capacity
+        free_memory = limit
+        running = []
+        for job_id in self._processes:
+            job = self._jobs[job_id]
+            job_cpus = self._job_cpus[job_id]
+            job_memory = self._running_memory(job_id)
+            free_cpus -= job_cpus
+            if limit is not None:
+                free_memory -= job_memory
+            end = float('inf')
+            if job.duration_hint:
+                end = max(now, self._start_times.get(job_id, now)
+                          + job.duration_hint)
+            running.append((end, job_cpus, job_memory))
+        running.sort(key=lambda item: item[0])
+        # a job needing more than the memory limit is run alone
+        alone = limit is not None and memory > limit
+        shadow = now
+        for end, job_cpus, job_memory in running:
+            if not alone and free_cpus >= ncpu \
+                    and (limit is None or free_memory >= memory):
+                break
+            shadow = end
+            free_cpus += job_cpus
+            if limit is not None:
+                free_memory += job_memory
+        if alone:
+            return [shadow, 0, 0]
+        if limit is not None:
+            free_memory -= memory
+        return [shadow, free_cpus - ncpu, free_memory]
 
     def _cpu_for_job(self, job):
         parallel_job_info = job.parallel_job_info
@@ -237,22 +705,76 @@ class LocalScheduler(Scheduler):
             * parallel_job_info.get('cpu_per_node', 1)
         return ncpu
 
-    def _can_submit_new_job(self, ncpu=1):
-        n = sum([self._cpu_for_job(self._jobs[j])
-                 for j in self._processes])
-        n += ncpu
-        if n <= self._proc_nb:
+    @staticmethod
+    def _memory_for_job(job):
+        '''
+        Declared memory requirement of a job, in bytes (0 if not declared)
+        '''
+        memory = getattr(job, 'memory_requirement', None)
+        if not memory:
+            return 0
+        return int(memory * 1024 * 1024)
+
+    def _memory_limit(self):
+        '''
+        Memory which running jobs may use, in bytes, or None if not limited.
+        '''
+        if self._max_memory:
+            return self._max_memory * 1024 * 1024
+        return self._physical_memory
+
+    def _is_available_memory(self, memory=0, limit=None):
+        '''
+        Check if a job needing the given memory (in bytes) can be started
+        within the memory limit (given by _memory_limit() if not
+        specified), given the memory used or reserved by the running jobs.
+        '''
+        if not self._processes:
+            # run alone, even if it needs more than the limit
             return True
+        if limit is None:
+            limit = self._memory_limit()
+            if limit is None:
+                return True
+        return self._used_memory + memory <= limit
+
+    def _running_memory(self, job_id):
+        '''
+        Memory of a running job, in bytes: the highest of its declared
+        requirement and its last sampled memory.
+        '''
+        return max(self._memory_for_job(self._jobs[job_id]),
+                   self._memory.get(job_id, 0))
+
+    def _max_cpus(self):
+        '''
+        Maximum number of CPUs to be used (MAX_CPU_NB, or the number of
+        processors of the machine if 0)
+        '''
         max_proc_nb = self._max_proc_nb
         if max_proc_nb == 0:
             if have_psutil:
                 max_proc_nb = cpu_count()
             else:
                 max_proc_nb = cpu_count() - 1
-        if n <= max_proc_nb and self.is_available_cpu(ncpu):
+        return max_proc_nb
+
+    def _can_submit_new_job(self, ncpu=1, memory=0, memory_limit=None):
+        # memory is checked first: is_available_cpu() accounts for the job
+        # it accepts
+        if not self._is_available_memory(memory, memory_limit):
+            return False
+        n = self._allocated_cpus + ncpu
+        if n <= self._proc_nb:
+            return True
+        if n <= self._max_cpus() and self.is_available_cpu(ncpu):
             return True
         return False
 
+    @staticmethod
+    def _now():
+        return time.time()
+
     @staticmethod
     def is_available_cpu(ncpu=1):
         # OK if there is at least one half CPU left idle
@@ -389,13 +911,68 @@ class LocalScheduler(Scheduler):
         with self._lock:
             # print("job submission " + repr(job.job_id))
             drmaa_id = str(job.job_id)
-            self._queue.append(drmaa_id)
+            if job.is_engine_execution:
+                self._engine_jobs.append(drmaa_id)
+            else:
+                # heapq pops the lowest keys first
+                key = tuple([-x for x in job.scheduling_priority()])
+                heapq.heappush(self._queue,
+                               (key, next(self._submission_count), drmaa_id))
+                if job.duration_hint:
+                    self._queued_hints += 1
             self._jobs[drmaa_id] = job
             self._status[drmaa_id] = constants.QUEUED_ACTIVE
-            self._queue.sort(key=lambda job_id: self._jobs[drmaa_id].priority,
-                             reverse=True)
+            self._submission_times[drmaa_id] = self._now()
+        self._wake()
         return drmaa_id
 
+    def queued_jobs(self):
+        '''
+        * return: *list of string*
+            Ids of the jobs waiting to be run, in the order they will be
+            considered.
+        '''
+        with self._lock:
+            return self._engine_jobs \
+                + [entry[2] for entry in sorted(self._queue)]
+
+    def stats(self):
+        '''
+        * return: *dict*
+            Current state of the scheduler:
+
+            * allocated_cpus: number of CPUs used by the running jobs
+            * max_cpus: maximum number of CPUs which may be used
+            * running_jobs: number of running jobs
+            * queued_jobs: number of jobs waiting to be run
+            * oldest_wait: time the oldest queued job has been waiting, in
+              seconds, or None if the queue is empty
+            * dispatched_jobs: number of jobs started since the scheduler
+              has been created
+            * dispatch_latency: mean time the last 100 started jobs have
+              waited in the queue, in seconds, or None
+            * max_dispatch_latency: maximum of these times, or None
+        '''
+        with self._lock:
+            now = self._now()
+            oldest_wait = None
+            if self._submission_times:
+                oldest_wait = now - min(self._submission_times.values())
+            dispatch_latency = None
+            max_dispatch_latency = None
+            if self._dispatch_latencies:
+                dispatch_latency = sum(self._dispatch_latencies) \
+                    / len(self._dispatch_latencies)
+                max_dispatch_latency = max(self._dispatch_latencies)
+            return {'allocated_cpus': self._allocated_cpus,
+                    'max_cpus': max(self._proc_nb, self._max_cpus()),
+                    'running_jobs': len(self._processes),
+                    'queued_jobs': len(self._queue) + len(self._engine_jobs),
+                    'oldest_wait': oldest_wait,
+                    'dispatched_jobs': self._dispatched_jobs,
+                    'dispatch_latency': dispatch_latency,
+                    'max_dispatch_latency': max_dispatch_latency}
+
     def get_job_status(self, scheduler_job_id):
         '''
         * scheduler_job_id *string*
@@ -422,6 +999,31 @@ class LocalScheduler(Scheduler):
             del self._exit_info[scheduler_job_id]
         return exit_info
 
+    def get_jobs_status(self, scheduler_job_ids):
+        '''
+        * scheduler_job_ids *list of string*
+        * return: *dict scheduler_job_id -> status*
+            Unknown jobs are not in the returned dict.
+        '''
+        with self._lock:
+            return dict([(job_id, self._status[job_id])
+                         for job_id in scheduler_job_ids
+                         if job_id in self._status])
+
+    def get_jobs_exit_info(self, scheduler_job_ids):
+        '''
+        * scheduler_job_ids *list of string*
+        * return: *dict scheduler_job_id -> exit info tuple*
+            Jobs without exit info are not in the returned dict.
+        '''
+        exit_info = {}
+        with self._lock:
+            for job_id in scheduler_job_ids:
+                info = self._exit_info.pop(job_id, None)
+                if info is not None:
+                    exit_info[job_id] = info
+        return exit_info
+
     def kill_job(self, scheduler_job_id):
         '''
         * scheduler_job_id *string*
@@ -455,15 +1057,30 @@ class LocalScheduler(Scheduler):
                     process.communicate()
 
                 del self._processes[scheduler_job_id]
+                self._allocated_cpus -= self._job_cpus.pop(scheduler_job_id)
+                self._polled_processes.pop(scheduler_job_id, None)
+                self._start_times.pop(scheduler_job_id, None)
+                self._peak_memory.pop(scheduler_job_id, None)
+                self._used_memory -= self._running_memory(scheduler_job_id)
+                self._memory.pop(scheduler_job_id, None)
                 self._status[scheduler_job_id] = constants.FAILED
                 self._exit_info[scheduler_job_id] = (constants.USER_KILLED,
                                                      None,
                                                      None,
                                                      None)
-            elif scheduler_job_id in self._queue:
+            elif self._status.get(scheduler_job_id) \
+                    == constants.QUEUED_ACTIVE:
                 # print("    => removed from queue ")
-                self._queue.remove(scheduler_job_id)
+                if scheduler_job_id in self._engine_jobs:
+                    self._engine_jobs.remove(scheduler_job_id)
+                else:
+                    self._queue = [entry for entry in self._queue
+                                   if entry[2] != scheduler_job_id]
+                    heapq.heapify(self._queue)
+                    if self._jobs[scheduler_job_id].duration_hint:
+                        self._queued_hints -= 1
                 del self._jobs[scheduler_job_id]
+                self._submission_times.pop(scheduler_job_id, None)
                 self._status[scheduler_job_id] = constants.FAILED
                 self._exit_info[scheduler_job_id] = (constants.EXIT_ABORTED,
                                                      None,
@@ -471,6 +1088,72 @@ class LocalScheduler(Scheduler):
                                                      None)
 
 
+def format_resource_usage(rusage=None, start_time=None, end_time=None,
+                          peak_memory=None):
+    '''
+    Resource usage of a job in the exit info format: a string of
+    ``name=value`` items separated with spaces. Items names follow PBS where
+    they exist (see :meth:`Scheduler.get_job_exit_info`) and are understood
+    by the GUI:
+
+    * cput: CPU time, ``HH:MM:SS``
+    * utime, stime: user and system CPU time, in seconds
+    * cpupercent: mean CPU usage
+    * walltime: ``HH:MM:SS``
+    * mem: maximum memory, ``<n>kb``: sampled memory of the process tree, or
+      maximum resident memory of a single process if it is higher
+    * maxrss: maximum resident memory of a single process, ``<n>kb``
+    * inblock, oublock: number of file system inputs and outputs
+    * start_time, end_time: in seconds since the epoch
+
+    Parameters
+    ----------
+    rusage: resource.struct_rusage (optional)
+        as returned by os.wait4()
+    start_time: float (optional)
+    end_time: float (optional)
+    peak_memory: int (optional)
+        sampled peak memory of the process tree, in bytes
+
+    Returns
+    -------
+    resource_usage: str
+        empty string if no information is given
+    '''
+    def hms(seconds):
+        seconds = int(round(seconds))
+        return '%02d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60,
+                                   seconds % 60)
+
+    items = []
+    walltime = None
+    if start_time is not None and end_time is not None:
+        walltime = end_time - start_time
+    maxrss = None
+    if rusage is not None:
+        cput = rusage.ru_utime + rusage.ru_stime
+        items += ['cput=%s' % hms(cput), 'utime=%.3f' % rusage.ru_utime,
+                  'stime=%.3f' % rusage.ru_stime]
+        if walltime:
+            items.append('cpupercent=%d' % int(round(cput * 100. / walltime)))
+        # ru_maxrss is in kilobytes, but in bytes on Mac OS
+        maxrss = rusage.ru_maxrss
+        if sys.platform == 'darwin':
+            maxrss //= 1024
+    memory = maxrss
+    if peak_memory is not None:
+        memory = max(memory or 0, peak_memory // 1024)
+    if memory is not None:
+        items.append('mem=%dkb' % memory)
+    if maxrss is not None:
+        items += ['maxrss=%dkb' % maxrss, 'inblock=%d' % rusage.ru_inblock,
+                  'oublock=%d' % rusage.ru_oublock]
+    if walltime is not None:
+        items += ['walltime=%s' % hms(walltime),
+                  'start_time=%.3f' % start_time, 'end_time=%.3f' % end_time]
+    return ' '.join(items)
+
+
 def kill_process_tree(pid):
     """
     Kill a process with its children.
@@ -497,14 +1180,16 @@ class ConfiguredLocalScheduler(LocalScheduler):
         super(ConfiguredLocalScheduler, self).__init__(
             config.get_proc_nb(),
             config.get_interval(),
-            config.get_max_proc_nb())
+            config.get_max_proc_nb(),
+            config.get_max_memory())
         self._config = config
 
         self._config.addObserver(self,
                                  "update_from_config",
                                  [LocalSchedulerCfg.PROC_NB_CHANGED,
                                   LocalSchedulerCfg.INTERVAL_CHANGED,
-                                  LocalSchedulerCfg.MAX_PROC_NB_CHANGED, ])
+                                  LocalSchedulerCfg.MAX_PROC_NB_CHANGED,
+                                  LocalSchedulerCfg.MAX_MEMORY_CHANGED, ])
 
     def update_from_config(self, observable, event, msg):
         if event == LocalSchedulerCfg.PROC_NB_CHANGED:
@@ -513,6 +1198,8 @@ class ConfiguredLocalScheduler(LocalScheduler):
             self.change_interval(self._config.get_interval())
         elif event == LocalSchedulerCfg.MAX_PROC_NB_CHANGED:
             self.change_max_proc_nb(self._config.get_max_proc_nb())
+        elif event == LocalSchedulerCfg.MAX_MEMORY_CHANGED:
+            self.change_max_memory(self._config.get_max_memory())
         self._config.save_to_file()
 
     @classmethod
@@ -136,6 +136,13 @@ class PBSProScheduler(Scheduler):
     is_sleeping = False
     FAKE_JOB = -167
 
+    # max number of jobs queried in a single qstat command
+    max_qstat_jobs = 500
+
+    # jobs status dicts from the last get_jobs_status() call, used by
+    # get_jobs_exit_info()
+    _extended_status_cache = None
+
     def __init__(self,
                  parallel_job_submission_info,
                  tmp_file_path=None,
@@ -155,6 +162,7 @@ class PBSProScheduler(Scheduler):
         self.parallel_job_submission_info = parallel_job_submission_info
 
         self._configured_native_spec = configured_native_spec
+        self._extended_status_cache = {}
 
         self.logger.debug("Parallel job submission info: %s",
                           repr(parallel_job_submission_info))
@@ -441,43 +449,96 @@ class PBSProScheduler(Scheduler):
         if scheduler_job_id == self.FAKE_JOB:
             # a barrier job is done as soon as it is started.
             return constants.DONE
-        try:
-            if self._pbs_impl == 'pbspro':
-                cmd = ['qstat', '-x', '-f', '-F', 'json', scheduler_job_id]
-                json_str = subprocess.check_output(cmd).decode('utf-8')
-                super_status = json.loads(json_str)
-
-            else:  # torque/pbs
-                import xml.etree.cElementTree as ET
-                cmd = ['qstat', '-x', scheduler_job_id]
-                xml_str = subprocess.check_output(cmd).decode('utf-8')
-                super_status = {}
-                s_xml = ET.fromstring(xml_str)
-                xjob = s_xml[0]
-                job = {}
-                parsing = [(xjob, job)]
-                while parsing:
-                    element, parent = parsing.pop(0)
-                    for child in element:
-                        tag = child.tag
-                        if tag == 'Job_Id':
-                            super_status['Jobs'] = {child.text: job}
-                        else:
-                            if len(child) != 0:
-                                current = {}
-                                parsing.append((child, current))
-                            else:
-                                current = child.text
-                            parent[tag] = current
-                    current = None
-        except Exception as e:
-            self.logger.critical("%s: %s" % (type(e), e))
-            raise
-        status = super_status['Jobs'][scheduler_job_id]
+        status = self.get_jobs_extended_status([scheduler_job_id])[
+            scheduler_job_id]
         self.logger.debug('get_job_extended_status: ' + repr(scheduler_job_id)
                           + ': ' + repr(status))
         return status
 
+    def get_jobs_extended_status(self, scheduler_job_ids):
+        '''
+        Get the full status of several jobs using a single qstat command
+        (per chunk of max_qstat_jobs jobs).
+
+        Returns
+        -------
+        status: dict
+            scheduler_job_id -> job status dict. Jobs unknown by PBS are not
+            in the dict.
+        '''
+        if self.is_sleeping:
+            self.wake()
+        scheduler_job_ids = [job_id for job_id in scheduler_job_ids
+                             if job_id != self.FAKE_JOB]
+        super_status = {}
+        for chunk in range(0, len(scheduler_job_ids), self.max_qstat_jobs):
+            job_ids = scheduler_job_ids[chunk:chunk + self.max_qstat_jobs]
+            try:
+                if self._pbs_impl == 'pbspro':
+                    cmd = ['qstat', '-x', '-f', '-F', 'json'] + job_ids
+                    json_str = self._qstat_output(cmd)
+                    if json_str.strip():
+                        super_status.update(
+                            json.loads(json_str).get('Jobs', {}))
+
+                else:  # torque/pbs
+                    import xml.etree.cElementTree as ET
+                    cmd = ['qstat', '-x'] + job_ids
+                    xml_str = self._qstat_output(cmd)
+                    if xml_str.strip():
+                        s_xml = ET.fromstring(xml_str)
+                        for xjob in s_xml:
+                            job_id, job = self._parse_torque_job(xjob)
+                            if job_id is not None:
+                                super_status[job_id] = job
+            except Exception as e:
+                self.logger.critical("%s: %s" % (type(e), e))
+                raise
+        return super_status
+
+    @staticmethod
+    def _qstat_output(cmd):
+        '''
+        Run a qstat command and return its output. When some of the requested
+        jobs are unknown, qstat fails but still prints the other ones, thus
+        the error is only raised if nothing is output.
+        '''
+        try:
+            return subprocess.check_output(cmd).decode('utf-8')
+        except subprocess.CalledProcessError as e:
+            if e.output:
+                return e.output.decode('utf-8')
+            raise
+
+    @staticmethod
+    def _parse_torque_job(xjob):
+        '''
+        Convert a Job element of the torque qstat XML output into a dict
+
+        Returns
+        -------
+        job_id: str
+        job: dict
+        '''
+        job_id = None
+        job = {}
+        parsing = [(xjob, job)]
+        while parsing:
+            element, parent = parsing.pop(0)
+            for child in element:
+                tag = child.tag
+                if tag == 'Job_Id':
+                    job_id = child.text
+                else:
+                    if len(child) != 0:
+                        current = {}
+                        parsing.append((child, current))
+                    else:
+                        current = child.text
+                    parent[tag] = current
+            current = None
+        return job_id, job
+
     def get_pbs_status_codes(self):
         if self._pbs_impl == 'pbspro':
             class codes(object):
@@ -524,14 +585,53 @@ class PBSProScheduler(Scheduler):
         if scheduler_job_id == self.FAKE_JOB:
             # it's a barrier job, doesn't exist in DRMS, and it's always done.
             return constants.DONE
-        codes = self.get_pbs_status_codes()
         try:
             status = self.get_job_extended_status(scheduler_job_id)
-            state = status['job_state']
             self.logger.debug(
-                'get_job_status for: ' + repr(scheduler_job_id) + ': ', repr(state))
+                'get_job_status for: ' + repr(scheduler_job_id) + ': '
+                + repr(status['job_state']))
         except Exception:
             return constants.UNDETERMINED
+        return self._status_from_extended_status(status)
+
+    def get_jobs_status(self, scheduler_job_ids):
+        '''
+        Get the status of several jobs using a single qstat command. The qstat
+        output is kept until the next call, so that get_jobs_exit_info() does
+        not need to run qstat again for the jobs which have ended.
+
+        Parameters
+        ----------
+        scheduler_job_ids: list
+            Job ids for the scheduling system
+
+        Returns
+        -------
+        status: dict
+            scheduler_job_id -> job status as defined in constants.JOB_STATUS
+        '''
+        try:
+            ext_status = self.get_jobs_extended_status(scheduler_job_ids)
+        except Exception:
+            ext_status = {}
+        self._extended_status_cache = ext_status
+        status = {}
+        for scheduler_job_id in scheduler_job_ids:
+            if scheduler_job_id == self.FAKE_JOB:
+                status[scheduler_job_id] = constants.DONE
+                continue
+            job_status = ext_status.get(scheduler_job_id)
+            if job_status is not None:
+                status[scheduler_job_id] \
+                    = self._status_from_extended_status(job_status)
+        return status
+
+    def _status_from_extended_status(self, status):
+        '''
+        Translate a job status dict from qstat into a soma-workflow status
+        '''
+        codes = self.get_pbs_status_codes()
+        state = status.get('job_state')
         if state == codes.ARRAY_STARTED:
             return constants.RUNNING
         elif state == codes.EXITING:
@@ -603,15 +703,65 @@ class PBSProScheduler(Scheduler):
             return (res_status, res_exitValue, res_termSignal,
                     res_resourceUsage)
 
+        self.logger.debug(
+            "  ==> Start to find info of job %s" % (scheduler_job_id))
+        status = self.get_job_extended_status(scheduler_job_id)
+        return self._exit_info_from_extended_status(status)
+
+    def get_jobs_exit_info(self, scheduler_job_ids):
+        '''
+        Get the exit info of several jobs. Jobs which status has been
+        retrieved by the last call to get_jobs_status() are not queried again,
+        the other ones are queried using a single qstat command.
+
+        Parameters
+        ----------
+        scheduler_job_ids: list
+            Job ids for the scheduling system
+
+        Returns
+        -------
+        exit_info: dict
+            scheduler_job_id -> exit info tuple (exit_status, exit_value,
+            term_sig, resource_usage)
+        '''
+        cache = self._extended_status_cache
+        ext_status = {}
+        missing = []
+        for scheduler_job_id in scheduler_job_ids:
+            if scheduler_job_id == self.FAKE_JOB:
+                continue
+            status = cache.pop(scheduler_job_id, None)
+            if status is None:
+                missing.append(scheduler_job_id)
+            else:
+                ext_status[scheduler_job_id] = status
+        if missing:
+            try:
+                ext_status.update(self.get_jobs_extended_status(missing))
+            except Exception:
+                pass
+        exit_info = {}
+        for scheduler_job_id in scheduler_job_ids:
+            if scheduler_job_id == self.FAKE_JOB:
+                exit_info[scheduler_job_id] = self.get_job_exit_info(
+                    scheduler_job_id)
+            elif scheduler_job_id in ext_status:
+                exit_info[scheduler_job_id] \
+                    = self._exit_info_from_extended_status(
+                        ext_status[scheduler_job_id])
+        return exit_info
+
+    def _exit_info_from_extended_status(self, status):
+        '''
+        Build the exit info tuple from a job status dict from qstat
+        '''
         res_resourceUsage = []
         res_status = constants.EXIT_UNDETERMINED
         res_exitValue = 0
         res_termSignal = None
 
         try:
-            self.logger.debug(
-                "  ==> Start to find info of job %s" % (scheduler_job_id))
-            status = self.get_job_extended_status(scheduler_job_id)
             jid_out = status['Output_Path']
             exit_value = status.get('Exit_status', -1)
             signaled = False
@@ -35,14 +35,18 @@ if __name__ == '__main__':
                      tmp_file_dir_path,
                      shared_tmp_dir=None,
                      logging_configuration=None,
-                     remove_orphan_files=True):
+                     remove_orphan_files=True,
+                     process_lock=False,
+                     journal_mode='TRUNCATE'):
             soma_workflow.database_server.WorkflowDatabaseServer.__init__(
                 self,
                 database_file,
                 tmp_file_dir_path,
                 shared_tmp_dir,
                 logging_configuration,
-                remove_orphan_files)
+                remove_orphan_files,
+                process_lock,
+                journal_mode)
 
     if not len(sys.argv) == 2:
         sys.stdout.write(
@@ -83,7 +87,9 @@ if __name__ == '__main__':
                                     config.get_transfered_file_dir(),
                                     config.get_shared_temporary_directory(),
                                     config.get_server_log_info(),
-                                    config.get_remove_orphan_files())
+                                    config.get_remove_orphan_files(),
+                                    config.get_embedded_database_server(),
+                                    config.get_database_journal_mode())
 
     logging.debug("The server has been instantiated ")
 
@@ -304,7 +304,20 @@ if __name__ == "__main__":
             database_server = WorkflowDatabaseServer(
                 config.get_database_file(),
                 config.get_transfered_file_dir(),
-                remove_orphan_files=config.get_remove_orphan_files())
+                remove_orphan_files=config.get_remove_orphan_files(),
+                journal_mode=config.get_database_journal_mode())
+        elif config.get_embedded_database_server():
+            # the database server lives in the engine process: no RPC, the
+            # other engines and servers of the resource are synchronized
+            # through the database lock file.
+            logger.info("using an embedded database server")
+            database_server = WorkflowDatabaseServer(
+                config.get_database_file(),
+                config.get_transfered_file_dir(),
+                config.get_shared_temporary_directory(),
+                remove_orphan_files=config.get_remove_orphan_files(),
+                process_lock=True,
+                journal_mode=config.get_database_journal_mode())
         else:
             database_server = get_database_server_proxy(config, logger)
             logger.debug("database_server launched")
@@ -68,6 +68,21 @@ res &= soma_workflow.test.workflow_tests.test_workflow_env.test()
 import soma_workflow.test.test_serialization
 res &= soma_workflow.test.test_serialization.test()
 
+import soma_workflow.test.test_engine_loop
+res &= soma_workflow.test.test_engine_loop.test()
+
+import soma_workflow.test.test_engine_workflow
+res &= soma_workflow.test.test_engine_workflow.test()
+
+import soma_workflow.test.test_scheduler
+res &= soma_workflow.test.test_scheduler.test()
+
+import soma_workflow.test.test_embedded_database_server
+res &= soma_workflow.test.test_embedded_database_server.test()
+
+import soma_workflow.test.test_database_server
+res &= soma_workflow.test.test_database_server.test()
+
 if res:
     print('All tests OK')
     sys.exit(0)
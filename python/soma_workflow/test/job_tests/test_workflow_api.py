@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import absolute_import
+from __future__ import print_function
 import unittest
+import time
 import sys
 
 import soma_workflow.client as wfclient
+from soma_workflow.errors import WorkflowError
 
 
 class WorkflowApiTests(unittest.TestCase):
@@ -70,6 +73,113 @@ class WorkflowApiTests(unittest.TestCase):
         self.assertTrue(len(workflow3.groups) == 2)
         self.assertTrue(len(workflow3.dependencies) == 17)
 
+    def test_group_dependencies_conversion(self):
+        jobs = [wfclient.Job(['ls'], name='job%d' % i) for i in range(6)]
+        groups = [wfclient.Group(jobs[i * 2:i * 2 + 2], name='group%d' % i)
+                  for i in range(3)]
+        workflow = wfclient.Workflow(
+            jobs, dependencies=[(groups[0], groups[1]),
+                                (groups[0], groups[1])],
+            root_group=groups)
+        # 2 hubs for each of the 2 groups, 4 intra-groups dependencies for
+        # each, and the duplicated group dependency converted once
+        self.assertEqual(len(workflow.jobs), 10)
+        self.assertEqual(len(workflow.dependencies), 9)
+        # groups already converted keep their hubs
+        workflow.add_dependencies([(groups[1], groups[2]),
+                                   (groups[0], groups[1])])
+        self.assertEqual(len(workflow.jobs), 12)
+        self.assertEqual(len(workflow.dependencies), 14)
+        self.assertFalse(any([isinstance(dep[0], wfclient.Group)
+                              or isinstance(dep[1], wfclient.Group)
+                              for dep in workflow.dependencies]))
+        # converting again does not change anything
+        deps = list(workflow.dependencies)
+        workflow.add_dependencies([])
+        self.assertEqual(workflow.dependencies, deps)
+
+    def test_group_dependencies_time(self):
+        # 10000 groups of 10 jobs, each group depending on the previous one
+        ngroups = 10000
+        jobs = [wfclient.Job(['ls'], name='job%d' % i)
+                for i in range(ngroups * 10)]
+        groups = [wfclient.Group(jobs[i * 10:(i + 1) * 10],
+                                 name='group%d' % i)
+                  for i in range(ngroups)]
+        dependencies = [(jobs[i], jobs[i + 1]) for i in range(0, len(jobs), 2)]
+        dependencies += [(groups[i], groups[i + 1])
+                         for i in range(0, ngroups - 1, 2)]
+        start = time.time()
+        workflow = wfclient.Workflow(jobs, dependencies, root_group=groups)
+        build_time = time.time() - start
+        start = time.time()
+        workflow.add_dependencies([(groups[i], groups[i + 1])
+                                   for i in range(1, ngroups - 1, 2)])
+        add_time = time.time() - start
+        self.assertEqual(len(workflow.jobs), ngroups * 12)
+        self.assertEqual(len(workflow.dependencies),
+                         ngroups * 5 + ngroups - 1 + ngroups * 20)
+        print('\nworkflow of %d groups / %d jobs: construction: %.2f s, '
+              'group dependencies added: %.2f s'
+              % (ngroups, ngroups * 10, build_time, add_time),
+              file=sys.stderr)
+        self.assertTrue(build_time + add_time < 20.)
+
+    def test_reduce_dependencies(self):
+        jobs = [wfclient.Job(['ls'], name='job%d' % i) for i in range(6)]
+        group = wfclient.Group(jobs[3:5], name='group')
+        dependencies = [(jobs[0], jobs[1]), (jobs[1], jobs[2]),
+                        (jobs[0], jobs[2]),  # redundant
+                        (jobs[0], jobs[1]),  # duplicate
+                        (jobs[2], group), (jobs[2], jobs[3]),  # redundant
+                        (group, jobs[5]), (jobs[4], jobs[5]),  # redundant
+                        (jobs[0], jobs[5])]  # redundant
+        workflow = wfclient.Workflow(jobs, list(dependencies),
+                                     root_group=jobs[:3] + [group, jobs[5]])
+        ndeps = len(workflow.dependencies)
+        self.assertEqual(workflow.reduce_dependencies(), 5)
+        self.assertEqual(len(workflow.dependencies), ndeps - 5)
+        in_hub, out_hub = workflow._group_to_hub[group]
+        self.assertEqual(
+            set(workflow.dependencies),
+            set([(jobs[0], jobs[1]), (jobs[1], jobs[2]), (jobs[2], in_hub),
+                 (in_hub, jobs[3]), (in_hub, jobs[4]), (jobs[3], out_hub),
+                 (jobs[4], out_hub), (out_hub, jobs[5])]))
+        self.assertEqual(workflow.reduce_dependencies(), 0)
+        # same result with dependencies as a set
+        workflow2 = wfclient.Workflow(jobs[:3], set(dependencies[:4]))
+        self.assertEqual(workflow2.reduce_dependencies(), 1)
+        self.assertEqual(workflow2.dependencies,
+                         set([(jobs[0], jobs[1]), (jobs[1], jobs[2])]))
+        # cycles are detected
+        workflow3 = wfclient.Workflow(jobs[:3], dependencies[:3]
+                                      + [(jobs[2], jobs[0])])
+        self.assertRaises(WorkflowError, workflow3.reduce_dependencies)
+
+    def test_reduce_dependencies_time(self):
+        # layers of 100 jobs, each job depending on all the jobs of the 2
+        # previous layers: the dependencies on the layer before the previous
+        # one are all redundant.
+        nlayers = 50
+        width = 50
+        layers = [[wfclient.Job(['ls'], name='job%d_%d' % (i, j))
+                   for j in range(width)] for i in range(nlayers)]
+        dependencies = []
+        for i in range(1, nlayers):
+            for layer in layers[max(0, i - 2):i]:
+                dependencies += [(job1, job2) for job1 in layer
+                                 for job2 in layers[i]]
+        ndeps = len(dependencies)
+        workflow = wfclient.Workflow(sum(layers, []), dependencies)
+        start = time.time()
+        removed = workflow.reduce_dependencies()
+        reduce_time = time.time() - start
+        self.assertEqual(removed, (nlayers - 2) * width * width)
+        self.assertEqual(len(workflow.dependencies),
+                         (nlayers - 1) * width * width)
+        print('\ntransitive reduction of %d dependencies: %.2f s'
+              % (ndeps, reduce_time), file=sys.stderr)
+
 
 def test():
     suite = unittest.TestLoader().loadTestsFromTestCase(WorkflowApiTests)
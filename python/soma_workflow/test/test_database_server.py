@@ -0,0 +1,629 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the WorkflowDatabaseServer internals: connection pool, schema
+migrations and indexes, and micro-benchmarks of the methods called by each
+engine loop iteration.
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import tempfile
+import shutil
+import sqlite3
+import threading
+import pickle
+import unittest
+import six
+from datetime import datetime, timedelta
+
+import soma_workflow.constants as constants
+from soma_workflow.client import Job, Workflow, FileTransfer, TemporaryPath, \
+    Group
+from soma_workflow.database_server import WorkflowDatabaseServer, \
+    create_database, get_schema_revision, DB_SCHEMA_REVISION, \
+    strtime_format, encode_engine_object, decode_engine_object
+from soma_workflow.errors import DatabaseError, UnknownObjectError
+from soma_workflow.engine import WorkflowEngineLoop
+from soma_workflow.engine_types import EngineWorkflow, EngineJob
+from soma_workflow.schedulers.local_scheduler import LocalScheduler
+
+
+class UnpooledDatabaseServer(WorkflowDatabaseServer):
+
+    '''
+    Database server opening a new connection for each access, as before the
+    connection pool was introduced: reference for benchmarks.
+    '''
+
+    def _connect(self, read_only=False):
+        connection = sqlite3.connect(
+            self._database_file, timeout=10, isolation_level="EXCLUSIVE",
+            check_same_thread=False)
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA journal_mode = TRUNCATE")
+        return connection
+
+
+class DatabaseServerTest(unittest.TestCase):
+
+    nloops = 200
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='swf_database_server_')
+        self.database_file = os.path.join(self.tmp_dir, 'soma_workflow.db')
+        self.database_server = WorkflowDatabaseServer(self.database_file,
+                                                      self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def add_workflow(self, database_server=None, njobs=10):
+        '''
+        Add a workflow using an engine loop which is not started, thus jobs
+        stay pending. Returns the workflow id, user id, jobs ids and a
+        transfer id. The first job also has a temporary output.
+        '''
+        if database_server is None:
+            database_server = self.database_server
+        scheduler = LocalScheduler(proc_nb=1, interval=0.1)
+        try:
+            engine_loop = WorkflowEngineLoop(database_server, scheduler)
+            input_file = os.path.join(self.tmp_dir, 'input.txt')
+            open(input_file, 'w').close()
+            transfer = FileTransfer(True, input_file, name='input')
+            jobs = [Job([sys.executable, '-c', 'pass'], name='job%d' % i,
+                        referenced_input_files=[transfer])
+                    for i in range(njobs)]
+            jobs[0].referenced_output_files = [TemporaryPath(name='tmp')]
+            wf_id = engine_loop.add_workflow(
+                Workflow(jobs, name='db_test'),
+                datetime.now() + timedelta(days=1), 'db_test', None)
+            user_id = engine_loop._user_id
+        finally:
+            scheduler.end_scheduler_thread()
+        jobs_info, transfers_info, wf_status, wf_queue, tmp_files \
+            = database_server.get_detailed_workflow_status(wf_id)
+        job_ids = [job_info[0] for job_info in jobs_info]
+        transfer_id = transfers_info[0][0]
+        return wf_id, user_id, job_ids, transfer_id
+
+    def test_connection_reuse(self):
+        connection = self.database_server._connect()
+        # nested connections are distinct
+        connection2 = self.database_server._connect()
+        self.assertFalse(connection2 is connection)
+        connection2.close()
+        connection.close()
+        self.assertTrue(self.database_server._connect() is connection)
+        connection.close()
+        # other threads get their own connections
+        other = []
+
+        def connect():
+            c = self.database_server._connect()
+            other.append(c)
+            c.close()
+
+        thread = threading.Thread(target=connect)
+        thread.start()
+        thread.join()
+        self.assertFalse(other[0] is connection)
+
+    def test_uncommitted_changes_discarded(self):
+        connection = self.database_server._connect()
+        cursor = connection.cursor()
+        cursor.execute("INSERT INTO users (login) VALUES ('ghost')")
+        cursor.close()
+        # close without commit: the transaction is rolled back, and the
+        # database is not left locked
+        connection.close()
+        other = sqlite3.connect(self.database_file, timeout=1)
+        try:
+            self.assertEqual(
+                other.execute("SELECT count(*) FROM users WHERE "
+                              "login='ghost'").fetchone()[0], 0)
+            other.execute("INSERT INTO users (login) VALUES ('other')")
+            other.commit()
+        finally:
+            other.close()
+
+    def test_database_file_replaced(self):
+        user_id = self.database_server.register_user('user1')
+        self.assertEqual(self.database_server.register_user('user1'),
+                         user_id)
+        # replace the database file by a new, empty database
+        new_file = os.path.join(self.tmp_dir, 'new.db')
+        create_database(new_file)
+        os.rename(new_file, self.database_file)
+        # pooled connections point to the old file: they must be discarded
+        connection = self.database_server._connect()
+        try:
+            count = connection.execute(
+                "SELECT count(*) FROM users").fetchone()[0]
+        finally:
+            connection.close()
+        self.assertEqual(count, 0)
+
+    def test_wal_concurrent_reads(self):
+        database_server = WorkflowDatabaseServer(
+            os.path.join(self.tmp_dir, 'soma_workflow_wal.db'), self.tmp_dir,
+            journal_mode='WAL')
+        wf_id, user_id, job_ids, transfer_id \
+            = self.add_workflow(database_server)
+        connection = database_server._connect()
+        try:
+            self.assertEqual(
+                connection.execute("PRAGMA journal_mode").fetchone()[0],
+                'wal')
+        finally:
+            connection.close()
+        status = database_server.get_workflow_status(wf_id, user_id)[0]
+        results = []
+
+        def read():
+            results.append(database_server.get_workflow_status(
+                wf_id, user_id)[0])
+            results.append(database_server.get_detailed_workflow_status(
+                wf_id)[2])
+
+        # a write is in progress: the server lock is held and a write
+        # transaction is open
+        with database_server._lock:
+            connection = database_server._connect()
+            connection.execute("UPDATE workflows SET status=? WHERE id=?",
+                               (constants.WORKFLOW_DONE, wf_id))
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join(5)
+            # reads are not blocked, and see the last committed state
+            self.assertFalse(thread.is_alive())
+            self.assertEqual(results, [status, status])
+            connection.commit()
+            connection.close()
+        self.assertEqual(database_server.get_workflow_status(
+            wf_id, user_id)[0], constants.WORKFLOW_DONE)
+
+    def test_schema_migration(self):
+        user_id = self.database_server.register_user('user1')
+        # bring the database back to the initial schema (revision 0)
+        connection = sqlite3.connect(self.database_file)
+        try:
+            indexes = [row[0] for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type='index' AND "
+                "name NOT LIKE 'sqlite_autoindex_%'")]
+            self.assertTrue('jobs_workflow_id' in indexes)
+            for index in indexes:
+                connection.execute('DROP INDEX %s' % index)
+            connection.execute('PRAGMA user_version = 0')
+            connection.commit()
+        finally:
+            connection.close()
+        # opening the database migrates it, and keeps its contents
+        database_server = WorkflowDatabaseServer(self.database_file,
+                                                 self.tmp_dir)
+        self.assertEqual(database_server.register_user('user1'), user_id)
+        connection = sqlite3.connect(self.database_file)
+        try:
+            self.assertEqual(get_schema_revision(connection),
+                             DB_SCHEMA_REVISION)
+            new_indexes = [row[0] for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type='index' AND "
+                "name NOT LIKE 'sqlite_autoindex_%'")]
+        finally:
+            connection.close()
+        self.assertEqual(sorted(new_indexes), sorted(indexes))
+
+    def test_query_plans(self):
+        self.add_workflow()
+        # hot queries, and the index each one should use
+        queries = [
+            ('SELECT id, status, exit_status, queue, drmaa_id FROM jobs '
+             'WHERE workflow_id=?', [1], 'jobs_workflow_id'),
+            ('SELECT id FROM jobs WHERE user_id=? AND status=?',
+             [1, constants.DELETE_PENDING], 'jobs_user_status_queue'),
+            ('SELECT count(*) FROM jobs WHERE user_id=? and ( status=? or '
+             'status=? ) and queue=?',
+             [1, constants.RUNNING, constants.UNDETERMINED, 'q'],
+             'jobs_user_status_queue'),
+            ('SELECT id FROM jobs WHERE expiration_date < ?', ['2020-01-01'],
+             'jobs_expiration_date'),
+            ('SELECT id FROM workflows WHERE user_id=? AND status=?',
+             [1, constants.DELETE_PENDING], 'workflows_user_status'),
+            ('SELECT id, engine_file_path, status FROM transfers '
+             'WHERE workflow_id=?', [1], 'transfers_workflow_id'),
+            ('SELECT temp_path_id, engine_file_path, status '
+             'FROM temporary_paths WHERE workflow_id=?', [1],
+             'temporary_paths_workflow_id'),
+            ('SELECT dest_param, src_job_id, src_param, pickled_function '
+             'FROM param_links WHERE dest_job_id=?', [1],
+             'param_links_dest_job_id'),
+            ('SELECT engine_file_id, is_input FROM ios WHERE job_id=?', [1],
+             'sqlite_autoindex_ios_1'),
+            ('SELECT DISTINCT engine_file_id FROM ios '
+             'WHERE engine_file_id IN (?, ?)', [1, 2], 'ios_engine_file_id'),
+        ]
+        connection = self.database_server._connect()
+        try:
+            for query, args, index in queries:
+                plan = ' '.join([row[-1] for row in connection.execute(
+                    'EXPLAIN QUERY PLAN ' + query, args)])
+                self.assertTrue('INDEX %s' % index in plan,
+                                'query: %s\nplan: %s' % (query, plan))
+        finally:
+            connection.close()
+
+    def test_apply_updates(self):
+        wf_id, user_id, job_ids, transfer_id = self.add_workflow()
+        updates = [
+            ('set_jobs_status',
+             (dict([(job_id, constants.RUNNING) for job_id in job_ids]), ),
+             {}),
+            ('set_transfer_status', (transfer_id, constants.FILES_ON_CR), {}),
+            ('set_workflow_status', (wf_id, constants.WORKFLOW_IN_PROGRESS),
+             {})]
+        # a failing update cancels the whole batch
+        self.assertRaises(
+            DatabaseError, self.database_server.apply_updates,
+            updates + [('set_jobs_exit_info', ({job_ids[0]: None}, ), {})])
+        self.assertEqual(self.database_server.get_workflow_status(
+            wf_id, user_id)[0], constants.WORKFLOW_NOT_STARTED)
+        self.assertEqual(self.database_server.get_job_status(
+            job_ids[0], user_id)[0], constants.NOT_SUBMITTED)
+        self.assertEqual(self.database_server.get_transfer_status(
+            transfer_id, user_id), constants.FILES_ON_CLIENT)
+        # only the methods which support it can be used
+        self.assertRaises(
+            DatabaseError, self.database_server.apply_updates,
+            [('delete_workflow', (wf_id, ), {})])
+        self.database_server.apply_updates(updates)
+        self.assertEqual(self.database_server.get_workflow_status(
+            wf_id, user_id)[0], constants.WORKFLOW_IN_PROGRESS)
+        self.assertEqual(
+            [status for status, date in self.database_server.get_jobs_status(
+                job_ids, user_id)], [constants.RUNNING] * len(job_ids))
+        self.assertEqual(self.database_server.get_transfer_status(
+            transfer_id, user_id), constants.FILES_ON_CR)
+
+    def test_bulk_transfers_status(self):
+        wf_id, user_id, job_ids, transfer_id = self.add_workflow()
+        wf_id2 = self.add_workflow()[0]
+        tmp_id = self.database_server.get_detailed_workflow_status(
+            wf_id)[4][0][0]
+        other_user_id = self.database_server.register_user('other_user')
+        # unknown objects are ignored
+        self.assertEqual(
+            self.database_server.get_transfers_status(
+                [transfer_id, transfer_id + 1000], user_id),
+            {transfer_id: constants.FILES_ON_CLIENT})
+        self.assertEqual(
+            self.database_server.get_transfers_status([transfer_id],
+                                                      other_user_id), {})
+        self.assertEqual(
+            self.database_server.get_temporaries_status(
+                [tmp_id, tmp_id + 1000], user_id),
+            {tmp_id: constants.FILES_ON_CR})
+        self.assertEqual(
+            self.database_server.get_temporaries_status([], user_id), {})
+        # ended transfers
+        self.assertEqual(
+            self.database_server.pop_ended_transfers([wf_id, wf_id2]), {})
+        self.database_server.add_workflow_ended_transfer(wf_id, transfer_id)
+        self.assertEqual(
+            self.database_server.pop_ended_transfers([wf_id, wf_id2]),
+            {wf_id: [str(transfer_id)]})
+        self.assertEqual(
+            self.database_server.pop_ended_transfers([wf_id, wf_id2]), {})
+
+    def test_jobs_mean_duration(self):
+        wf_id, user_id, job_ids, transfer_id = self.add_workflow(njobs=3)
+        job_ids2 = self.add_workflow(njobs=3)[2]
+        other_user_id = self.database_server.register_user('other_user')
+        ending_date = datetime(2020, 1, 1, 12)
+        # job id -> (exit value, execution date, submission date)
+        runs = {job_ids[0]: (0, ending_date - timedelta(seconds=10), None),
+                job_ids2[0]: (0, ending_date - timedelta(seconds=20), None),
+                # failed
+                job_ids[1]: (1, ending_date - timedelta(seconds=10), None),
+                # running status missed
+                job_ids[2]: (0, None, ending_date - timedelta(seconds=5))}
+        connection = self.database_server._connect()
+        cursor = connection.cursor()
+        for job_id, (exit_value, execution_date, submission_date) \
+                in runs.items():
+            cursor.execute(
+                '''UPDATE jobs SET status=?, exit_status=?, exit_value=?,
+                execution_date=?, submission_date=?, ending_date=?
+                WHERE id=?''',
+                (constants.DONE, constants.FINISHED_REGULARLY, exit_value,
+                 execution_date.strftime(strtime_format)
+                 if execution_date else None,
+                 submission_date.strftime(strtime_format)
+                 if submission_date else None,
+                 ending_date.strftime(strtime_format), job_id))
+        connection.commit()
+        cursor.close()
+        connection.close()
+        self.assertEqual(
+            self.database_server.get_jobs_mean_duration(
+                user_id, ['job0', 'job1', 'job2', 'unknown']),
+            {'job0': 15., 'job2': 5.})
+        self.assertEqual(
+            self.database_server.get_jobs_mean_duration(
+                other_user_id, ['job0']), {})
+        self.assertEqual(
+            self.database_server.get_jobs_mean_duration(user_id, []), {})
+
+    def test_workflow_resource_usage(self):
+        wf_id, user_id, job_ids, transfer_id = self.add_workflow(njobs=4)
+        other_user_id = self.database_server.register_user('other_user')
+        usage = self.database_server.get_workflow_resource_usage(wf_id,
+                                                                 user_id)
+        self.assertEqual(usage['jobs'], 0)
+        self.assertEqual(usage['cpu_time'], None)
+        self.assertEqual(usage['max_memory'], None)
+        # local scheduler and PBS formats
+        resource_usage = {
+            job_ids[0]: 'cput=00:00:02 utime=1.500 stime=0.250 '
+                        'cpupercent=44 mem=2048kb maxrss=2048kb inblock=8 '
+                        'oublock=16 walltime=00:00:04',
+            job_ids[1]: b'cpupercent=60 mem=13530kb cput=00:00:12 '
+                        b'walltime=00:00:20',
+            job_ids[2]: None}
+        for job_id, ru in resource_usage.items():
+            self.database_server.set_job_exit_info(
+                job_id, constants.FINISHED_REGULARLY, 0, None, ru)
+        usage = self.database_server.get_workflow_resource_usage(wf_id,
+                                                                 user_id)
+        self.assertEqual(usage['jobs'], 2)
+        self.assertAlmostEqual(usage['cpu_time'], 13.75)
+        self.assertEqual(usage['walltime'], 24.)
+        self.assertAlmostEqual(usage['cpu_percent'], 13.75 * 100. / 24.)
+        self.assertEqual(usage['max_memory'], 13530 * 1024)
+        self.assertEqual(usage['max_memory_job'], job_ids[1])
+        self.assertEqual(usage['inblock'], 8)
+        self.assertEqual(usage['oublock'], 16)
+        self.assertRaises(UnknownObjectError,
+                          self.database_server.get_workflow_resource_usage,
+                          wf_id, other_user_id)
+
+    def test_add_workflow_throughput(self):
+        njobs = 20000
+        user_id = self.database_server.register_user('swf_test')
+        transfers = [FileTransfer(True, os.path.join(self.tmp_dir,
+                                                     'input%d.txt' % i),
+                                  name='input%d' % i)
+                     for i in range(10)]
+        temp = TemporaryPath(name='tmp')
+        jobs = [Job(['echo', 'job', i, [i, i + 1]], name='job%d' % i,
+                    referenced_input_files=[transfers[i % 10]])
+                for i in range(njobs)]
+        jobs[0].referenced_output_files = [temp]
+        jobs[1].referenced_input_files.append(temp)
+        dependencies = [(jobs[i], jobs[i + 1]) for i in range(njobs - 1)]
+        param_links = {jobs[1]: {'input': [(jobs[0], 'output')]}}
+        workflow = Workflow(jobs, dependencies, name='throughput',
+                            param_links=param_links)
+        engine_workflow = EngineWorkflow(
+            workflow, {}, None, datetime.now() + timedelta(days=1),
+            'throughput')
+        start = time.time()
+        engine_workflow = self.database_server.add_workflow(user_id,
+                                                            engine_workflow)
+        duration = time.time() - start
+        print('\nadd_workflow: %d jobs in %.2f s: %.0f jobs/s'
+              % (njobs, duration, njobs / duration), file=sys.stderr)
+
+        # all elements are registered with their own ids
+        self.assertEqual(len(engine_workflow.registered_jobs), njobs)
+        self.assertEqual(len(engine_workflow.registered_tr), 10)
+        self.assertEqual(len(engine_workflow.registered_tmp), 1)
+        jobs_info, transfers_info, wf_status, wf_queue, tmp_info \
+            = self.database_server.get_detailed_workflow_status(
+                engine_workflow.wf_id)
+        self.assertEqual(sorted([job_info[0] for job_info in jobs_info]),
+                         sorted(engine_workflow.registered_jobs.keys()))
+        self.assertEqual(sorted([tr_info[0] for tr_info in transfers_info]),
+                         sorted(engine_workflow.registered_tr.keys()))
+        self.assertEqual([tmp[0] for tmp in tmp_info],
+                         list(engine_workflow.registered_tmp.keys()))
+        ejob = engine_workflow.job_mapping[jobs[1]]
+        self.assertEqual(
+            self.database_server.get_job_command(ejob.job_id),
+            "'echo' 'job' 1 '[1, 2]'")
+        self.assertEqual(len(set(
+            [engine_job.stdout_file for engine_job
+             in six.itervalues(engine_workflow.registered_jobs)])), njobs)
+        with self.database_server._connect() as connection:
+            self.assertEqual(
+                connection.execute(
+                    'SELECT COUNT(*) FROM ios WHERE engine_file_id=?',
+                    [transfers_info[0][0]]).fetchone()[0], njobs // 10)
+            self.assertEqual(
+                connection.execute(
+                    'SELECT job_id, is_input FROM ios_tmp ORDER BY job_id'
+                    ).fetchall(),
+                [(engine_workflow.job_mapping[jobs[0]].job_id, False),
+                 (ejob.job_id, True)])
+            self.assertEqual(
+                connection.execute(
+                    'SELECT dest_job_id, dest_param, src_job_id, src_param '
+                    'FROM param_links').fetchall(),
+                [(ejob.job_id, 'input',
+                  engine_workflow.job_mapping[jobs[0]].job_id, 'output')])
+        # ids are not reused by the next workflow
+        job = Job(['echo'], name='job')
+        engine_workflow2 = self.database_server.add_workflow(
+            user_id,
+            EngineWorkflow(Workflow([job]), {}, None,
+                           datetime.now() + timedelta(days=1), 'next'))
+        self.assertTrue(min(engine_workflow2.registered_jobs.keys())
+                        > max(engine_workflow.registered_jobs.keys()))
+
+    def test_engine_objects_encoding(self):
+        user_id = self.database_server.register_user('swf_test')
+        transfer = FileTransfer(True, os.path.join(self.tmp_dir, 'input.txt'),
+                                name='input')
+        temp = TemporaryPath(name='tmp')
+        job1 = Job(['cat', transfer, temp], name='job1',
+                   referenced_input_files=[transfer],
+                   referenced_output_files=[temp], env={'JOB_VAR': 'job'},
+                   param_dict={'input': transfer, 'values': (1, 2)})
+        job2 = Job(['ls', temp], name='job2', referenced_input_files=[temp],
+                   param_dict={'input': temp})
+        group = Group([job1, job2], name='group')
+        workflow = Workflow([job1, job2], [(job1, job2)], root_group=[group],
+                            env={'WF_VAR': 'wf'},
+                            param_links={job2: {'input': [(job1, 'input')]}})
+        workflow.user_storage = {'key': [1, 2]}
+        engine_workflow = self.database_server.add_workflow(
+            user_id,
+            EngineWorkflow(workflow, {}, None,
+                           datetime.now() + timedelta(days=1), 'encoding'))
+        with self.database_server._connect() as connection:
+            data = connection.execute(
+                'SELECT pickled_engine_workflow FROM workflows WHERE id=?',
+                [engine_workflow.wf_id]).fetchone()[0]
+        self.assertRaises(Exception, pickle.loads, data)
+
+        decoded = self.database_server.get_engine_workflow(
+            engine_workflow.wf_id, user_id)
+        self.assertEqual(decoded.wf_id, engine_workflow.wf_id)
+        self.assertEqual(decoded.user_storage, {'key': [1, 2]})
+        self.assertEqual(sorted(decoded.registered_jobs.keys()),
+                         sorted(engine_workflow.registered_jobs.keys()))
+        self.assertEqual(sorted(decoded.registered_tr.keys()),
+                         sorted(engine_workflow.registered_tr.keys()))
+        self.assertEqual(sorted(decoded.registered_tmp.keys()),
+                         sorted(engine_workflow.registered_tmp.keys()))
+        self.assertEqual(len(decoded.dependencies), 1)
+        self.assertEqual(decoded.root_group[0].name, 'group')
+        for job_id, engine_job in six.iteritems(
+                engine_workflow.registered_jobs):
+            decoded_job = decoded.registered_jobs[job_id]
+            self.assertEqual(decoded_job.name, engine_job.name)
+            self.assertEqual(decoded_job.stdout_file, engine_job.stdout_file)
+            self.assertEqual(decoded_job.plain_command(),
+                             engine_job.plain_command())
+            self.assertEqual(decoded_job.env, engine_job.env)
+        ejob1 = decoded.job_mapping[decoded.jobs[0]]
+        self.assertEqual(ejob1.env['WF_VAR'], 'wf')
+        self.assertEqual(ejob1.param_dict['values'], (1, 2))
+        ejob2 = decoded.registered_jobs[
+            engine_workflow.job_mapping[job2].job_id]
+        self.assertEqual(decoded.job_mapping[decoded.jobs[1]], ejob2)
+        self.assertEqual(
+            list(decoded.registered_tr.values())[0].engine_path,
+            list(engine_workflow.registered_tr.values())[0].engine_path)
+
+        # standalone jobs are stored the same way
+        engine_job = EngineJob(Job(['echo', 'standalone'], name='job'),
+                               None)
+        engine_job = self.database_server.add_job(
+            user_id, engine_job,
+            expiration_date=datetime.now() + timedelta(days=1))
+        job_id = engine_job.job_id
+        decoded_job, workflow_id = self.database_server.get_engine_job(
+            job_id, user_id)
+        self.assertEqual(decoded_job.job_id, job_id)
+        self.assertEqual(decoded_job.plain_command(), ['echo', 'standalone'])
+        self.assertEqual(decoded_job.stdout_file, engine_job.stdout_file)
+
+        # pickles written by older versions are still read
+        with self.database_server._connect() as connection:
+            connection.execute(
+                'UPDATE workflows SET pickled_engine_workflow=? WHERE id=?',
+                [sqlite3.Binary(pickle.dumps(engine_workflow)),
+                 engine_workflow.wf_id])
+            connection.commit()
+        decoded = self.database_server.get_engine_workflow(
+            engine_workflow.wf_id, user_id)
+        self.assertEqual(sorted(decoded.registered_jobs.keys()),
+                         sorted(engine_workflow.registered_jobs.keys()))
+
+    def test_engine_workflow_encoding_size(self):
+        njobs = 10000
+        transfers = [FileTransfer(True, os.path.join(self.tmp_dir,
+                                                     'input%d.txt' % i),
+                                  name='input%d' % i)
+                     for i in range(10)]
+        jobs = [Job(['echo', 'job', i, transfers[i % 10]], name='job%d' % i,
+                    referenced_input_files=[transfers[i % 10]],
+                    param_dict={'index': i})
+                for i in range(njobs)]
+        env = dict([('VAR%d' % i, '/some/path/%d' % i) for i in range(20)])
+        engine_workflow = EngineWorkflow(
+            Workflow(jobs, name='size', env=env), {}, None,
+            datetime.now() + timedelta(days=1), 'size')
+        for i, engine_job in enumerate(
+                six.itervalues(engine_workflow.job_mapping)):
+            engine_job.job_id = i + 1
+            engine_workflow.registered_jobs[engine_job.job_id] = engine_job
+
+        start = time.time()
+        data = encode_engine_object(engine_workflow)
+        encode_time = time.time() - start
+        start = time.time()
+        pickled = pickle.dumps(engine_workflow, protocol=2)
+        pickle_time = time.time() - start
+        # restoring a workflow (at engine restart) should not be slower than
+        # unpickling it was: keep the best of a few runs to limit the noise
+        decode_time = unpickle_time = None
+        for i in range(3):
+            start = time.time()
+            decoded = decode_engine_object(data, EngineWorkflow)
+            elapsed = time.time() - start
+            if decode_time is None or elapsed < decode_time:
+                decode_time = elapsed
+            start = time.time()
+            pickle.loads(pickled)
+            elapsed = time.time() - start
+            if unpickle_time is None or elapsed < unpickle_time:
+                unpickle_time = elapsed
+        print('\nengine workflow (%d jobs): encoded: %d bytes, %.2f s / '
+              '%.2f s, pickle: %d bytes, %.2f s / %.2f s'
+              % (njobs, len(data), encode_time, decode_time, len(pickled),
+                 pickle_time, unpickle_time), file=sys.stderr)
+        self.assertEqual(len(decoded.registered_jobs), njobs)
+        self.assertTrue(len(data) < len(pickled))
+        self.assertTrue(decode_time < unpickle_time * 1.5)
+
+    def method_time(self, method, *args):
+        start = time.time()
+        for i in range(self.nloops):
+            method(*args)
+        return (time.time() - start) / self.nloops
+
+    def test_hot_methods_benchmark(self):
+        wf_id, user_id, job_ids, transfer_id = self.add_workflow()
+        unpooled_server = UnpooledDatabaseServer(self.database_file,
+                                                 self.tmp_dir)
+        results = []
+        for name, args in (('get_job_status', (job_ids[0], user_id)),
+                           ('get_transfer_status', (transfer_id, user_id)),
+                           ('nb_running_jobs', (user_id, )),
+                           ('get_workflow_status', (wf_id, user_id))):
+            unpooled = self.method_time(getattr(unpooled_server, name),
+                                        *args)
+            pooled = self.method_time(getattr(self.database_server, name),
+                                      *args)
+            results.append((name, unpooled, pooled))
+        print(file=sys.stderr)
+        for name, unpooled, pooled in results:
+            print('%s: new connection: %.1f us, pooled: %.1f us'
+                  % (name, unpooled * 1e6, pooled * 1e6), file=sys.stderr)
+        # the whole set of methods should be faster
+        self.assertTrue(sum([r[2] for r in results])
+                        < sum([r[1] for r in results]))
+
+
+def test():
+    suite = unittest.TestLoader().loadTestsFromTestCase(DatabaseServerTest)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == '__main__':
+    sys.exit(0 if test() else 1)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the database server embedded in the workflow engine process: locking
+between processes using the same database, and latency of the database calls
+done by an engine loop iteration, compared to a database server accessed
+through a zro proxy (separate database server process).
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import tempfile
+import shutil
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+import soma_workflow.constants as constants
+from soma_workflow import zro
+from soma_workflow.client import Job, Workflow
+from soma_workflow.database_server import WorkflowDatabaseServer, \
+    DatabaseFileLock
+from soma_workflow.engine import WorkflowEngineLoop
+from soma_workflow.schedulers.local_scheduler import LocalScheduler
+
+
+class EmbeddedDatabaseServerTest(unittest.TestCase):
+
+    # number of jobs updated at each simulated loop iteration
+    njobs = 50
+    nloops = 20
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='swf_embedded_db_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_process_lock(self):
+        lock_file = os.path.join(self.tmp_dir, 'soma_workflow.db.lock')
+        # two locks on the same file behave like two processes
+        lock1 = DatabaseFileLock(lock_file)
+        lock2 = DatabaseFileLock(lock_file)
+        acquired = []
+
+        def acquire_lock2():
+            with lock2:
+                acquired.append(time.time())
+
+        with lock1:
+            # re-entrant
+            with lock1:
+                thread = threading.Thread(target=acquire_lock2)
+                thread.start()
+                time.sleep(0.2)
+                self.assertEqual(acquired, [])
+            # still held by the outer level
+            time.sleep(0.2)
+            self.assertEqual(acquired, [])
+            release_time = time.time()
+        thread.join(5)
+        self.assertEqual(len(acquired), 1)
+        self.assertTrue(acquired[0] >= release_time)
+
+    def loop_database_calls(self, database_server, user_id, wf_id, job_ids):
+        '''
+        database calls done by an engine loop iteration while the jobs of a
+        workflow are running.
+        '''
+        database_server.jobs_to_delete_and_kill(user_id)
+        database_server.workflows_to_delete_and_kill(user_id)
+        database_server.set_jobs_status(
+            dict([(job_id, constants.RUNNING) for job_id in job_ids]))
+        # per-job updates (submission, ended jobs...)
+        for job_id in job_ids:
+            database_server.set_job_status(job_id, constants.RUNNING)
+        database_server.set_workflow_status(wf_id,
+                                            constants.WORKFLOW_IN_PROGRESS)
+
+    def loop_latency(self, database_server, user_id, wf_id, job_ids):
+        times = []
+        for i in range(self.nloops):
+            start = time.time()
+            self.loop_database_calls(database_server, user_id, wf_id,
+                                     job_ids)
+            times.append(time.time() - start)
+        times.sort()
+        return times[len(times) // 2]
+
+    def test_loop_latency(self):
+        database_file = os.path.join(self.tmp_dir, 'soma_workflow.db')
+        database_server = WorkflowDatabaseServer(database_file, self.tmp_dir,
+                                                 process_lock=True)
+        scheduler = LocalScheduler(proc_nb=1, interval=0.1)
+        obj_serv = zro.ObjectServer()
+        try:
+            engine_loop = WorkflowEngineLoop(database_server, scheduler)
+            jobs = [Job([sys.executable, '-c', 'pass'], name='job%d' % i)
+                    for i in range(self.njobs)]
+            wf_id = engine_loop.add_workflow(
+                Workflow(jobs, name='latency'),
+                datetime.now() + timedelta(days=1), 'latency', None)
+            user_id = engine_loop._user_id
+            job_ids = [job_info[0] for job_info in
+                       database_server.get_detailed_workflow_status(wf_id)[0]]
+
+            # the same database server accessed as a separate server
+            uri = obj_serv.register(database_server)
+            server_thread = threading.Thread(target=obj_serv.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
+            proxy = zro.Proxy(uri)
+            self.assertTrue(proxy.test())
+
+            embedded_time = self.loop_latency(database_server, user_id,
+                                              wf_id, job_ids)
+            proxy_time = self.loop_latency(proxy, user_id, wf_id, job_ids)
+            print('\nengine loop database calls (%d jobs): embedded: '
+                  '%.2f ms, proxy: %.2f ms'
+                  % (self.njobs, embedded_time * 1000, proxy_time * 1000),
+                  file=sys.stderr)
+            self.assertTrue(embedded_time < proxy_time)
+        finally:
+            obj_serv.stop()
+            scheduler.end_scheduler_thread()
+
+
+def test():
+    suite = unittest.TestLoader().loadTestsFromTestCase(
+        EmbeddedDatabaseServerTest)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == '__main__':
+    sys.exit(0 if test() else 1)
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the workflow engine loop, run in-process with a local scheduler and
+a temporary database.
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import tempfile
+import shutil
+import unittest
+from datetime import datetime, timedelta
+
+import soma_workflow.constants as constants
+from soma_workflow.client import Job, Workflow
+from soma_workflow.database_server import WorkflowDatabaseServer
+from soma_workflow.errors import DatabaseError
+from soma_workflow.engine import WorkflowEngineLoop, EngineLoopThread, \
+    DatabaseUpdateBuffer, PendingQueue, FairSharePendingQueue
+from soma_workflow.schedulers.local_scheduler import LocalScheduler
+
+
+class PendingJob(object):
+
+    def __init__(self, name, priority=0, workflow_id=-1):
+        self.name = name
+        self.priority = priority
+        self.workflow_id = workflow_id
+
+    def __repr__(self):
+        return self.name
+
+    def scheduling_priority(self):
+        return (self.priority, 0.)
+
+
+class FailingDatabaseServer(WorkflowDatabaseServer):
+
+    '''
+    Database server which apply_updates() fails while *fail* is True.
+    '''
+
+    fail = False
+
+    def apply_updates(self, updates):
+        if self.fail:
+            raise DatabaseError('database is locked')
+        super(FailingDatabaseServer, self).apply_updates(updates)
+
+
+class EngineLoopTest(unittest.TestCase):
+
+    # the engine loop fallback timeout: much longer than the tests should
+    # last, so that only events can make the loop iterate.
+    loop_interval = 30.
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='swf_engine_loop_')
+        self.database_server = WorkflowDatabaseServer(
+            os.path.join(self.tmp_dir, 'soma_workflow.db'),
+            self.tmp_dir)
+        self.scheduler = LocalScheduler(proc_nb=2, interval=0.02)
+        self.engine_loop = WorkflowEngineLoop(self.database_server,
+                                              self.scheduler)
+        self.loop_thread = EngineLoopThread(self.engine_loop)
+        self.loop_thread.time_interval = self.loop_interval
+        self.loop_thread.setDaemon(True)
+        self.loop_thread.start()
+
+    def tearDown(self):
+        self.loop_thread.stop()
+        self.scheduler.end_scheduler_thread()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def wait_workflow(self, wf_id, timeout):
+        user_id = self.engine_loop._user_id
+        start = time.time()
+        while time.time() - start < timeout:
+            status = self.database_server.get_workflow_status(
+                wf_id, user_id)[0]
+            if status == constants.WORKFLOW_DONE:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_wake_up_on_events(self):
+        jobs = [Job([sys.executable, '-c', 'pass'], name='job%d' % i)
+                for i in range(4)]
+        dependencies = [(jobs[i], jobs[i + 1]) for i in range(len(jobs) - 1)]
+        workflow = Workflow(jobs, dependencies, name='chain')
+        start = time.time()
+        wf_id = self.engine_loop.add_workflow(
+            workflow, datetime.now() + timedelta(days=1), 'chain', None)
+        # each job end needs a loop iteration: without events, the chain
+        # would take len(jobs) * loop_interval
+        self.assertTrue(self.wait_workflow(wf_id, self.loop_interval / 2))
+        self.assertTrue(time.time() - start < self.loop_interval / 2)
+        jobs_info = self.database_server.get_detailed_workflow_status(
+            wf_id)[0]
+        self.assertEqual(len(jobs_info), len(jobs))
+        for job_info in jobs_info:
+            self.assertEqual(job_info[1], constants.DONE)
+            self.assertEqual(job_info[3][0], constants.FINISHED_REGULARLY)
+
+    def test_active_jobs_index(self):
+        jobs = [Job([sys.executable, '-c', 'pass'], name='job%d' % i)
+                for i in range(3)]
+        jobs.append(Job([sys.executable, '-c', 'import time; time.sleep(3)'],
+                        name='long_job'))
+        workflow = Workflow(jobs, name='index')
+        wf_id = self.engine_loop.add_workflow(
+            workflow, datetime.now() + timedelta(days=1), 'index', None)
+        start = time.time()
+        done = []
+        while len(done) < 3 and time.time() - start < 10:
+            time.sleep(0.05)
+            jobs_info = self.database_server.get_detailed_workflow_status(
+                wf_id)[0]
+            done = [job_info[0] for job_info in jobs_info
+                    if job_info[1] == constants.DONE]
+            running = [job_info[0] for job_info in jobs_info
+                       if job_info[1] != constants.DONE]
+        self.assertEqual(len(done), 3)
+        with self.engine_loop._lock:
+            # only the long job is still polled
+            self.assertEqual(list(self.engine_loop._active_jobs.keys()),
+                             running)
+        self.assertTrue(self.wait_workflow(wf_id, 10))
+        self.engine_loop.wait_one_loop()
+        with self.engine_loop._lock:
+            self.assertEqual(len(self.engine_loop._active_jobs), 0)
+            self.assertEqual(len(self.engine_loop._changed_jobs), 0)
+
+    def test_database_update_buffer(self):
+        updates = DatabaseUpdateBuffer(self.database_server)
+        updates.set_jobs_status({1: constants.RUNNING, 2: constants.RUNNING})
+        updates.set_jobs_status({2: constants.DONE, 3: constants.RUNNING})
+        updates.set_workflow_status(1, constants.WORKFLOW_IN_PROGRESS,
+                                    force=True)
+        updates.set_transfer_status(4, constants.FILES_ON_CR)
+        updates.set_workflow_status(1, constants.WORKFLOW_DONE)
+        updates.set_jobs_status({4: constants.DONE})
+        # consecutive jobs status are merged, the workflow status is only
+        # written once, with its last value
+        self.assertEqual(
+            [update[:2] for update in updates._updates],
+            [['set_jobs_status', ({1: constants.RUNNING, 2: constants.DONE,
+                                   3: constants.RUNNING}, )],
+             ['set_workflow_status', (1, constants.WORKFLOW_DONE)],
+             ['set_transfer_status', (4, constants.FILES_ON_CR)],
+             ['set_jobs_status', ({4: constants.DONE}, )]])
+        self.assertEqual(updates._updates[1][2], {'force': True})
+        self.assertEqual(updates.transfer_status(4), constants.FILES_ON_CR)
+        self.assertEqual(updates.transfer_status(5, 'default'), 'default')
+
+    def test_database_update_buffer_failure(self):
+        user_id = self.engine_loop._user_id
+        database_server = FailingDatabaseServer(
+            os.path.join(self.tmp_dir, 'soma_workflow.db'),
+            self.tmp_dir)
+        wf_id = self.engine_loop.add_workflow(
+            Workflow([Job(['echo'], name='job')], name='failure'),
+            datetime.now() + timedelta(days=1), 'failure', None)
+        self.loop_thread.stop()
+        updates = DatabaseUpdateBuffer(database_server)
+        updates.set_workflow_status(wf_id, constants.WORKFLOW_IN_PROGRESS)
+        database_server.fail = True
+        self.assertRaises(DatabaseError, updates.flush)
+        # the updates are kept, before the ones recorded afterwards
+        self.assertEqual(len(updates), 1)
+        self.assertTrue(updates.age() > 0)
+        updates.set_workflow_status(wf_id, constants.WORKFLOW_DONE)
+        self.assertEqual(
+            [update[:2] for update in updates._updates],
+            [['set_workflow_status', (wf_id, constants.WORKFLOW_DONE)]])
+        database_server.fail = False
+        updates.flush()
+        self.assertEqual(len(updates), 0)
+        self.assertEqual(
+            self.database_server.get_workflow_status(wf_id, user_id)[0],
+            constants.WORKFLOW_DONE)
+
+    def test_database_updates_window(self):
+        user_id = self.engine_loop._user_id
+        # keep the loop updates in memory during the whole test
+        self.engine_loop.update_window = 1000.
+        jobs = [Job([sys.executable, '-c', 'pass'], name='job%d' % i)
+                for i in range(3)]
+        dependencies = [(jobs[0], jobs[1]), (jobs[1], jobs[2])]
+        wf_id = self.engine_loop.add_workflow(
+            Workflow(jobs, dependencies, name='window'),
+            datetime.now() + timedelta(days=1), 'window', None)
+        start = time.time()
+        ended = False
+        while not ended and time.time() - start < 10:
+            time.sleep(0.05)
+            with self.engine_loop._lock:
+                ended = wf_id not in self.engine_loop._workflows
+        self.assertTrue(ended)
+        # the engine loop is done with the workflow, but has not written
+        # anything yet
+        self.assertEqual(
+            self.database_server.get_workflow_status(wf_id, user_id)[0],
+            constants.WORKFLOW_NOT_STARTED)
+        self.assertEqual(self.engine_loop._db_updates.flush_count, 0)
+        # stopping the loop writes all the updates at once
+        self.loop_thread.stop()
+        self.assertEqual(
+            self.database_server.get_workflow_status(wf_id, user_id)[0],
+            constants.WORKFLOW_DONE)
+        self.assertEqual(self.engine_loop._db_updates.flush_count, 1)
+        jobs_info = self.database_server.get_detailed_workflow_status(
+            wf_id)[0]
+        for job_info in jobs_info:
+            self.assertEqual(job_info[1], constants.DONE)
+            self.assertEqual(job_info[3][0], constants.FINISHED_REGULARLY)
+
+    def test_workflow_status_heartbeat(self):
+        user_id = self.engine_loop._user_id
+        job = Job([sys.executable, '-c', 'import time; time.sleep(6)'],
+                  name='long_job')
+        wf_id = self.engine_loop.add_workflow(
+            Workflow([job], name='heartbeat'),
+            datetime.now() + timedelta(days=1), 'heartbeat', None)
+        start = time.time()
+        status = None
+        while status != constants.WORKFLOW_IN_PROGRESS \
+                and time.time() - start < 5:
+            time.sleep(0.05)
+            status, date = self.database_server.get_workflow_status(
+                wf_id, user_id)
+        self.assertEqual(status, constants.WORKFLOW_IN_PROGRESS)
+        with self.engine_loop._lock:
+            job_id = list(
+                self.engine_loop._workflows[wf_id].registered_jobs)[0]
+        job_status = None
+        while job_status != constants.RUNNING and time.time() - start < 5:
+            self.engine_loop.wait_one_loop()
+            self.engine_loop.flush_database_updates()
+            job_status, job_date = self.database_server.get_job_status(
+                job_id, user_id)
+        self.assertEqual(job_status, constants.RUNNING)
+        # the status does not change: it is not written again (dates are
+        # stored with a 1 second resolution)
+        time.sleep(1.1)
+        self.engine_loop.wait_one_loop()
+        self.engine_loop.wait_one_loop()
+        self.assertEqual(
+            self.database_server.get_workflow_status(wf_id, user_id),
+            (status, date))
+        self.assertEqual(
+            self.database_server.get_job_status(job_id, user_id),
+            (job_status, job_date))
+        # until the periodic heartbeat
+        time.sleep(1.1)
+        with self.engine_loop._lock:
+            self.engine_loop._last_status_update = datetime.now() \
+                - timedelta(days=1)
+        self.engine_loop.wait_one_loop()
+        new_status, new_date = self.database_server.get_workflow_status(
+            wf_id, user_id)
+        self.assertEqual(new_status, status)
+        self.assertTrue(new_date > date)
+        # the job which is still running gets a heartbeat too
+        new_status, new_date = self.database_server.get_job_status(
+            job_id, user_id)
+        self.assertEqual(new_status, job_status)
+        self.assertTrue(new_date > job_date)
+        self.assertTrue(self.wait_workflow(wf_id, 10))
+
+    def test_pending_queue(self):
+        queue = PendingQueue()
+        jobs = [PendingJob('job%d' % i, priority=i % 3) for i in range(9)]
+        queue.extend(jobs[:6])
+        queue.push(jobs[6])
+        queue.extend(jobs[7:])
+        queue.remove(jobs[5])
+        self.assertEqual(len(queue), 8)
+        self.assertFalse(jobs[5] in queue)
+        self.assertTrue(queue.oldest_wait() >= 0)
+        # by priority, then in the order they have been added
+        self.assertEqual(queue.pop(), jobs[2])
+        self.assertEqual(queue.pop_all(),
+                         [jobs[8], jobs[1], jobs[4], jobs[7], jobs[0],
+                          jobs[3], jobs[6]])
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.oldest_wait(), None)
+        self.assertRaises(IndexError, queue.pop)
+
+        # a wave of 100000 jobs, queued one by one and in bulk
+        njobs = 100000
+        jobs = [PendingJob('job%d' % i, priority=i % 10)
+                for i in range(njobs)]
+        start = time.time()
+        for job in jobs:
+            queue.push(job)
+        push_time = time.time() - start
+        queue = PendingQueue()
+        start = time.time()
+        queue.extend(jobs)
+        extend_time = time.time() - start
+        start = time.time()
+        popped = [queue.pop() for i in range(njobs)]
+        pop_time = time.time() - start
+        self.assertEqual(popped[:2], [jobs[9], jobs[19]])
+        self.assertEqual(popped[-1], jobs[-10])
+        print('\npending queue of %d jobs: push: %.3f s, bulk: %.3f s, '
+              'pop: %.3f s' % (njobs, push_time, extend_time, pop_time),
+              file=sys.stderr)
+        self.assertTrue(push_time + extend_time + pop_time < 10.)
+
+    def simulate_dispatch(self, queue, workflows, slots):
+        '''
+        Simulate the submission of the jobs of workflows to a queue limited
+        to slots running jobs. Jobs last one time step, workflows are
+        submitted one per time step.
+
+        Returns the time step each workflow ends at.
+        '''
+        end_steps = {}
+        remaining = dict([(wf_id, len(jobs)) for wf_id, jobs in workflows])
+        step = 0
+        while remaining:
+            if step < len(workflows):
+                queue.extend(workflows[step][1])
+            for i in range(min(slots, len(queue))):
+                job = queue.pop()
+                remaining[job.workflow_id] -= 1
+                if remaining[job.workflow_id] == 0:
+                    del remaining[job.workflow_id]
+                    end_steps[job.workflow_id] = step
+            step += 1
+        return end_steps
+
+    def test_fair_share(self):
+        queue = FairSharePendingQueue()
+        jobs = [PendingJob('job%d' % i, priority=i, workflow_id=i // 3)
+                for i in range(6)] + [PendingJob('job6')]
+        queue.extend(jobs)
+        queue.remove(jobs[4])
+        self.assertEqual(len(queue), 6)
+        self.assertTrue(jobs[5] in queue)
+        self.assertFalse(jobs[4] in queue)
+        self.assertTrue(queue.oldest_wait() >= 0)
+        # in turn, by priority in each workflow
+        self.assertEqual(queue.pop_all(),
+                         [jobs[2], jobs[5], jobs[6], jobs[1], jobs[3],
+                          jobs[0]])
+        self.assertEqual(queue.oldest_wait(), None)
+        self.assertRaises(IndexError, queue.pop)
+
+        # a large workflow followed by small ones, on 4 slots
+        slots = 4
+        workflows = [(0, [PendingJob('big%d' % i, workflow_id=0)
+                          for i in range(2000)])]
+        for wf_id in range(1, 11):
+            workflows.append(
+                (wf_id, [PendingJob('small%d_%d' % (wf_id, i),
+                                    workflow_id=wf_id) for i in range(10)]))
+        fifo_end = self.simulate_dispatch(PendingQueue(), workflows, slots)
+        fair_end = self.simulate_dispatch(FairSharePendingQueue(), workflows,
+                                          slots)
+        small_fifo = max([fifo_end[wf_id] for wf_id in range(1, 11)])
+        small_fair = max([fair_end[wf_id] - wf_id for wf_id in range(1, 11)])
+        print('\nsmall workflows latency behind a large one: priority '
+              'order: %d steps, fair share: %d steps'
+              % (small_fifo, small_fair), file=sys.stderr)
+        self.assertTrue(small_fifo >= 500)
+        # each small workflow gets at least one slot over 11 workflows at
+        # each step
+        self.assertTrue(small_fair <= 10 * 11 // slots + 1)
+        # the slots are used as much
+        self.assertEqual(max(fair_end.values()), max(fifo_end.values()))
+
+    def test_pending_queues_info(self):
+        # no job may run in this queue
+        self.engine_loop._running_jobs_limits = {'limited': 0}
+        jobs = [Job([sys.executable, '-c', 'pass'], name='job%d' % i)
+                for i in range(3)]
+        wf_id = self.engine_loop.add_workflow(
+            Workflow(jobs, name='limited'),
+            datetime.now() + timedelta(days=1), 'limited', 'limited')
+        self.engine_loop.wait_one_loop()
+        time.sleep(0.1)
+        info = self.engine_loop.pending_queues_info()
+        self.assertEqual(info['limited'][0], 3)
+        self.assertTrue(info['limited'][1] >= 0.1)
+        self.engine_loop._running_jobs_limits = {'limited': 10}
+        self.engine_loop.wake_up()
+        self.assertTrue(self.wait_workflow(wf_id, 10))
+        self.assertEqual(self.engine_loop.pending_queues_info(),
+                         {'limited': (0, None)})
+
+    def test_scheduler_stats(self):
+        jobs = [Job([sys.executable, '-c', 'pass'], name='job%d' % i)
+                for i in range(3)]
+        wf_id = self.engine_loop.add_workflow(
+            Workflow(jobs, name='stats'),
+            datetime.now() + timedelta(days=1), 'stats', None)
+        self.assertTrue(self.wait_workflow(wf_id, 10))
+        stats = self.engine_loop.scheduler_stats()
+        self.assertEqual(stats['dispatched_jobs'], 3)
+        self.assertEqual(stats['allocated_cpus'], 0)
+        self.assertEqual(stats['running_jobs'], 0)
+        self.assertEqual(stats['queued_jobs'], 0)
+        self.assertTrue(stats['max_dispatch_latency'] >= 0)
+
+    def test_critical_path_priorities(self):
+        self.engine_loop._critical_path_priorities = True
+        jobs = [Job([sys.executable, '-c', 'pass'], name='job%d' % i)
+                for i in range(3)]
+        jobs[0].duration_hint = 10.
+        wf_id = self.engine_loop.add_workflow(
+            Workflow(jobs, [(jobs[0], jobs[1])], name='critical_path'),
+            datetime.now() + timedelta(days=1), 'critical_path', None)
+        with self.engine_loop._lock:
+            workflow = self.engine_loop._workflows[wf_id]
+            self.assertEqual(
+                sorted([job.critical_path
+                        for job in workflow.job_mapping.values()]),
+                [10., 10., 20.])
+        self.assertTrue(self.wait_workflow(wf_id, 10))
+
+    def test_stop_loop(self):
+        start = time.time()
+        self.loop_thread.stop()
+        self.assertFalse(self.loop_thread.is_alive())
+        self.assertTrue(time.time() - start < self.loop_interval / 2)
+
+
+def test():
+    suite = unittest.TestLoader().loadTestsFromTestCase(EngineLoopTest)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == '__main__':
+    sys.exit(0 if test() else 1)
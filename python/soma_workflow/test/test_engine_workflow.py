@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+'''
+Tests of the EngineWorkflow jobs follow-up: the incremental algorithm of
+EngineWorkflow.find_out_jobs_to_process() is checked against the full scan
+of find_out_jobs_to_process_nocache() on simulated executions of the
+workflow examples. Abort propagation after a job failure, workflow restart and
+critical path priorities are also tested.
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import random
+import shutil
+import pickle
+import unittest
+import warnings
+
+import soma_workflow.constants as constants
+from soma_workflow.client import Job, Workflow
+from soma_workflow.engine_types import EngineWorkflow
+from soma_workflow.engine import PendingQueue
+from soma_workflow.test.workflow_tests import WorkflowExamplesLocal, \
+    WorkflowExamplesTransfer
+
+
+class CountingDict(dict):
+
+    '''
+    Dictionary which counts its item accesses: used as the job_mapping of a
+    workflow, it counts the jobs visited by an inspection.
+    '''
+
+    count = 0
+
+    def __getitem__(self, key):
+        self.count += 1
+        return dict.__getitem__(self, key)
+
+
+class SimulatedWorkflow(object):
+
+    '''
+    EngineWorkflow which jobs are "executed" without a scheduler nor a
+    database: jobs states are changed directly.
+    '''
+
+    def __init__(self, client_workflow):
+        self.workflow = EngineWorkflow(client_workflow, {}, None, None,
+                                       'test')
+        self.jobs = [self.workflow.job_mapping[job]
+                     for job in self.workflow.jobs]
+        self.index = dict([(job, i) for i, job in enumerate(self.jobs)])
+        for i, job in enumerate(self.jobs):
+            # aborted jobs are only marked if they have an id
+            job.job_id = i + 1
+            self.workflow.registered_jobs[job.job_id] = job
+            # truncated at restart
+            job.stdout_file = os.devnull
+            job.stderr_file = os.devnull
+        self.transfers = sorted(
+            [transfer for transfer in self.workflow.transfer_mapping.values()
+             if hasattr(transfer, 'client_paths')],
+            key=lambda transfer: transfer.name)
+
+    def find_out_jobs_to_process(self, nocache=False):
+        if nocache:
+            to_run, ended_jobs, status \
+                = self.workflow.find_out_jobs_to_process_nocache()
+        else:
+            to_run, ended_jobs, status \
+                = self.workflow.find_out_jobs_to_process()
+        return (sorted([self.index[job] for job in to_run]),
+                sorted(ended_jobs.keys()), status)
+
+    def submit(self, job_indices):
+        for i in job_indices:
+            self.jobs[i].status = constants.SUBMISSION_PENDING
+
+    def set_running(self, i):
+        self.jobs[i].status = constants.RUNNING
+
+    def end(self, i, success):
+        job = self.jobs[i]
+        job.status = constants.DONE
+        job.exit_status = constants.FINISHED_REGULARLY
+        job.exit_value = 0 if success else 1
+
+    def kill(self, i):
+        job = self.jobs[i]
+        job.status = constants.FAILED
+        job.exit_status = constants.EXIT_NOTRUN
+        self.workflow.reset_dependency_state()
+
+    def transfer_ended(self, i):
+        self.transfers[i].status = constants.FILES_ON_CR
+
+
+class SimulatedDatabaseServer(object):
+
+    '''
+    Database server methods used by EngineWorkflow.restart() and
+    restart_jobs(): the jobs states are the ones of the simulated workflow.
+    '''
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def get_detailed_workflow_status(self, wf_id, with_drms_id=False):
+        jobs_info = [(job.job_id, job.status, None,
+                      (job.exit_status, job.exit_value, None, None), None,
+                      None) for job in self.sim.jobs]
+        return (jobs_info, [], constants.WORKFLOW_DONE, None, [])
+
+    def set_submission_information(self, *args, **kwargs):
+        pass
+
+    def set_jobs_status(self, *args, **kwargs):
+        pass
+
+    def set_queue(self, *args, **kwargs):
+        pass
+
+
+class EngineWorkflowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.examples = []
+
+    def tearDown(self):
+        for examples in self.examples:
+            shutil.rmtree(examples.output_dir, ignore_errors=True)
+
+    def example_workflows(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for examples_class in (WorkflowExamplesLocal,
+                                   WorkflowExamplesTransfer):
+                examples = examples_class()
+                self.examples.append(examples)
+                names = examples.get_workflow_example_list()
+                for name, workflow in zip(names, examples.get_workflows()):
+                    yield '%s.%s' % (examples_class.__name__, name), workflow
+
+    def simulate(self, name, client_workflow, seed, failure_rate):
+        '''
+        Run the workflow twice in lockstep, inspected by each algorithm, with
+        the same random sequence of events, and compare their results.
+        '''
+        ref = SimulatedWorkflow(client_workflow)
+        inc = SimulatedWorkflow(client_workflow)
+        rand = random.Random(seed)
+        submitted = []
+        step = 0
+        while True:
+            result = inc.find_out_jobs_to_process()
+            ref_result = ref.find_out_jobs_to_process(nocache=True)
+            self.assertEqual(result, ref_result,
+                             '%s, seed %d, step %d' % (name, seed, step))
+            to_run, ended, status = result
+            if status == constants.WORKFLOW_DONE:
+                break
+            self.assertTrue(step < 10 * len(ref.jobs) + 10, name)
+            step += 1
+            # submit some of the jobs to run, not always all of them
+            to_submit = [i for i in to_run if rand.random() < 0.8]
+            for sim in (ref, inc):
+                sim.submit(to_submit)
+            submitted += to_submit
+            # events: jobs start or end, transfers end, waiting jobs are
+            # killed
+            for i in list(submitted):
+                event = rand.random()
+                if event < 0.3:
+                    for sim in (ref, inc):
+                        sim.set_running(i)
+                elif event < 0.7:
+                    success = rand.random() >= failure_rate
+                    for sim in (ref, inc):
+                        sim.end(i, success)
+                    submitted.remove(i)
+            for i, transfer in enumerate(ref.transfers):
+                if not transfer.files_exist_on_server() \
+                        and rand.random() < 0.3:
+                    for sim in (ref, inc):
+                        sim.transfer_ended(i)
+            if rand.random() < 0.02:
+                waiting = [i for i, job in enumerate(ref.jobs)
+                           if job.status == constants.NOT_SUBMITTED]
+                if waiting:
+                    i = rand.choice(waiting)
+                    for sim in (ref, inc):
+                        sim.kill(i)
+
+    def test_equivalence_on_examples(self):
+        for name, workflow in self.example_workflows():
+            if len(workflow.jobs) > 100:
+                seeds = [0]
+            else:
+                seeds = range(5)
+            for seed in seeds:
+                self.simulate(name, workflow, seed, failure_rate=0.)
+                self.simulate(name, workflow, seed, failure_rate=0.1)
+
+    def test_inspection_time(self):
+        # a wide workflow: inspecting it after a few jobs have ended should
+        # not depend on its size
+        njobs = 20000
+        width = 100
+        jobs = [Job(['true'], name='job%d' % i) for i in range(njobs)]
+        dependencies = [(jobs[i], jobs[i + width])
+                        for i in range(njobs - width)]
+        sim = SimulatedWorkflow(Workflow(jobs, dependencies))
+        # first inspection: the state is built
+        to_run = sim.find_out_jobs_to_process()[0]
+        self.assertEqual(len(to_run), width)
+        sim.submit(to_run)
+        sim.find_out_jobs_to_process()
+        job_mapping = CountingDict(sim.workflow.job_mapping)
+        sim.workflow.job_mapping = job_mapping
+        times = []
+        visits = []
+        for i in range(10):
+            sim.end(to_run[i], True)
+            job_mapping.count = 0
+            start = time.time()
+            new_to_run = sim.find_out_jobs_to_process()[0]
+            times.append(time.time() - start)
+            visits.append(job_mapping.count)
+            self.assertTrue(to_run[i] + width in new_to_run)
+        job_mapping.count = 0
+        start = time.time()
+        sim.find_out_jobs_to_process(nocache=True)
+        full_time = time.time() - start
+        print('\ninspection of a %d jobs workflow: incremental: %.3f ms, '
+              '%d jobs visited, full scan: %.3f ms, %d jobs visited'
+              % (njobs, min(times) * 1000, max(visits), full_time * 1000,
+                 job_mapping.count),
+              file=sys.stderr)
+        # only the running jobs and the ones depending on ended jobs are
+        # visited (timings are too noisy to be compared)
+        self.assertTrue(max(visits) <= 2 * width)
+        self.assertTrue(job_mapping.count >= njobs)
+
+    def test_abort_propagation(self):
+        # a failing root job with a 50000 edges fan-out: all the branch is
+        # aborted in one inspection
+        nchildren = 50000
+        root = Job(['false'], name='root')
+        children = [Job(['true'], name='child%d' % i)
+                    for i in range(nchildren)]
+        # an independent job, and a job depending on it and on a child
+        other = Job(['true'], name='other')
+        last = Job(['true'], name='last')
+        jobs = [root] + children + [other, last]
+        dependencies = [(root, child) for child in children] \
+            + [(other, last), (children[-1], last)]
+        for nocache in (False, True):
+            sim = SimulatedWorkflow(Workflow(jobs, dependencies))
+            to_run = sim.find_out_jobs_to_process(nocache)[0]
+            self.assertEqual(to_run, [0, nchildren + 1])
+            sim.submit(to_run)
+            sim.find_out_jobs_to_process(nocache)
+            sim.end(0, False)
+            start = time.time()
+            to_run, ended, status = sim.find_out_jobs_to_process(nocache)
+            duration = time.time() - start
+            print('\nabort of %d jobs (%s): %.3f s'
+                  % (nchildren + 1, 'full scan' if nocache else 'incremental',
+                     duration), file=sys.stderr)
+            self.assertEqual(to_run, [])
+            self.assertEqual(len(ended), nchildren + 1)
+            self.assertEqual(status, constants.WORKFLOW_IN_PROGRESS)
+            self.assertTrue(all(job.exit_status == constants.EXIT_NOTRUN
+                                for job in sim.jobs[1:nchildren + 1]))
+            self.assertEqual(sim.jobs[-1].exit_status, constants.EXIT_NOTRUN)
+            self.assertEqual(sim.jobs[-2].status, constants.SUBMISSION_PENDING)
+            self.assertTrue(duration < 10.)
+
+        # report of the cancelled jobs, on an unpickled workflow as the
+        # client gets it
+        workflow = pickle.loads(pickle.dumps(sim.workflow))
+        aborted_ids = [job.job_id for job in sim.jobs
+                       if job.exit_status == constants.EXIT_NOTRUN]
+        report = workflow.cancelled_jobs([sim.jobs[0].job_id], aborted_ids)
+        self.assertEqual(list(report.keys()), [sim.jobs[0].job_id])
+        self.assertEqual(sorted(report[sim.jobs[0].job_id]),
+                         sorted(aborted_ids))
+
+    def test_abort_report(self):
+        # two failures: each aborted job is reported once, for the first
+        # failed job it depends on
+        jobs = [Job(['true'], name='job%d' % i) for i in range(6)]
+        dependencies = [(jobs[0], jobs[2]), (jobs[1], jobs[2]),
+                        (jobs[1], jobs[3]), (jobs[2], jobs[4]),
+                        (jobs[3], jobs[4]), (jobs[3], jobs[5])]
+        sim = SimulatedWorkflow(Workflow(jobs, dependencies))
+        sim.submit(sim.find_out_jobs_to_process()[0])
+        sim.end(0, False)
+        sim.end(1, False)
+        sim.find_out_jobs_to_process()
+        aborted_ids = [job.job_id for job in sim.jobs[2:]]
+        self.assertTrue(all(job.exit_status == constants.EXIT_NOTRUN
+                            for job in sim.jobs[2:]))
+        report = sim.workflow.cancelled_jobs(
+            [sim.jobs[0].job_id, sim.jobs[1].job_id], aborted_ids)
+        self.assertEqual(report[sim.jobs[0].job_id],
+                         [sim.jobs[2].job_id, sim.jobs[4].job_id])
+        self.assertEqual(report[sim.jobs[1].job_id],
+                         [sim.jobs[3].job_id, sim.jobs[5].job_id])
+
+    def run_simulation(self, sim, failed):
+        '''
+        Run all the jobs of a simulated workflow, those in failed fail.
+        '''
+        while True:
+            to_run, ended, status = sim.find_out_jobs_to_process()
+            if status == constants.WORKFLOW_DONE:
+                break
+            sim.submit(to_run)
+            for i in to_run:
+                sim.end(i, i not in failed)
+        sim.workflow.status = status
+
+    def test_critical_path(self):
+        # a 4 jobs chain, and a fan of 2 jobs depending on a job
+        jobs = [Job(['true'], name='chain%d' % i) for i in range(4)] \
+            + [Job(['true'], name='fan%d' % i, duration_hint=2.)
+               for i in range(3)]
+        dependencies = [(jobs[i], jobs[i + 1]) for i in range(3)] \
+            + [(jobs[4], jobs[5]), (jobs[4], jobs[6])]
+        sim = SimulatedWorkflow(Workflow(jobs, dependencies))
+        # durations of the previous runs are used for jobs without hints,
+        # the others get the mean duration (2.25)
+        length = sim.workflow.set_critical_path_priorities(
+            {'chain0': 3., 'fan0': 100.})
+        self.assertEqual(length, 9.75)
+        self.assertEqual([job.critical_path for job in sim.jobs],
+                         [9.75, 6.75, 4.5, 2.25, 4., 2., 2.])
+
+        # a long pipeline submitted after many independent jobs, on 2
+        # processors: the pipeline is run first
+        ncpu = 2
+        jobs = [Job(['true'], name='job%d' % i) for i in range(60)] \
+            + [Job(['true'], name='pipeline%d' % i) for i in range(20)]
+        dependencies = [(jobs[i], jobs[i + 1]) for i in range(60, 79)]
+        makespans = []
+        for priorities in (False, True):
+            sim = SimulatedWorkflow(Workflow(jobs, dependencies))
+            if priorities:
+                sim.workflow.set_critical_path_priorities()
+            queue = PendingQueue()
+            step = 0
+            while True:
+                to_run, ended, status \
+                    = sim.workflow.find_out_jobs_to_process()
+                if status == constants.WORKFLOW_DONE:
+                    break
+                to_run = sorted(to_run, key=lambda job: sim.index[job])
+                queue.extend(to_run)
+                for job in to_run:
+                    job.status = constants.SUBMISSION_PENDING
+                # each job lasts one step
+                for i in range(min(ncpu, len(queue))):
+                    sim.end(sim.index[queue.pop()], True)
+                step += 1
+            makespans.append(step)
+        print('\nmakespan on %d processors: %d steps, with critical path '
+              'priorities: %d steps' % (ncpu, makespans[0], makespans[1]),
+              file=sys.stderr)
+        self.assertEqual(makespans, [50, 40])
+
+    def test_rerun_closure(self):
+        # 0 and 1 are killed, 2 depends on both, 3 on 2, 4 only on 1
+        jobs = [Job(['true'], name='job%d' % i) for i in range(5)]
+        dependencies = [(jobs[0], jobs[2]), (jobs[1], jobs[2]),
+                        (jobs[2], jobs[3]), (jobs[1], jobs[4])]
+        sim = SimulatedWorkflow(Workflow(jobs, dependencies))
+        self.run_simulation(sim, failed=(0, 1))
+        for job in sim.jobs[:2]:
+            job.status = constants.FAILED
+        ids = [job.job_id for job in sim.jobs]
+        self.assertEqual(sim.workflow.job_ids_which_can_rerun([ids[0]]),
+                         set([ids[0]]))
+        self.assertEqual(sim.workflow.job_ids_which_can_rerun([ids[1]]),
+                         set([ids[1], ids[4]]))
+        self.assertEqual(
+            sim.workflow.job_ids_which_can_rerun([ids[0], ids[1]]),
+            set(ids))
+
+    def test_restart_time(self):
+        # restart a 30000 jobs workflow after a failure in its middle
+        njobs = 30000
+        width = 100
+        jobs = [Job(['true'], name='job%d' % i) for i in range(njobs)]
+        dependencies = [(jobs[i], jobs[i + width])
+                        for i in range(njobs - width)]
+        sim = SimulatedWorkflow(Workflow(jobs, dependencies))
+        failed = njobs // 2
+        self.run_simulation(sim, failed=(failed, ))
+        # the failed job, and all the jobs below it, aborted
+        branch = list(range(failed, njobs, width))
+        self.assertEqual([i for i, job in enumerate(sim.jobs)
+                          if job.failed()], branch)
+        database_server = SimulatedDatabaseServer(sim)
+
+        start = time.time()
+        rerun_ids = sim.workflow.job_ids_which_can_rerun(
+            [sim.jobs[failed].job_id])
+        rerun_time = time.time() - start
+        self.assertEqual(rerun_ids,
+                         set([sim.jobs[i].job_id for i in branch]))
+
+        start = time.time()
+        to_run = sim.workflow.restart_jobs(database_server, rerun_ids,
+                                           check_deps=False)
+        restart_jobs_time = time.time() - start
+        self.assertEqual(to_run, set([sim.jobs[failed]]))
+
+        self.run_simulation(sim, failed=(failed, ))
+        start = time.time()
+        to_run, status = sim.workflow.restart(database_server, None)
+        restart_time = time.time() - start
+        self.assertEqual(to_run, [sim.jobs[failed]])
+        self.assertEqual(status, constants.WORKFLOW_IN_PROGRESS)
+
+        print('\n%d jobs workflow: rerun closure: %.3f s, restart_jobs: '
+              '%.3f s, restart: %.3f s'
+              % (njobs, rerun_time, restart_jobs_time, restart_time),
+              file=sys.stderr)
+        self.assertTrue(rerun_time + restart_jobs_time + restart_time < 5.)
+
+
+def test():
+    suite = unittest.TestLoader().loadTestsFromTestCase(EngineWorkflowTest)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == '__main__':
+    sys.exit(0 if test() else 1)
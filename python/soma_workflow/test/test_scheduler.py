@@ -0,0 +1,570 @@
+# -*- coding: utf-8 -*-
+'''
+Unit tests of the Scheduler API implementations, which do not need an
+actual DRMS.
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+
+import soma_workflow.constants as constants
+from soma_workflow.client import Job, BarrierJob
+from soma_workflow.configuration import LocalSchedulerCfg
+from soma_workflow.engine_types import EngineJob
+from soma_workflow.errors import DRMError
+from soma_workflow.scheduler import Scheduler
+from soma_workflow.utils import parse_resource_usage
+from soma_workflow.schedulers import local_scheduler
+from soma_workflow.schedulers.local_scheduler import LocalScheduler, \
+    ConfiguredLocalScheduler
+from soma_workflow.schedulers.pbspro_scheduler import PBSProScheduler
+
+
+class DummyScheduler(Scheduler):
+
+    def __init__(self, status):
+        super(DummyScheduler, self).__init__()
+        self.status = status
+        self.calls = 0
+
+    def get_job_status(self, scheduler_job_id):
+        self.calls += 1
+        if scheduler_job_id not in self.status:
+            raise DRMError('unknown job %s' % scheduler_job_id)
+        return self.status[scheduler_job_id]
+
+    def get_job_exit_info(self, scheduler_job_id):
+        return (constants.FINISHED_REGULARLY, 0, None, None)
+
+
+class FakeQstatPBSProScheduler(PBSProScheduler):
+
+    '''
+    PBSProScheduler which does not call PBS commands: qstat output is built
+    from a dict of jobs.
+    '''
+
+    def __init__(self, jobs):
+        # do not call PBSProScheduler.__init__, which needs PBS
+        Scheduler.__init__(self)
+        self.logger = logging.getLogger('test.pbspro_scheduler')
+        self._pbs_impl = 'pbspro'
+        self._extended_status_cache = {}
+        self.jobs = jobs
+        self.commands = []
+
+    def _qstat_output(self, cmd):
+        self.commands.append(cmd)
+        job_ids = cmd[5:]
+        return json.dumps({'Jobs': dict([(job_id, self.jobs[job_id])
+                                         for job_id in job_ids
+                                         if job_id in self.jobs])})
+
+
+class SimulatedProcess(object):
+
+    def __init__(self, pid, end_time):
+        self.pid = pid
+        self.end_time = end_time
+        self.returncode = None
+
+
+class SimulatedLocalScheduler(LocalScheduler):
+    '''
+    LocalScheduler running jobs in simulated time: each job lasts its
+    duration hint. It must be used while holding the scheduler lock, so that
+    the scheduler thread does not run.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(SimulatedLocalScheduler, self).__init__(*args, **kwargs)
+        self.clock = 0.
+        self.pids = 0
+        # number of queued jobs considered by _iterate()
+        self.considered_jobs = 0
+
+    def create_process(self, job):
+        self.pids += 1
+        # jobs without duration hint do not end
+        return SimulatedProcess(self.pids,
+                                self.clock
+                                + (job.duration_hint or float('inf')))
+
+    def _cpu_for_job(self, job):
+        self.considered_jobs += 1
+        return super(SimulatedLocalScheduler, self)._cpu_for_job(job)
+
+    def _watch_process(self, job_id, process):
+        self._polled_processes[job_id] = process
+
+    def _reap_process(self, process):
+        if self.clock < process.end_time:
+            return (False, None)
+        process.returncode = 0
+        return (True, None)
+
+    def _now(self):
+        return self.clock
+
+    def simulate(self, jobs):
+        '''
+        Run the jobs until the queue is empty.
+
+        Returns
+        -------
+        start_times: dict
+            scheduler job id -> start time
+        utilization: float
+            ratio of the used CPU time to the available CPU time
+        '''
+        for job in jobs:
+            self.job_submission(job)
+        start_times = {}
+        used = 0.
+        while True:
+            self._iterate()
+            for job_id in self._processes:
+                start_times.setdefault(job_id, self.clock)
+            if not self._processes:
+                break
+            next_end = min([process.end_time
+                            for process in self._processes.values()])
+            used += (next_end - self.clock) * self._allocated_cpus
+            self.clock = next_end
+        return start_times, used / (self.clock * self._proc_nb)
+
+
+class LockCheckingScheduler(LocalScheduler):
+
+    '''
+    Records whether the scheduler lock could be taken by another thread while
+    job processes are sampled.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.lock_was_free = []
+        super(LockCheckingScheduler, self).__init__(*args, **kwargs)
+
+    def _process_memory(self, pid):
+        def try_lock():
+            acquired = self._lock.acquire(False)
+            if acquired:
+                self._lock.release()
+            self.lock_was_free.append(acquired)
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        return super(LockCheckingScheduler, self)._process_memory(pid)
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_default_bulk_api(self):
+        sch = DummyScheduler({'1': constants.RUNNING, '2': constants.DONE})
+        status = sch.get_jobs_status(['1', '2', '3'])
+        self.assertEqual(status, {'1': constants.RUNNING,
+                                  '2': constants.DONE})
+        exit_info = sch.get_jobs_exit_info(['2'])
+        self.assertEqual(list(exit_info.keys()), ['2'])
+
+    def test_local_bulk_api(self):
+        sch = LocalScheduler(proc_nb=1, interval=0.1)
+        try:
+            with sch._lock:
+                sch._status.update({'1': constants.RUNNING,
+                                    '2': constants.DONE})
+                sch._exit_info['2'] = (constants.FINISHED_REGULARLY, 0, None,
+                                       None)
+            self.assertEqual(sch.get_jobs_status(['1', '2', '3']),
+                             {'1': constants.RUNNING, '2': constants.DONE})
+            self.assertEqual(sch.get_jobs_exit_info(['1', '2']),
+                             {'2': (constants.FINISHED_REGULARLY, 0, None,
+                                    None)})
+            # exit info is consumed
+            self.assertEqual(sch.get_jobs_exit_info(['2']), {})
+        finally:
+            sch.end_scheduler_thread()
+
+    def test_local_priorities(self):
+        sch = LocalScheduler(proc_nb=1, interval=0.1)
+        try:
+            jobs = []
+            for i, (priority, critical_path) in enumerate(
+                    [(0, 1.), (1, 0.), (0, 5.), (1, 2.)]):
+                job = EngineJob(Job(['true'], priority=priority), None)
+                job.job_id = i + 1
+                job.critical_path = critical_path
+                jobs.append(job)
+            # the scheduler loop must not run the jobs
+            with sch._lock:
+                drmaa_ids = [sch.job_submission(job) for job in jobs]
+                queue = sch.queued_jobs()
+                sch._queue = []
+            self.assertEqual(queue, [drmaa_ids[3], drmaa_ids[1],
+                                     drmaa_ids[2], drmaa_ids[0]])
+        finally:
+            sch.end_scheduler_thread()
+
+    def test_local_barrier_when_busy(self):
+        sch = LocalScheduler(proc_nb=1, interval=0.1, max_proc_nb=1)
+        try:
+            jobs = [EngineJob(Job(['sleep', '10']), None),
+                    EngineJob(Job(['sleep', '10']), None),
+                    EngineJob(BarrierJob(), None)]
+            for i, job in enumerate(jobs):
+                job.job_id = i + 1
+            with sch._lock:
+                drmaa_ids = [sch.job_submission(job) for job in jobs]
+                sch._iterate()
+                # the barrier needs no CPU: it does not wait for the running
+                # job, nor for the queued one
+                status = sch.get_jobs_status(drmaa_ids)
+                self.assertEqual(
+                    [status[drmaa_id] for drmaa_id in drmaa_ids],
+                    [constants.RUNNING, constants.QUEUED_ACTIVE,
+                     constants.DONE])
+                self.assertEqual(sch.queued_jobs(), [drmaa_ids[1]])
+                sch.kill_job(drmaa_ids[0])
+                sch.kill_job(drmaa_ids[1])
+        finally:
+            sch.end_scheduler_thread()
+
+    def test_local_resource_usage(self):
+        sch = LocalScheduler(proc_nb=1, interval=0.1)
+        try:
+            # allocates 100 MB, uses some CPU and lasts more than an interval
+            job = EngineJob(Job([sys.executable, '-c',
+                                 'import time; '
+                                 'x = bytearray(100 * 1024 * 1024); '
+                                 'sum(range(1000000)); time.sleep(0.3)']),
+                            None)
+            job.job_id = 1
+            drmaa_id = sch.job_submission(job)
+            start = time.time()
+            while sch.get_job_status(drmaa_id) != constants.DONE \
+                    and time.time() - start < 30:
+                time.sleep(0.05)
+            exit_info = sch.get_job_exit_info(drmaa_id)
+        finally:
+            sch.end_scheduler_thread()
+        self.assertEqual(exit_info[:2], (constants.FINISHED_REGULARLY, 0))
+        usage = parse_resource_usage(exit_info[3])
+        self.assertTrue(usage['walltime'] >= 0)
+        self.assertTrue(usage['end_time'] - usage['start_time'] >= 0.3)
+        if hasattr(os, 'wait4'):
+            self.assertTrue(usage['utime'] + usage['stime'] > 0)
+            self.assertTrue(usage['maxrss'] >= 100 * 1024 * 1024)
+            self.assertTrue(usage['mem'] >= usage['maxrss'])
+            self.assertTrue('cput' in usage)
+            self.assertTrue('cpupercent' in usage)
+
+    def test_local_memory_sampling(self):
+        if not local_scheduler.have_psutil:
+            self.skipTest('psutil is not available')
+        sch = LockCheckingScheduler(proc_nb=1, interval=0.1)
+        # iterations are run by the test
+        sch.end_scheduler_thread()
+        job = EngineJob(Job(['sleep', '10']), None)
+        job.job_id = 1
+        drmaa_id = sch.job_submission(job)
+        sch._iterate()
+        try:
+            sch._sample_memory()
+            # the lock was free while the process was sampled
+            self.assertEqual(sch.lock_was_free, [True])
+            self.assertTrue(sch._memory[drmaa_id] > 0)
+            self.assertEqual(sch._used_memory, sch._memory[drmaa_id])
+        finally:
+            sch.kill_job(drmaa_id)
+        self.assertEqual(sch._used_memory, 0)
+
+    def test_resource_usage_format(self):
+        self.assertEqual(local_scheduler.format_resource_usage(), '')
+        usage = parse_resource_usage(
+            local_scheduler.format_resource_usage(
+                start_time=10., end_time=3735.4, peak_memory=2 * 1024 ** 3))
+        self.assertEqual(usage, {'mem': 2 * 1024 ** 3,
+                                 'walltime': 3725.,
+                                 'start_time': 10.,
+                                 'end_time': 3735.4})
+
+    def test_local_memory_admission(self):
+        mb = 1024 * 1024
+        sch = LocalScheduler(proc_nb=4, interval=0.1, max_memory=1000)
+        try:
+            jobs = []
+            for i, memory in enumerate([600, 600, None, 2000]):
+                job = EngineJob(Job(['sleep', '10'],
+                                    memory_requirement=memory), None)
+                job.job_id = i + 1
+                jobs.append(job)
+            with sch._lock:
+                drmaa_ids = [sch.job_submission(job) for job in jobs]
+                sch._iterate()
+                status = sch.get_jobs_status(drmaa_ids)
+                self.assertEqual(
+                    [status[drmaa_id] for drmaa_id in drmaa_ids],
+                    [constants.RUNNING, constants.QUEUED_ACTIVE,
+                     constants.RUNNING, constants.QUEUED_ACTIVE])
+                # observed memory counts when it exceeds the requirement
+                self.assertEqual(sch._used_memory, 600 * mb)
+                self.assertTrue(sch._can_submit_new_job(1, 0))
+                sch._update_memory(drmaa_ids[2], 500 * mb)
+                self.assertFalse(sch._can_submit_new_job(1, 0))
+                sch._update_memory(drmaa_ids[0], 100 * mb)
+                sch._update_memory(drmaa_ids[2], 300 * mb)
+                self.assertEqual(sch._used_memory, 900 * mb)
+                self.assertEqual(sch._peak_memory[drmaa_ids[2]], 500 * mb)
+                self.assertTrue(sch._can_submit_new_job(1, 100 * mb))
+                self.assertFalse(sch._can_submit_new_job(1, 200 * mb))
+                sch.kill_job(drmaa_ids[0])
+                sch.kill_job(drmaa_ids[2])
+                sch._iterate()
+                # the job needing more than the limit runs alone
+                self.assertEqual(sch.get_job_status(drmaa_ids[1]),
+                                 constants.RUNNING)
+                self.assertEqual(sch.get_job_status(drmaa_ids[3]),
+                                 constants.QUEUED_ACTIVE)
+                sch.kill_job(drmaa_ids[1])
+                sch._iterate()
+                self.assertEqual(sch.get_job_status(drmaa_ids[3]),
+                                 constants.RUNNING)
+                self.assertEqual(sch._used_memory, 2000 * mb)
+                sch.kill_job(drmaa_ids[3])
+                self.assertEqual(sch._used_memory, 0)
+        finally:
+            sch.end_scheduler_thread()
+
+    def test_local_scheduler_config(self):
+        tmp_dir = tempfile.mkdtemp(prefix='swf_scheduler_')
+        try:
+            config_file = os.path.join(tmp_dir, 'scheduler.cfg')
+            config = LocalSchedulerCfg(proc_nb=2, interval=1, max_proc_nb=8,
+                                       max_memory=64000)
+            config.save_to_file(config_file)
+            config = LocalSchedulerCfg.load_from_file(config_file)
+            self.assertEqual(config.get_max_memory(), 64000)
+            self.assertEqual(config.get_max_proc_nb(), 8)
+            sch = ConfiguredLocalScheduler(config)
+            try:
+                self.assertEqual(sch._max_memory, 64000)
+                config.set_max_memory(32000)
+                self.assertEqual(sch._max_memory, 32000)
+            finally:
+                sch.end_scheduler_thread()
+            self.assertEqual(
+                LocalSchedulerCfg.load_from_file(
+                    config_file).get_max_memory(), 32000)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def local_throughput(self, njobs, proc_nb=4, interval=0.1):
+        '''
+        Run njobs very short jobs, returns the number of jobs run per second.
+        '''
+        sch = LocalScheduler(proc_nb=proc_nb, interval=interval)
+        try:
+            start = time.time()
+            drmaa_ids = []
+            for i in range(njobs):
+                job = EngineJob(Job(['true']), None)
+                job.job_id = i + 1
+                drmaa_ids.append(sch.job_submission(job))
+            while True:
+                status = sch.get_jobs_status(drmaa_ids)
+                if all([s == constants.DONE for s in status.values()]):
+                    break
+                time.sleep(0.01)
+            duration = time.time() - start
+            exit_info = sch.get_jobs_exit_info(drmaa_ids)
+            self.assertEqual(len(exit_info), njobs)
+            self.assertEqual(set([e[1] for e in exit_info.values()]), {0})
+        finally:
+            sch.end_scheduler_thread()
+        return njobs / duration
+
+    def simulate_local_scheduling(self, backfill):
+        sch = SimulatedLocalScheduler(proc_nb=8, interval=0.1,
+                                      max_proc_nb=8)
+        sch.backfill = backfill
+        try:
+            # (number of jobs, cpus, duration), by decreasing priority
+            workload = [(4, 1, 10.), (1, 8, 20.), (2, 2, 8.), (6, 1, 30.)]
+            jobs = []
+            for njobs, ncpu, duration in workload:
+                for i in range(njobs):
+                    job = EngineJob(
+                        Job(['true'], priority=100 - len(jobs),
+                            duration_hint=duration),
+                        None)
+                    job.job_id = len(jobs) + 1
+                    if ncpu != 1:
+                        job.parallel_job_info = {'nodes_number': 1,
+                                                 'cpu_per_node': ncpu}
+                    jobs.append(job)
+            with sch._lock:
+                start_times, utilization = sch.simulate(jobs)
+                self.assertEqual(sch.queued_jobs(), [])
+        finally:
+            sch.end_scheduler_thread()
+        self.assertEqual(len(start_times), len(jobs))
+        # start time of the wide job
+        return start_times['5'], utilization
+
+    def test_local_backfill(self):
+        wide_start, utilization = self.simulate_local_scheduling(True)
+        strict_wide_start, strict_utilization \
+            = self.simulate_local_scheduling(False)
+        print('\nlocal scheduler CPU utilization: backfill: %.1f %%, '
+              'priority order: %.1f %%'
+              % (utilization * 100, strict_utilization * 100),
+              file=sys.stderr)
+        # the wide job is not delayed by backfilled jobs
+        self.assertEqual(wide_start, 10.)
+        self.assertEqual(strict_wide_start, 10.)
+        self.assertTrue(utilization > strict_utilization)
+
+    def test_local_backfill_scan(self):
+        sch = SimulatedLocalScheduler(proc_nb=8, interval=0.1,
+                                      max_proc_nb=8)
+        try:
+            # 7 running jobs, a wide job waiting for them, and many
+            # single-CPU jobs: none can start without delaying the wide job
+            jobs = []
+            for i, ncpu in enumerate([1] * 7 + [8] + [1] * 1000):
+                job = EngineJob(Job(['true'], priority=2000 - i), None)
+                job.job_id = i + 1
+                job.parallel_job_info = {'nodes_number': 1,
+                                         'cpu_per_node': ncpu}
+                jobs.append(job)
+            with sch._lock:
+                for job in jobs:
+                    sch.job_submission(job)
+                sch._iterate()
+                self.assertEqual(sch.stats()['allocated_cpus'], 7)
+                sch.considered_jobs = 0
+                sch._iterate()
+                # only the wide job
+                self.assertEqual(sch.considered_jobs, 1)
+                # no CPU is free
+                sch._proc_nb = sch._max_proc_nb = 7
+                sch.considered_jobs = 0
+                sch._iterate()
+                self.assertEqual(sch.considered_jobs, 0)
+                self.assertEqual(len(sch.queued_jobs()), 1001)
+        finally:
+            sch.end_scheduler_thread()
+
+    def test_local_stats(self):
+        sch = SimulatedLocalScheduler(proc_nb=4, interval=0.1,
+                                      max_proc_nb=4)
+        try:
+            jobs = []
+            for i, (ncpu, duration) in enumerate([(2, 10.), (2, 10.),
+                                                  (1, 5.)]):
+                job = EngineJob(Job(['true'], priority=10 - i,
+                                    duration_hint=duration), None)
+                job.job_id = i + 1
+                job.parallel_job_info = {'nodes_number': 1,
+                                         'cpu_per_node': ncpu}
+                jobs.append(job)
+            with sch._lock:
+                for job in jobs:
+                    sch.job_submission(job)
+                self.assertEqual(sch.stats()['oldest_wait'], 0.)
+                sch._iterate()
+                sch.clock = 4.
+                self.assertEqual(sch.stats(),
+                                 {'allocated_cpus': 4,
+                                  'max_cpus': 4,
+                                  'running_jobs': 2,
+                                  'queued_jobs': 1,
+                                  'oldest_wait': 4.,
+                                  'dispatched_jobs': 2,
+                                  'dispatch_latency': 0.,
+                                  'max_dispatch_latency': 0.})
+                sch.clock = 10.
+                sch._iterate()
+                stats = sch.stats()
+                self.assertEqual(stats['allocated_cpus'], 1)
+                self.assertEqual(stats['running_jobs'], 1)
+                self.assertEqual(stats['queued_jobs'], 0)
+                self.assertEqual(stats['oldest_wait'], None)
+                self.assertEqual(stats['dispatched_jobs'], 3)
+                self.assertAlmostEqual(stats['dispatch_latency'], 10. / 3)
+                self.assertEqual(stats['max_dispatch_latency'], 10.)
+                sch.clock = 15.
+                sch._iterate()
+                self.assertEqual(sch.stats()['allocated_cpus'], 0)
+        finally:
+            sch.end_scheduler_thread()
+        self.assertEqual(DummyScheduler({}).stats(), None)
+
+    def test_local_throughput(self):
+        rate = self.local_throughput(2000)
+        # processes ends polled every interval
+        have_pidfd = local_scheduler.have_pidfd
+        local_scheduler.have_pidfd = False
+        try:
+            polled_rate = self.local_throughput(200)
+        finally:
+            local_scheduler.have_pidfd = have_pidfd
+        print('\nlocal scheduler throughput: %.0f jobs/s, with polling: '
+              '%.0f jobs/s' % (rate, polled_rate), file=sys.stderr)
+        if have_pidfd:
+            self.assertTrue(rate > polled_rate)
+
+    def test_pbspro_bulk_api(self):
+        jobs = {
+            '1.pbs': {'job_state': 'R'},
+            '2.pbs': {'job_state': 'Q'},
+            '3.pbs': {'job_state': 'F', 'Exit_status': 0,
+                      'Output_Path': 'host:/tmp/out',
+                      'resources_used': {'ncpus': 1}},
+            '4.pbs': {'job_state': 'F', 'Exit_status': 1,
+                      'Output_Path': 'host:/tmp/out'},
+        }
+        sch = FakeQstatPBSProScheduler(jobs)
+        sch.max_qstat_jobs = 3
+        job_ids = ['1.pbs', '2.pbs', '3.pbs', '4.pbs', '5.pbs',
+                   sch.FAKE_JOB]
+        status = sch.get_jobs_status(job_ids)
+        # 5 real jobs, 3 per qstat command
+        self.assertEqual(len(sch.commands), 2)
+        self.assertEqual(status, {'1.pbs': constants.RUNNING,
+                                  '2.pbs': constants.QUEUED_ACTIVE,
+                                  '3.pbs': constants.DONE,
+                                  '4.pbs': constants.FAILED,
+                                  sch.FAKE_JOB: constants.DONE})
+        exit_info = sch.get_jobs_exit_info(['3.pbs', '4.pbs', sch.FAKE_JOB])
+        # the qstat output has been reused
+        self.assertEqual(len(sch.commands), 2)
+        self.assertEqual(exit_info['3.pbs'][:2],
+                         (constants.FINISHED_REGULARLY, 0))
+        self.assertEqual(exit_info['4.pbs'][:2],
+                         (constants.FINISHED_REGULARLY, 1))
+        self.assertEqual(exit_info[sch.FAKE_JOB][0],
+                         constants.FINISHED_REGULARLY)
+        # not in the cache any longer: qstat is run again
+        exit_info = sch.get_jobs_exit_info(['3.pbs'])
+        self.assertEqual(len(sch.commands), 3)
+        self.assertEqual(list(exit_info.keys()), ['3.pbs'])
+
+
+def test():
+    suite = unittest.TestLoader().loadTestsFromTestCase(SchedulerTest)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+
+
+if __name__ == '__main__':
+    sys.exit(0 if test() else 1)
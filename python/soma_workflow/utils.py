@@ -240,6 +240,12 @@ def explore(root_job,
                         workflow)
 
 
+# types which to_json() and from_json() leave unchanged
+_json_scalar_types = frozenset(six.string_types + six.integer_types
+                               + (six.text_type, bytes, float, bool,
+                                  type(None)))
+
+
 def to_json(value):
     '''
     Convert value to an object which will mark some types through JSON
@@ -249,19 +255,26 @@ def to_json(value):
 
     "Decding" can be done using :func:`from_json`
     '''
+    # scalars are tested inline: most values are, and this function is used
+    # on large structures (workflows stored in the database)
+    scalars = _json_scalar_types
+    if type(value) in scalars:
+        return value
     if isinstance(value, tuple):
-        value = ['<tuple>'] + [to_json(x) for x in value]
+        return ['<tuple>'] + [x if type(x) in scalars else to_json(x)
+                              for x in value]
     if isinstance(value, set):
-        value = ['<set>'] + [to_json(x) for x in value]
-    elif isinstance(value, list):
-        value = [to_json(x) for x in value]
-    elif hasattr(value, 'items'):
+        return ['<set>'] + [x if type(x) in scalars else to_json(x)
+                            for x in value]
+    if isinstance(value, list):
+        return [x if type(x) in scalars else to_json(x) for x in value]
+    if hasattr(value, 'items'):
         new_value = {}
         for key, item in six.iteritems(value):
-            new_value[key] = to_json(item)
-        value = new_value
-    elif value is Undefined:
-        value = ['<undefined>']
+            new_value[key] = item if type(item) in scalars else to_json(item)
+        return new_value
+    if value is Undefined:
+        return ['<undefined>']
     return value
 
 
@@ -272,10 +285,14 @@ def from_json(value):
     Convert value from an object which matches JSON serialization, containing
     "code" for some types. Typically, tuples, sets, Undefined, etc.
     '''
+    scalars = _json_scalar_types
+    if type(value) in scalars:
+        return value
     if hasattr(value, 'items'):
         new_value = type(value)()
         for key, item in six.iteritems(value):
-            new_value[key] = from_json(item)
+            new_value[key] = item if type(item) in scalars \
+                else from_json(item)
         return new_value
     if not isinstance(value, list):
         return value
@@ -283,9 +300,114 @@ def from_json(value):
         return value
     code = value[0]
     if code == '<tuple>':
-        return tuple([from_json(x) for x in value[1:]])
+        return tuple([x if type(x) in scalars else from_json(x)
+                      for x in value[1:]])
     elif code == '<undefined>':
         return Undefined
     elif code == '<set>':
-        return set([from_json(x) for x in value[1:]])
-    return [from_json(x) for x in value]
+        return set([x if type(x) in scalars else from_json(x)
+                    for x in value[1:]])
+    return [x if type(x) in scalars else from_json(x) for x in value]
+
+
+_json_dict_tags = {'<tuple>': tuple, '<set>': set,
+                   '<undefined>': lambda item: Undefined}
+
+
+def to_json_dicts(value):
+    '''
+    Like :func:`to_json`, but tuples, sets and Undefined are marked using
+    single-key dicts (``{'<tuple>': [...]}``, ``{'<set>': [...]}``,
+    ``{'<undefined>': 0}``), which can be decoded by ``json.loads()`` while
+    parsing, using :func:`from_json_dict` as ``object_hook``. This is much
+    faster than :func:`from_json` on large structures.
+    '''
+    scalars = _json_scalar_types
+    if type(value) in scalars:
+        return value
+    if isinstance(value, tuple):
+        return {'<tuple>': [x if type(x) in scalars else to_json_dicts(x)
+                            for x in value]}
+    if isinstance(value, set):
+        return {'<set>': [x if type(x) in scalars else to_json_dicts(x)
+                          for x in value]}
+    if isinstance(value, list):
+        return [x if type(x) in scalars else to_json_dicts(x) for x in value]
+    if hasattr(value, 'items'):
+        new_value = {}
+        for key, item in six.iteritems(value):
+            new_value[key] = item if type(item) in scalars \
+                else to_json_dicts(item)
+        return new_value
+    if value is Undefined:
+        return {'<undefined>': 0}
+    return value
+
+
+def from_json_dict(value):
+    '''
+    ``object_hook`` for ``json.loads()`` decoding the output of
+    :func:`to_json_dicts`.
+    '''
+    if len(value) != 1:
+        return value
+    key = next(iter(value))
+    tag = _json_dict_tags.get(key)
+    if tag is None:
+        return value
+    return tag(value[key])
+
+
+# units of memory values in jobs resource usage strings
+_memory_units = {'b': 1, 'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3,
+                 'tb': 1024 ** 4, 'w': 8, 'kw': 8 * 1024, 'mw': 8 * 1024 ** 2,
+                 'gw': 8 * 1024 ** 3}
+
+
+def parse_resource_usage(resource_usage):
+    '''
+    Parse a job resource usage string, as found in jobs exit info
+    (``b'cpupercent=60 mem=13530kb cput=00:00:12'`` etc, see
+    :meth:`soma_workflow.scheduler.Scheduler.get_job_exit_info`).
+
+    Durations (``HH:MM:SS``) are converted to seconds, memory sizes
+    (``13530kb``) to bytes, other numbers to int or float. Other values are
+    left as strings.
+
+    Parameters
+    ----------
+    resource_usage: str or bytes or None
+
+    Returns
+    -------
+    usage: dict
+    '''
+    usage = {}
+    if not resource_usage:
+        return usage
+    if isinstance(resource_usage, bytes):
+        resource_usage = resource_usage.decode()
+    for item in resource_usage.split():
+        name, sep, value = item.partition('=')
+        if not sep:
+            continue
+        number = value.replace(',', '.')
+        lvalue = number.lower()
+        try:
+            if ':' in value:
+                seconds = 0.
+                for part in value.split(':'):
+                    seconds = seconds * 60 + float(part)
+                usage[name] = seconds
+                continue
+            digits = lvalue.rstrip('kmgtbw')
+            unit = lvalue[len(digits):]
+            if unit in _memory_units:
+                usage[name] = int(float(digits) * _memory_units[unit])
+            elif '.' in number:
+                usage[name] = float(number)
+            else:
+                usage[name] = int(number)
+        except ValueError:
+            usage[name] = value
+    return usage